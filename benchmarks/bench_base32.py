@@ -0,0 +1,44 @@
+"""Nix base32 encode/decode microbenchmark.
+
+    python -m benchmarks.bench_base32 [-n N]
+
+Times the table-driven encode()/decode() and the batch APIs against the
+per-character reference implementation, on 20-byte store path hashes
+and 32-byte SHA-256 digests.
+"""
+
+import argparse
+import os
+import time
+
+from pix.base32 import decode, decode_many, decode_reference, encode, encode_many, encode_reference
+
+
+def _rate(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - t0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200_000, help="values per case")
+    args = parser.parse_args()
+
+    for size in (20, 32):
+        data = [os.urandom(size) for _ in range(args.n)]
+        text = encode_many(data)
+        cases = [
+            ("encode_reference", lambda: [encode_reference(d) for d in data]),
+            ("encode", lambda: [encode(d) for d in data]),
+            ("encode_many", lambda: encode_many(data)),
+            ("decode_reference", lambda: [decode_reference(s) for s in text]),
+            ("decode", lambda: [decode(s) for s in text]),
+            ("decode_many", lambda: decode_many(text)),
+        ]
+        for label, fn in cases:
+            print(f"{size:>2} bytes  {label:<17} {_rate(fn, args.n) / 1e6:6.2f} M/s")
+
+
+if __name__ == "__main__":
+    main()
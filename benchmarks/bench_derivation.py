@@ -0,0 +1,48 @@
+"""ATerm .drv parsing throughput.
+
+    python -m benchmarks.bench_derivation [-r ROUNDS]
+
+Parses every derivation generated by the bootstrap stages (Stage0 through
+StageXgcc) with the per-character reference scanner, with parse() on
+str, with parse() on the raw UTF-8 bytes, and with parse_lazy() reading
+only input_drvs, as a graph walk does.
+"""
+
+import argparse
+import time
+
+from pix.derivation import parse, parse_lazy, parse_reference, serialize
+from pixpkgs.bootstrap import all_bootstrap_packages
+
+
+def bootstrap_drv_texts() -> dict[str, str]:
+    """drv path -> ATerm text for every derivation in the bootstrap chain."""
+    return {path: serialize(pkg.drv) for path, pkg in all_bootstrap_packages().items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rounds", type=int, default=50, help="passes over the bootstrap derivations")
+    args = parser.parse_args()
+
+    texts = list(bootstrap_drv_texts().values())
+    blobs = [t.encode() for t in texts]
+    total = sum(len(b) for b in blobs) * args.rounds
+    print(f"{len(texts)} derivations, {sum(len(b) for b in blobs) / 1024:.0f} KiB, {args.rounds} rounds")
+
+    cases = [
+        ("parse_reference", lambda: [parse_reference(t) for t in texts]),
+        ("parse(str)", lambda: [parse(t) for t in texts]),
+        ("parse(bytes)", lambda: [parse(b) for b in blobs]),
+        ("parse_lazy", lambda: [parse_lazy(t).input_drvs for t in texts]),
+    ]
+    for label, fn in cases:
+        t0 = time.perf_counter()
+        for _ in range(args.rounds):
+            fn()
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<16} {elapsed:7.3f} s  {total / elapsed / 1e6:7.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Memory held by a parsed derivation closure.
+
+    python -m benchmarks.bench_derivation_memory [-n COPIES]
+
+Parses COPIES copies of every bootstrap derivation (58 each, so the
+default 50 copies hold 2900 derivations) and reports the bytes
+tracemalloc attributes to them, for:
+
+  - dict layout: the same data in plain dataclasses with a __dict__,
+    as Derivation was before it used __slots__;
+  - parse():     slotted Derivation / DerivationOutput;
+  - intern=True: slotted, short strings interned;
+  - freeze():    interned, then frozen (tuples and mapping proxies).
+
+Each copy is parsed from its own text, so without interning every copy
+owns its own strings, as separately parsed .drv files do.
+"""
+
+import argparse
+import gc
+import tracemalloc
+from dataclasses import dataclass
+
+from benchmarks.bench_derivation import bootstrap_drv_texts
+from pix.derivation import parse
+
+
+@dataclass
+class _DictOutput:
+    path: str
+    hash_algo: str
+    hash_value: str
+
+
+@dataclass
+class _DictDerivation:
+    outputs: dict
+    input_drvs: dict
+    input_srcs: list
+    platform: str
+    builder: str
+    args: list
+    env: dict
+
+
+def _dict_layout(text: str) -> _DictDerivation:
+    d = parse(text)
+    return _DictDerivation(
+        {k: _DictOutput(o.path, o.hash_algo, o.hash_value) for k, o in d.outputs.items()},
+        d.input_drvs, d.input_srcs, d.platform, d.builder, d.args, d.env,
+    )
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    held = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--copies", type=int, default=50, help="copies of the bootstrap closure")
+    args = parser.parse_args()
+
+    # Copies of the text are distinct str objects, so each parse starts
+    # from separate memory, as reading separate files would.
+    closure = list(bootstrap_drv_texts().values())
+    texts = [t.encode().decode() for _ in range(args.copies) for t in closure]
+    text_size = _measure(lambda: [t.encode().decode() for t in texts])
+    print(f"{len(texts)} derivations ({text_size / 2**20:.1f} MiB of ATerm text)")
+
+    cases = [
+        ("dict layout", lambda: [_dict_layout(t) for t in texts]),
+        ("parse()", lambda: [parse(t) for t in texts]),
+        ("intern=True", lambda: [parse(t, intern=True) for t in texts]),
+        ("freeze()", lambda: [parse(t, intern=True).freeze() for t in texts]),
+    ]
+    base = None
+    for label, build in cases:
+        size = _measure(build)
+        base = base or size
+        print(f"{label:<12} {size / 2**20:8.1f} MiB  {size / len(texts) / 1024:6.1f} KiB/drv  {size / base:5.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""NAR hashing throughput.
+
+    python -m benchmarks.bench_nar [--size-mb N]
+
+Builds a temporary tree with one large file and a directory of small
+files, then reports MB/s for the streaming nar_hash() against hashing
+the fully materialized nar_serialize() output.
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from pix.nar import nar_hash, nar_serialize
+
+
+def _throughput(fn, path: Path, nbytes: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - t0)
+    return nbytes / best / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256, help="size of the large file")
+    parser.add_argument("--small-files", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        big = Path(d, "big.bin")
+        with open(big, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+
+        small = Path(d, "small")
+        small.mkdir()
+        for i in range(args.small_files):
+            Path(small, f"f{i:06d}").write_bytes(os.urandom(1 + i % 4096))
+        small_bytes = sum(p.stat().st_size for p in small.iterdir())
+
+        cases = [
+            ("large file", big, big.stat().st_size),
+            (f"{args.small_files} small files", small, small_bytes),
+        ]
+        for label, path, nbytes in cases:
+            streamed = _throughput(nar_hash, path, nbytes, args.repeat)
+            joined = _throughput(
+                lambda p: hashlib.sha256(nar_serialize(p)).digest(), path, nbytes, args.repeat,
+            )
+            print(f"{label:>24}: nar_hash {streamed:8.1f} MB/s   sha256(nar_serialize) {joined:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
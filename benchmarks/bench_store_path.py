@@ -0,0 +1,47 @@
+"""Store path hashing throughput.
+
+    python -m benchmarks.bench_store_path [-n N]
+
+Computes the <hash> part of N store paths three ways: the unfused
+sha256 -> byte-wise XOR fold -> per-character base32 pipeline,
+store_path_digest(), and the batched make_store_paths().
+"""
+
+import argparse
+import hashlib
+import time
+
+from pix.base32 import encode_reference
+from pix.store_path import make_store_paths, store_path_digest
+
+
+def _bytewise_digest(fingerprint: bytes) -> str:
+    digest = hashlib.sha256(fingerprint).digest()
+    folded = bytearray(20)
+    for i, b in enumerate(digest):
+        folded[i % 20] ^= b
+    return encode_reference(bytes(folded))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1_000_000, help="number of fingerprints")
+    args = parser.parse_args()
+
+    items = [("source", hashlib.sha256(i.to_bytes(8, "little")).digest(), f"pkg-{i}") for i in range(args.n)]
+    fingerprints = [f"{t}:sha256:{h.hex()}:/nix/store:{name}".encode() for t, h, name in items]
+
+    cases = [
+        ("byte-wise pipeline", lambda: [_bytewise_digest(fp) for fp in fingerprints]),
+        ("store_path_digest", lambda: [store_path_digest(fp) for fp in fingerprints]),
+        ("make_store_paths", lambda: make_store_paths(items)),
+    ]
+    for label, fn in cases:
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<20} {elapsed:7.2f} s  {args.n / elapsed / 1e6:5.2f} M/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""Daemon log and activity events, the activity tree, and a progress line.
+
+Between a request and its reply the daemon streams stderr messages (see
+pix.daemon): log lines, and the start, stop and results of activities,
+which are nested units of work (a build, a download, a path copy) with
+ids and parent ids. A DaemonConnection with an event sink turns each
+message into one of the events below:
+
+    LogLine(time, text)                                   STDERR_NEXT
+    ActivityStart(time, id, level, type, text, fields, parent)
+    ActivityStop(time, id)
+    ActivityResult(time, id, type, fields)                STDERR_RESULT
+
+time is time.monotonic() when the message was read. A sink is any
+callable taking an event; ActivityTree, ProgressRenderer and BuildReport
+are sinks, and tee() combines several.
+
+See: nix/src/libutil/logging.hh — ActivityType, ResultType
+"""
+
+import json
+import re
+import sys
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from typing import TextIO
+
+# ActivityType
+ACT_UNKNOWN = 0
+ACT_COPY_PATH = 100
+ACT_FILE_TRANSFER = 101
+ACT_REALISE = 102
+ACT_COPY_PATHS = 103
+ACT_BUILDS = 104
+ACT_BUILD = 105
+ACT_OPTIMISE_STORE = 106
+ACT_VERIFY_PATHS = 107
+ACT_SUBSTITUTE = 108
+ACT_QUERY_PATH_INFO = 109
+ACT_POST_BUILD_HOOK = 110
+ACT_BUILD_WAITING = 111
+ACT_FETCH_TREE = 112
+
+# ResultType
+RES_FILE_LINKED = 100
+RES_BUILD_LOG_LINE = 101
+RES_UNTRUSTED_PATH = 102
+RES_CORRUPTED_PATH = 103
+RES_SET_PHASE = 104
+RES_PROGRESS = 105  # fields: done, expected, running, failed
+RES_SET_EXPECTED = 106  # fields: activity type, expected
+RES_POST_BUILD_LOG_LINE = 107
+RES_FETCH_STATUS = 108
+
+
+@dataclass(frozen=True, slots=True)
+class LogLine:
+    time: float
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class ActivityStart:
+    time: float
+    id: int
+    level: int
+    type: int
+    text: str
+    fields: tuple
+    parent: int  # 0 for a top-level activity
+
+
+@dataclass(frozen=True, slots=True)
+class ActivityStop:
+    time: float
+    id: int
+
+
+@dataclass(frozen=True, slots=True)
+class ActivityResult:
+    time: float
+    id: int
+    type: int
+    fields: tuple
+
+
+Event = LogLine | ActivityStart | ActivityStop | ActivityResult
+
+
+def as_sink(sink) -> Callable[[Event], None] | None:
+    """A callable for a sink given as a callable or a queue.
+
+    Queues (queue.Queue, asyncio.Queue, anything with put_nowait) are
+    fed without blocking.
+    """
+    if sink is None or callable(sink):
+        return sink
+    if hasattr(sink, "put_nowait"):
+        return sink.put_nowait
+    raise TypeError(f"event sink must be callable or a queue, not {type(sink).__name__}")
+
+
+def tee(*sinks) -> Callable[[Event], None] | None:
+    """One sink that passes each event to every given sink.
+
+    None sinks are skipped; with none left the result is None, so that
+    a connection given it builds no events at all.
+    """
+    targets = [as_sink(s) for s in sinks if s is not None]
+    if not targets:
+        return None
+    if len(targets) == 1:
+        return targets[0]
+
+    def send(event: Event) -> None:
+        for target in targets:
+            target(event)
+
+    return send
+
+
+@dataclass(slots=True)
+class Activity:
+    """One node of an ActivityTree."""
+
+    id: int
+    type: int
+    text: str
+    fields: tuple
+    parent: int
+    start: float
+    stop: float | None = None
+    children: list[int] = field(default_factory=list)
+    phase: str = ""  # last RES_SET_PHASE (builds)
+    done: int = 0  # last RES_PROGRESS
+    expected: int = 0
+    running: int = 0
+    failed: int = 0
+    results: list[ActivityResult] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.stop is None else self.stop - self.start
+
+
+class ActivityTree:
+    """Activities nested by parent id, built from events as they arrive.
+
+    Use it as an event sink. Results other than progress, phase and log
+    lines are kept on their activity (results); log lines are not kept.
+    An activity whose parent is unknown (0, or started before the sink
+    was attached) is a root.
+    """
+
+    def __init__(self):
+        self.activities: dict[int, Activity] = {}
+        self.roots: list[int] = []
+
+    def __call__(self, event: Event) -> None:
+        if isinstance(event, ActivityStart):
+            act = Activity(event.id, event.type, event.text, event.fields, event.parent, event.time)
+            self.activities[event.id] = act
+            parent = self.activities.get(event.parent)
+            if parent is None:
+                self.roots.append(event.id)
+            else:
+                parent.children.append(event.id)
+        elif isinstance(event, ActivityStop):
+            act = self.activities.get(event.id)
+            if act is not None:
+                act.stop = event.time
+        elif isinstance(event, ActivityResult):
+            act = self.activities.get(event.id)
+            if act is None:
+                return
+            if event.type == RES_PROGRESS:
+                act.done, act.expected, act.running, act.failed = event.fields[:4]
+            elif event.type == RES_SET_PHASE:
+                act.phase = event.fields[0]
+            elif event.type not in (RES_BUILD_LOG_LINE, RES_POST_BUILD_LOG_LINE):
+                act.results.append(event)
+
+    def walk(self, ids: list[int] | None = None, depth: int = 0) -> Iterator[tuple[int, Activity]]:
+        """(depth, activity) for every activity, parents before children."""
+        stack = [(depth, i) for i in reversed(self.roots if ids is None else ids)]
+        while stack:
+            d, i = stack.pop()
+            act = self.activities[i]
+            yield d, act
+            stack.extend((d + 1, c) for c in reversed(act.children))
+
+    def running(self, type: int | None = None) -> list[Activity]:
+        """Activities not yet stopped, optionally of one type, oldest first."""
+        return [a for a in self.activities.values() if a.stop is None and (type is None or a.type == type)]
+
+    def of_type(self, type: int) -> list[Activity]:
+        return [a for a in self.activities.values() if a.type == type]
+
+
+def _store_name(path: str) -> str:
+    """hello-2.12.2 for /nix/store/<hash>-hello-2.12.2.drv."""
+    base = path.rsplit("/", 1)[-1]
+    base = base.split("-", 1)[1] if "-" in base else base
+    return base.removesuffix(".drv")
+
+
+def describe(act: Activity) -> str:
+    """A short human label for an activity."""
+    if act.type == ACT_BUILD and act.fields:
+        label = f"building {_store_name(act.fields[0])}"
+        return f"{label} ({act.phase})" if act.phase else label
+    if act.type == ACT_SUBSTITUTE and act.fields:
+        return f"fetching {_store_name(act.fields[0])}"
+    if act.type == ACT_COPY_PATH and act.fields:
+        return f"copying {_store_name(act.fields[0])}"
+    if act.type == ACT_FILE_TRANSFER and act.fields:
+        return f"downloading {act.fields[0]}"
+    return act.text
+
+
+class ProgressRenderer:
+    """A status line for a running build, with the daemon's log above it.
+
+    An event sink. Log lines (STDERR_NEXT and build log results) are
+    printed as they come. On a terminal a single status line, rewritten
+    at most every interval seconds, shows counts of finished and running
+    builds and downloads and what the newest build is doing:
+
+        [1/3 built, 1 fetching] building hello-2.12.2 (configurePhase)
+
+    Elsewhere (a pipe, a CI log) there is no line to rewrite, so each
+    build or download is announced once when it starts instead.
+    """
+
+    def __init__(self, stream: TextIO | None = None, interval: float = 0.1, tty: bool | None = None):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.tty = self.stream.isatty() if tty is None else tty
+        self.tree = ActivityTree()
+        self._shown = ""
+        self._last = 0.0
+
+    def __call__(self, event: Event) -> None:
+        self.tree(event)
+        if isinstance(event, LogLine):
+            self._print(event.text)
+        elif isinstance(event, ActivityResult):
+            if event.type in (RES_BUILD_LOG_LINE, RES_POST_BUILD_LOG_LINE) and event.fields:
+                self._print(event.fields[0])
+        elif isinstance(event, ActivityStart) and not self.tty:
+            if event.type in (ACT_BUILD, ACT_SUBSTITUTE, ACT_COPY_PATH):
+                self._print(describe(self.tree.activities[event.id]))
+        if self.tty and event.time - self._last >= self.interval:
+            self._last = event.time
+            self._status(self.status())
+
+    def status(self) -> str:
+        """The current status line."""
+        builds = self.tree.of_type(ACT_BUILD)
+        done = sum(1 for b in builds if b.stop is not None)
+        parts = [f"{done}/{len(builds)} built"] if builds else []
+        fetching = len(self.tree.running(ACT_SUBSTITUTE)) + len(self.tree.running(ACT_FILE_TRANSFER))
+        if fetching:
+            parts.append(f"{fetching} fetching")
+        running = self.tree.running(ACT_BUILD)
+        line = f"[{', '.join(parts)}]" if parts else ""
+        if running:
+            line += " " + describe(running[-1])
+        return line.strip()
+
+    def _print(self, text: str) -> None:
+        if self.tty and self._shown:
+            self.stream.write("\r\x1b[K")
+        self.stream.write(text.rstrip("\n") + "\n")
+        if self.tty and self._shown:
+            self.stream.write(self._shown)
+        self.stream.flush()
+
+    def _status(self, line: str) -> None:
+        if line == self._shown:
+            return
+        self.stream.write("\r\x1b[K" + line)
+        self.stream.flush()
+        self._shown = line
+
+    def finish(self) -> None:
+        """Clear the status line."""
+        if self.tty and self._shown:
+            self.stream.write("\r\x1b[K")
+            self.stream.flush()
+            self._shown = ""
+
+
+# --- Telemetry ---
+#
+# Numbers rather than logs: how long each derivation took to build, how
+# long it waited before starting, where inside the build the time went
+# (phases), and how many bytes were downloaded and copied.
+
+
+@dataclass(slots=True)
+class BuildTiming:
+    drv: str
+    started_after: float  # seconds from the start of the report to the build starting
+    duration: float | None  # None if it never finished (failed or cut short)
+    phases: dict[str, float] = field(default_factory=dict)  # phase -> seconds
+    log_lines: int = 0
+    queue_seconds: float = 0.0  # waiting for a build slot, user or lock (BuildWaiting)
+
+
+class BuildReport:
+    """Per-build telemetry, aggregated from activity events.
+
+    An event sink. Create it right before the build request, since build
+    start times are measured from then, and call finish() once it returns.
+    A build's started_after is not its queue time: in a chain it also
+    includes every upstream build, which the events do not link to it.
+    queue_seconds is: the time the daemon reported waiting to start it
+    (BuildWaiting activities naming the .drv, for a free build slot,
+    build user or remote machine).
+    Report with to_dict(), to_json() or to_prometheus().
+
+        report = BuildReport()
+        with conn.events(report):
+            conn.build_paths(paths)
+        report.finish()
+        print(report.to_prometheus())
+    """
+
+    def __init__(self):
+        self.tree = ActivityTree()
+        self.start = time.monotonic()
+        self.started_at = time.time()  # wall clock, for the JSON report
+        self.end: float | None = None
+        self._phase: dict[int, tuple[str, float]] = {}  # build id -> (phase, since)
+        self._phases: dict[int, dict[str, float]] = {}
+        self._log_lines: dict[int, int] = {}
+
+    def __call__(self, event: Event) -> None:
+        self.tree(event)
+        self.end = event.time
+        if isinstance(event, ActivityResult):
+            if event.type == RES_SET_PHASE and event.id in self.tree.activities:
+                self._close_phase(event.id, event.time)
+                self._phase[event.id] = (event.fields[0], event.time)
+            elif event.type == RES_BUILD_LOG_LINE:
+                self._log_lines[event.id] = self._log_lines.get(event.id, 0) + 1
+        elif isinstance(event, ActivityStop):
+            self._close_phase(event.id, event.time)
+
+    def finish(self) -> None:
+        """Mark the end of the request (otherwise its last event is)."""
+        self.end = time.monotonic()
+
+    def _close_phase(self, act_id: int, now: float) -> None:
+        current = self._phase.pop(act_id, None)
+        if current is not None:
+            phase, since = current
+            phases = self._phases.setdefault(act_id, {})
+            phases[phase] = phases.get(phase, 0.0) + now - since
+
+    def _waits(self) -> dict[str, float]:
+        """drv path -> seconds in BuildWaiting activities that name it."""
+        waits: dict[str, float] = {}
+        for a in self.tree.of_type(ACT_BUILD_WAITING):
+            drv = _waiting_drv(a)
+            if drv is None:
+                continue  # e.g. "waiting for lock on <outputs>"
+            stop = a.stop if a.stop is not None else self.end if self.end is not None else a.start
+            waits[drv] = waits.get(drv, 0.0) + stop - a.start
+        return waits
+
+    def builds(self) -> list[BuildTiming]:
+        waits = self._waits()
+        builds = []
+        for a in self.tree.of_type(ACT_BUILD):
+            drv = a.fields[0] if a.fields else a.text
+            builds.append(BuildTiming(
+                drv=drv,
+                started_after=a.start - self.start,
+                duration=a.duration,
+                phases=dict(self._phases.get(a.id, {})),
+                log_lines=self._log_lines.get(a.id, 0),
+                queue_seconds=waits.get(drv, 0.0),
+            ))
+        return builds
+
+    def _transferred(self, act_type: int) -> tuple[int, int]:
+        """(count, bytes) over activities of a type, from their last progress."""
+        acts = self.tree.of_type(act_type)
+        return len(acts), sum(a.done for a in acts)
+
+    def to_dict(self) -> dict:
+        downloads, downloaded = self._transferred(ACT_FILE_TRANSFER)
+        copies, copied = self._transferred(ACT_COPY_PATH)
+        end = self.end if self.end is not None else self.start
+        return {
+            "started_at": self.started_at,
+            "duration": end - self.start,
+            "builds": [
+                {
+                    "drv": b.drv,
+                    "started_after": b.started_after,
+                    "queue_seconds": b.queue_seconds,
+                    "duration": b.duration,
+                    "phases": b.phases,
+                    "log_lines": b.log_lines,
+                }
+                for b in self.builds()
+            ],
+            "substitutions": len(self.tree.of_type(ACT_SUBSTITUTE)),
+            "downloads": {"count": downloads, "bytes": downloaded},
+            "copies": {"count": copies, "bytes": copied},
+        }
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "pix_build") -> str:
+        """The report in the Prometheus text exposition format."""
+        d = self.to_dict()
+        out: list[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: list[tuple[dict, float]]) -> None:
+            out.append(f"# HELP {prefix}_{name} {help}")
+            out.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_prom_escape(v)}"' for k, v in labels.items())
+                out.append(f"{prefix}_{name}{{{label_text}}} {_prom_value(value)}" if labels else f"{prefix}_{name} {_prom_value(value)}")
+
+        builds = d["builds"]
+        metric("duration_seconds", "gauge", "Wall time of the whole build request.", [({}, d["duration"])])
+        metric("derivations", "gauge", "Derivations built (started) by the request.", [({}, len(builds))])
+        metric("derivation_duration_seconds", "gauge", "Time to build each derivation.",
+               [({"drv": b["drv"]}, b["duration"]) for b in builds if b["duration"] is not None])
+        metric("derivation_queue_seconds", "gauge", "Time each derivation waited for a build slot, user or machine.",
+               [({"drv": b["drv"]}, b["queue_seconds"]) for b in builds])
+        metric("derivation_started_after_seconds", "gauge", "Time from the request until each derivation started building.",
+               [({"drv": b["drv"]}, b["started_after"]) for b in builds])
+        metric("phase_duration_seconds", "gauge", "Time spent in each phase of each derivation's build.",
+               [({"drv": b["drv"], "phase": p}, t) for b in builds for p, t in b["phases"].items()])
+        metric("unfinished_derivations", "gauge", "Derivations that started but did not finish.",
+               [({}, sum(1 for b in builds if b["duration"] is None))])
+        metric("substitutions", "gauge", "Paths substituted from binary caches.", [({}, d["substitutions"])])
+        metric("downloaded_bytes", "gauge", "Bytes downloaded by file transfers.", [({}, d["downloads"]["bytes"])])
+        metric("copied_bytes", "gauge", "Bytes of store paths copied.", [({}, d["copies"]["bytes"])])
+        return "\n".join(out) + "\n"
+
+
+_DRV_PATH = re.compile(r"/[^\s'\"]*/[0-9a-z]{32}-[^\s'\"]*\.drv")
+
+
+def _waiting_drv(act: Activity) -> str | None:
+    """The .drv a BuildWaiting activity is about: a field, or named in its text."""
+    for f in act.fields:
+        if isinstance(f, str) and f.endswith(".drv"):
+            return f
+    m = _DRV_PATH.search(act.text)
+    return m.group(0) if m else None
+
+
+def _prom_value(value: float) -> str:
+    """A sample value, exactly: ints in full, floats round-tripping."""
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _prom_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
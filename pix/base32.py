@@ -18,11 +18,111 @@ Output length: ceil(n*8/5) characters for n input bytes.
   32 bytes (SHA-256 digest)  → 52 chars
 """
 
+import re
+
 CHARS = "0123456789abcdfghijklmnpqrsvwxyz"
 _DECODE_MAP = {c: i for i, c in enumerate(CHARS)}
 
 
+# --- Fast path ---
+#
+# Read as a number, the input is little-endian: byte 0 is the lowest.
+# Output character i holds bits 5i..5i+4 of that number, and the highest
+# i comes first — so a Nix base32 string is just that number written in
+# base 32, most significant digit first, zero-padded to ceil(n*8/5) digits.
+#
+# So instead of locating each 5-bit group byte by byte:
+#   encode: convert once with int.from_bytes, then shift out 10 bits at a
+#           time and look up both digits in a 1024-entry table.
+#   decode: translate Nix's alphabet into the digits int() accepts for
+#           base 32 (0-9a-v) and parse the whole string in C.
+
+_PAIRS = [CHARS[i >> 5] + CHARS[i & 0x1F] for i in range(1024)]
+_TO_INT_DIGITS = str.maketrans(CHARS, "0123456789abcdefghijklmnopqrstuv")
+_VALID = re.compile(f"[{CHARS}]*")
+
+
 def encode(data: bytes) -> str:
+    """Encode bytes to Nix base32. Same result as encode_reference()."""
+    return encode_int(int.from_bytes(data, "little"), (len(data) * 8 + 4) // 5)
+
+
+def encode_int(n: int, out_len: int) -> str:
+    """The out_len lowest base-32 digits of n, most significant first.
+
+    encode(data) is encode_int() of data read as a little-endian integer;
+    callers that already hold that integer skip the bytes.
+    """
+    # With an odd digit count the first pair starts one digit above the
+    # top — always a zero digit, sliced off below.
+    top = 5 * (out_len + (out_len & 1) - 2)
+    s = "".join([_PAIRS[(n >> shift) & 0x3FF] for shift in range(top, -1, -10)])
+    return s[1:] if out_len & 1 else s
+
+
+def decode(s: str) -> bytes:
+    """Decode a Nix base32 string to bytes. Same result as decode_reference()."""
+    if not _VALID.fullmatch(s):
+        bad = next(ch for ch in s if ch not in _DECODE_MAP)
+        raise ValueError(f"invalid nix base32 character: {bad!r}")
+    out_len = len(s) * 5 // 8
+    if not s:
+        return b""
+    # Bits above out_len*8 don't fit in the output; the reference drops them too.
+    n = int(s.translate(_TO_INT_DIGITS), 32) & ((1 << (out_len * 8)) - 1)
+    return n.to_bytes(out_len, "little")
+
+
+def encode_many(items: list[bytes]) -> list[str]:
+    """encode() over many inputs (e.g. every store path hash in a store).
+
+    The shift schedule depends only on the input length, so it is worked
+    out once per length rather than once per item.
+    """
+    pairs = _PAIRS
+    plans: dict[int, tuple[range, int]] = {}
+    out = []
+    for data in items:
+        plan = plans.get(len(data))
+        if plan is None:
+            out_len = (len(data) * 8 + 4) // 5
+            top = 5 * (out_len + (out_len & 1) - 2)
+            plan = plans[len(data)] = (range(top, -1, -10), out_len & 1)
+        shifts, odd = plan
+        n = int.from_bytes(data, "little")
+        s = "".join([pairs[(n >> shift) & 0x3FF] for shift in shifts])
+        out.append(s[1:] if odd else s)
+    return out
+
+
+def decode_many(items: list[str]) -> list[bytes]:
+    """decode() over many inputs.
+
+    The batch is validated with one regex match and translated with one
+    str.translate call; only int() and to_bytes() remain per item.
+    """
+    joined = "".join(items)
+    if not _VALID.fullmatch(joined):
+        for s in items:
+            decode(s)  # raises for the first bad item
+    digits = joined.translate(_TO_INT_DIGITS)
+    out = []
+    pos = 0
+    for s in items:
+        out_len = len(s) * 5 // 8
+        n = int(digits[pos:pos + len(s)], 32) if s else 0
+        out.append((n & ((1 << (out_len * 8)) - 1)).to_bytes(out_len, "little"))
+        pos += len(s)
+    return out
+
+
+# --- Reference implementation ---
+#
+# The direct transcription of printHash32() / parseHash32(): one character
+# per iteration. Slower, but it shows exactly which bits go where, and the
+# tests check the fast path against it.
+
+def encode_reference(data: bytes) -> str:
     """Encode bytes to Nix base32.
 
     Iterates from the highest 5-bit position down to 0. At each position i,
@@ -44,7 +144,7 @@ def encode(data: bytes) -> str:
     return "".join(result)
 
 
-def decode(s: str) -> bytes:
+def decode_reference(s: str) -> bytes:
     """Decode Nix base32 string to bytes. Reverses the encode process."""
     out_len = len(s) * 5 // 8
     result = bytearray(out_len)
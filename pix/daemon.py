@@ -11,13 +11,36 @@ The protocol is simple:
   - Each request/response has a stderr log stream in between that must
     be fully drained before reading the response
 
+Framing is buffered in both directions. Writes accumulate in a
+bytearray that is sent with one sendall() when the client next waits for
+the daemon, so a request is one syscall however many fields it has.
+Reads recv_into() a preallocated buffer and fields are unpacked from it
+in place, so a response of thousands of strings takes a few recv calls.
+
+Request encoding (_Framing) and reply decoding (the _read_* functions)
+do no I/O of their own, so pix.daemon_async reuses them unchanged.
+
 See: nix/src/libstore/daemon.cc, nix/src/libstore/remote-store.cc
 """
 
+import base64
+import hashlib
 import os
+import select
 import socket
 import struct
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+from pix import activity, base32
+from pix.nar import CHUNK_SIZE, _source, nar_stream
+from pix.store_path import make_source_store_path
 
 # Handshake magic numbers — ASCII "nixc" and "dxio"
 WORKER_MAGIC_1 = 0x6E697863  # client sends this
@@ -33,6 +56,8 @@ WOP_BUILD_PATHS = 9
 WOP_QUERY_PATH_INFO = 26
 WOP_QUERY_VALID_PATHS = 31
 WOP_ADD_TO_STORE_NAR = 39
+WOP_QUERY_DERIVATION_OUTPUT_MAP = 41
+WOP_ADD_MULTIPLE_TO_STORE = 44
 
 # Between each request/response, the daemon sends a stream of stderr
 # messages. Each starts with one of these uint64 type codes.
@@ -46,6 +71,16 @@ STDERR_START_ACTIVITY = 0x53545254  # progress reporting
 STDERR_STOP_ACTIVITY = 0x53544F50
 STDERR_RESULT = 0x52534C54
 
+_U64 = struct.Struct("<Q")
+_PADDING = bytes(8)
+
+DEFAULT_SOCKET = "/nix/var/nix/daemon-socket/socket"
+
+# Receive buffer size, and the size above which a payload skips the
+# write buffer and is sent directly (after flushing what precedes it).
+RECV_BUFFER_SIZE = 64 * 1024
+SEND_DIRECT_SIZE = 64 * 1024
+
 
 @dataclass
 class PathInfo:
@@ -55,19 +90,345 @@ class PathInfo:
     registration_time: int
     nar_size: int
     sigs: list[str]
+    path: str = ""
+    ultimate: bool = False
+    ca: str = ""
+
+
+@dataclass
+class Closure:
+    """The result of DaemonConnection.compute_closure()."""
+
+    infos: dict[str, PathInfo]  # every path of the closure, in BFS order
+
+    @property
+    def paths(self) -> list[str]:
+        return sorted(self.infos)
+
+    @property
+    def nar_size(self) -> int:
+        """Total NAR size: roughly what copying the closure transfers, uncompressed."""
+        return sum(info.nar_size for info in self.infos.values())
+
+    def __len__(self) -> int:
+        return len(self.infos)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.infos
 
 
 class NixDaemonError(Exception):
     pass
 
 
-class DaemonConnection:
-    """Low-level connection to the Nix daemon."""
+class _EventSource:
+    """The optional event sink of a connection (see pix.activity).
+
+    With no sink, stderr messages are decoded (they must be read off the
+    wire regardless) and dropped: no event objects, no clock reads.
+    """
+
+    _emit: Callable[[activity.Event], None] | None = None
+
+    @property
+    def event_sink(self):
+        return self._emit
+
+    @event_sink.setter
+    def event_sink(self, sink) -> None:
+        """A callable taking events, or a queue to put them on, or None."""
+        self._emit = activity.as_sink(sink)
+
+    @contextmanager
+    def events(self, sink):
+        """Send events to sink for the duration of a with block."""
+        previous = self._emit
+        self.event_sink = sink
+        try:
+            yield self
+        finally:
+            self._emit = previous
+
+
+def _event(msg_type: int, payload: tuple) -> activity.Event:
+    t = time.monotonic()
+    if msg_type == STDERR_NEXT:
+        return activity.LogLine(t, payload[0])
+    if msg_type == STDERR_START_ACTIVITY:
+        act_id, level, act_type, text, fields, parent = payload
+        return activity.ActivityStart(t, act_id, level, act_type, text, tuple(fields), parent)
+    if msg_type == STDERR_STOP_ACTIVITY:
+        return activity.ActivityStop(t, payload[0])
+    act_id, result_type, fields = payload
+    return activity.ActivityResult(t, act_id, result_type, tuple(fields))
+
+
+class _Framing(_EventSource):
+    """Request encoding, shared by the blocking and asyncio clients.
+
+    The _send_* methods append to a write buffer; the connection decides
+    when to put it on the wire. The _request_* methods encode one
+    operation each.
+    """
+
+    def __init__(self) -> None:
+        self._wbuf = bytearray()
+
+    def _send_uint64(self, n: int) -> None:
+        self._wbuf += _U64.pack(n)
+
+    def _send_bytes(self, data: bytes) -> None:
+        self._wbuf += _U64.pack(len(data))
+        self._wbuf += data
+        self._wbuf += _PADDING[:-len(data) % 8]
+
+    def _send_string(self, s: str) -> None:
+        self._send_bytes(s.encode())
+
+    def _send_string_list(self, lst: list[str]) -> None:
+        self._send_uint64(len(lst))
+        for s in lst:
+            self._send_string(s)
+
+    def _send_bool(self, b: bool) -> None:
+        self._send_uint64(1 if b else 0)
+
+    def _send_client_hello(self) -> None:
+        """What the client sends once it knows the daemon's version."""
+        # Send our protocol version
+        self._send_uint64(PROTOCOL_VERSION)
+
+        # Since protocol >= 1.14, we can send CPU affinity (0 = no override)
+        self._send_uint64(0)
+
+        # Since protocol >= 1.11, send reserve-space flag
+        self._send_bool(False)
+
+    # --- Requests ---
+
+    def _request_is_valid_path(self, path: str) -> None:
+        self._send_uint64(WOP_IS_VALID_PATH)
+        self._send_string(path)
+
+    def _request_query_valid_paths(self, paths: list[str], substitute: bool = False) -> None:
+        self._send_uint64(WOP_QUERY_VALID_PATHS)
+        self._send_string_list(paths)
+        self._send_bool(substitute)
+
+    def _request_query_path_info(self, path: str) -> None:
+        self._send_uint64(WOP_QUERY_PATH_INFO)
+        self._send_string(path)
+
+    def _request_query_derivation_output_map(self, drv_path: str) -> None:
+        self._send_uint64(WOP_QUERY_DERIVATION_OUTPUT_MAP)
+        self._send_string(drv_path)
+
+    def _request_add_text_to_store(self, name: str, content: str, references: list[str] | None = None) -> None:
+        self._send_uint64(WOP_ADD_TEXT_TO_STORE)
+        self._send_string(name)
+        self._send_string(content)
+        self._send_string_list(references or [])
+
+    def _request_build_paths(self, paths: list[str], build_mode: int = 0) -> None:
+        self._send_uint64(WOP_BUILD_PATHS)
+
+        # Since protocol >= 1.30, paths are sent as DerivedPath serialization
+        # For simplicity, send as string list (opaque paths or drv!out)
+        self._send_string_list(paths)
+
+        self._send_uint64(build_mode)  # bmNormal=0
+
+    def _request_add_to_store_nar(self, info: PathInfo, repair: bool = False, dont_check_sigs: bool = False) -> None:
+        # The NAR itself follows as frames (see _send_frame), since 1.23.
+        self._send_uint64(WOP_ADD_TO_STORE_NAR)
+        self._send_path_info(info)
+        self._send_bool(repair)
+        self._send_bool(dont_check_sigs)
+
+    def _request_add_multiple_to_store(self, repair: bool = False, dont_check_sigs: bool = False) -> None:
+        # Followed by one framed stream holding every path (see
+        # DaemonConnection.add_multiple_to_store).
+        self._send_uint64(WOP_ADD_MULTIPLE_TO_STORE)
+        self._send_bool(repair)
+        self._send_bool(dont_check_sigs)
+
+    def _send_path_info(self, info: PathInfo) -> None:
+        """A ValidPathInfo: the store path, then its metadata."""
+        self._send_string(info.path)
+        self._send_string(info.deriver)
+        self._send_string(info.nar_hash)
+        self._send_string_list(info.references)
+        self._send_uint64(info.registration_time)
+        self._send_uint64(info.nar_size)
+        self._send_bool(info.ultimate)
+        self._send_string_list(info.sigs)
+        self._send_string(info.ca)
+
+    def _send_frame(self, data: bytes) -> None:
+        """One frame of a framed stream: uint64 length + data, no padding.
+
+        A zero-length frame ends the stream.
+        """
+        self._wbuf += _U64.pack(len(data))
+        self._wbuf += data
+
+
+# --- Replies ---
+#
+# Decoders for stderr messages and replies. *r* is anything with the
+# _recv_* methods: a DaemonConnection reading its socket, or
+# pix.daemon_async's parser over bytes already received.
+
+def _read_server_hello(r, daemon_version: int) -> None:
+    """What the daemon sends after the client's version."""
+    # Since protocol >= 1.33, daemon sends its nix version string
+    if daemon_version >= (1 << 8 | 33):
+        r._recv_string()  # daemon nix version (e.g. "2.28.5")
+
+    # Since protocol >= 1.35, daemon sends trusted status
+    if daemon_version >= (1 << 8 | 35):
+        r._recv_uint64()  # trusted (0=unknown, 1=trusted, 2=not trusted)
+
+
+def _read_fields(r) -> list:
+    n = r._recv_uint64()
+    fields = []
+    for _ in range(n):
+        field_type = r._recv_uint64()
+        if field_type == 0:
+            fields.append(r._recv_uint64())
+        elif field_type == 1:
+            fields.append(r._recv_string())
+        else:
+            raise NixDaemonError(f"unknown field type: {field_type}")
+    return fields
+
+
+def _read_stderr_message(r) -> tuple[int, tuple | NixDaemonError]:
+    """Read one stderr message: (type, payload).
+
+    STDERR_ERROR's payload is the NixDaemonError for the caller to raise;
+    the others are tuples of the message's fields.
+    """
+    msg_type = r._recv_uint64()
+    if msg_type == STDERR_LAST:
+        return msg_type, ()
+    elif msg_type == STDERR_ERROR:
+        error_type = r._recv_string()
+        _level = r._recv_uint64()
+        _name = r._recv_string()
+        msg = r._recv_string()
+        # traces
+        n_traces = r._recv_uint64()
+        for _ in range(n_traces):
+            _trace_pos = r._recv_uint64()
+            _trace_msg = r._recv_string()
+        return msg_type, NixDaemonError(f"{error_type}: {msg}")
+    elif msg_type == STDERR_NEXT:
+        return msg_type, (r._recv_string(),)
+    elif msg_type == STDERR_START_ACTIVITY:
+        act_id = r._recv_uint64()
+        level = r._recv_uint64()
+        act_type = r._recv_uint64()
+        text = r._recv_string()
+        fields = _read_fields(r)
+        parent = r._recv_uint64()
+        return msg_type, (act_id, level, act_type, text, fields, parent)
+    elif msg_type == STDERR_STOP_ACTIVITY:
+        return msg_type, (r._recv_uint64(),)
+    elif msg_type == STDERR_RESULT:
+        act_id = r._recv_uint64()
+        result_type = r._recv_uint64()
+        return msg_type, (act_id, result_type, _read_fields(r))
+    else:
+        raise NixDaemonError(f"unexpected stderr message type: {msg_type:#x}")
+
+
+def _read_bool(r) -> bool:
+    return r._recv_bool()
+
+
+def _read_uint64(r) -> int:
+    return r._recv_uint64()
+
+
+def _read_string(r) -> str:
+    return r._recv_string()
+
+
+def _read_path_set(r) -> set[str]:
+    return set(r._recv_string_list())
+
+
+def _read_path_info(r, path: str) -> PathInfo | NixDaemonError:
+    """Read a QueryPathInfo reply; an invalid path is returned as an error.
+
+    The reply is complete either way, so the connection stays usable.
+    """
+    valid = r._recv_bool()
+    if not valid:
+        return NixDaemonError(f"path not valid: {path}")
+
+    deriver = r._recv_string()
+    nar_hash = r._recv_string()
+    references = r._recv_string_list()
+    registration_time = r._recv_uint64()
+    nar_size = r._recv_uint64()
+
+    # ultimate flag (since 1.16)
+    ultimate = r._recv_bool()
+    sigs = r._recv_string_list()
+    # content-address (since 1.25-ish)
+    ca = r._recv_string()
+
+    return PathInfo(
+        deriver=deriver,
+        nar_hash=nar_hash,
+        references=references,
+        registration_time=registration_time,
+        nar_size=nar_size,
+        sigs=sigs,
+        path=path,
+        ultimate=ultimate,
+        ca=ca,
+    )
+
+
+def _read_output_map(r) -> dict[str, str | None]:
+    """Output name -> output path, or None where the daemon does not know it yet (CA derivations)."""
+    n = r._recv_uint64()
+    outputs = {}
+    for _ in range(n):
+        name = r._recv_string()
+        outputs[name] = r._recv_string() or None
+    return outputs
+
+
+def _path_info(info: PathInfo | NixDaemonError) -> PathInfo:
+    if isinstance(info, NixDaemonError):
+        raise info
+    return info
+
+
+class DaemonConnection(_Framing):
+    """Low-level connection to the Nix daemon.
+
+    broken is set once a reply could not be read to its end (the daemon
+    reported STDERR_ERROR, the socket failed, or an exception interrupted
+    the read): the stream position is then unknown and the connection
+    must not be reused.
+    """
 
     def __init__(self, socket_path: str | None = None):
-        self.socket_path = socket_path or "/nix/var/nix/daemon-socket/socket"
+        super().__init__()
+        self.socket_path = socket_path or DEFAULT_SOCKET
         self.sock: socket.socket | None = None
         self.daemon_version: int = 0
+        self.broken = False
+        self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
+        self._rpos = 0  # next unread byte in _rbuf
+        self._rend = 0  # end of received data in _rbuf
 
     def connect(self) -> None:
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -78,6 +439,8 @@ class DaemonConnection:
         if self.sock:
             self.sock.close()
             self.sock = None
+        self._wbuf.clear()
+        self._rpos = self._rend = 0
 
     def __enter__(self):
         self.connect()
@@ -88,54 +451,90 @@ class DaemonConnection:
 
     # --- Wire format ---
 
-    def _send_uint64(self, n: int) -> None:
-        self.sock.sendall(struct.pack("<Q", n))
+    def _flush(self) -> None:
+        """Send everything buffered by the _send_* methods."""
+        if self._wbuf:
+            self.sock.sendall(self._wbuf)
+            self._wbuf.clear()
+
+    def _fill(self, n: int) -> None:
+        """Make at least n unread bytes available in the receive buffer.
+
+        Flushes pending writes first: the daemon answers only once it has
+        the whole request.
+        """
+        if self._rend - self._rpos >= n:
+            return
+        self._flush()
+        # Move the unread tail to the front to make room (n never exceeds
+        # the buffer: _recv_exact reads larger payloads separately).
+        unread = self._rend - self._rpos
+        if self._rpos:
+            self._rbuf[:unread] = self._rbuf[self._rpos:self._rend]
+        self._rpos, self._rend = 0, unread
+        while self._rend < n:
+            got = self.sock.recv_into(self._rview[self._rend:])
+            if not got:
+                raise ConnectionError("daemon closed connection")
+            self._rend += got
 
     def _recv_uint64(self) -> int:
-        data = self._recv_exact(8)
-        return struct.unpack("<Q", data)[0]
+        self._fill(8)
+        (n,) = _U64.unpack_from(self._rbuf, self._rpos)
+        self._rpos += 8
+        return n
 
     def _send_bytes(self, data: bytes) -> None:
-        self._send_uint64(len(data))
+        if len(data) < SEND_DIRECT_SIZE:
+            return super()._send_bytes(data)
+        # Large payload: don't copy it into the buffer.
+        self._wbuf += _U64.pack(len(data))
+        self._flush()
+        self.sock.sendall(data)
+        self._wbuf += _PADDING[:-len(data) % 8]
+
+    def _send_frame(self, data: bytes) -> None:
+        if len(data) < SEND_DIRECT_SIZE:
+            return super()._send_frame(data)
+        self._wbuf += _U64.pack(len(data))
+        self._flush()
         self.sock.sendall(data)
-        pad = (8 - len(data) % 8) % 8
-        if pad:
-            self.sock.sendall(b"\0" * pad)
 
     def _recv_bytes(self) -> bytes:
         length = self._recv_uint64()
         data = self._recv_exact(length)
-        pad = (8 - length % 8) % 8
+        pad = -length % 8
         if pad:
             self._recv_exact(pad)
         return data
 
-    def _send_string(self, s: str) -> None:
-        self._send_bytes(s.encode())
-
     def _recv_string(self) -> str:
         return self._recv_bytes().decode()
 
-    def _send_string_list(self, lst: list[str]) -> None:
-        self._send_uint64(len(lst))
-        for s in lst:
-            self._send_string(s)
-
     def _recv_string_list(self) -> list[str]:
         n = self._recv_uint64()
         return [self._recv_string() for _ in range(n)]
 
     def _recv_exact(self, n: int) -> bytes:
-        buf = bytearray()
-        while len(buf) < n:
-            chunk = self.sock.recv(n - len(buf))
-            if not chunk:
-                raise ConnectionError("daemon closed connection")
-            buf.extend(chunk)
-        return bytes(buf)
-
-    def _send_bool(self, b: bool) -> None:
-        self._send_uint64(1 if b else 0)
+        if n > RECV_BUFFER_SIZE and self._rend - self._rpos < n:
+            # Large payload: receive straight into its own buffer instead
+            # of growing the shared one.
+            out = bytearray(n)
+            have = self._rend - self._rpos
+            out[:have] = self._rview[self._rpos:self._rend]
+            self._rpos = self._rend = 0
+            self._flush()
+            view = memoryview(out)
+            while have < n:
+                got = self.sock.recv_into(view[have:])
+                if not got:
+                    raise ConnectionError("daemon closed connection")
+                have += got
+            return bytes(out)
+        self._fill(n)
+        data = bytes(self._rview[self._rpos:self._rpos + n])
+        self._rpos += n
+        return data
 
     def _recv_bool(self) -> bool:
         return self._recv_uint64() != 0
@@ -149,138 +548,611 @@ class DaemonConnection:
             raise NixDaemonError(f"bad daemon magic: {magic:#x}")
 
         self.daemon_version = self._recv_uint64()
+        self._send_client_hello()
+        _read_server_hello(self, self.daemon_version)
 
-        # Send our protocol version
-        self._send_uint64(PROTOCOL_VERSION)
+        # Drain startup messages
+        self._drain_stderr()
 
-        # Since protocol >= 1.14, we can send CPU affinity (0 = no override)
-        self._send_uint64(0)
+    # --- Stderr draining ---
 
-        # Since protocol >= 1.11, send reserve-space flag
-        self._send_bool(False)
+    def _drain_stderr(self) -> None:
+        """Read daemon stderr messages until STDERR_LAST, passing them to the event sink."""
+        while not self._stderr_message():
+            pass
 
-        # Since protocol >= 1.33, daemon sends its nix version string
-        if self.daemon_version >= (1 << 8 | 33):
-            self._recv_string()  # daemon nix version (e.g. "2.28.5")
+    def _stderr_message(self) -> bool:
+        """Read one stderr message; True if it was STDERR_LAST."""
+        msg_type, payload = _read_stderr_message(self)
+        if msg_type == STDERR_LAST:
+            return True
+        if msg_type == STDERR_ERROR:
+            raise payload
+        if self._emit is not None:
+            self._emit(_event(msg_type, payload))
+        return False
 
-        # Since protocol >= 1.35, daemon sends trusted status
-        if self.daemon_version >= (1 << 8 | 35):
-            self._recv_uint64()  # trusted (0=unknown, 1=trusted, 2=not trusted)
+    def _poll_stderr(self) -> None:
+        """Read the stderr messages that have already arrived, without waiting.
 
-        # Drain startup messages
-        self._drain_stderr()
+        While we stream a NAR the daemon can log, or fail, before the
+        request is complete. Nix reads stderr on a second thread then;
+        reading whatever is pending between frames does the same job:
+        the daemon never blocks on a full socket, and an error stops the
+        upload instead of surfacing only at the end.
+        """
+        while self._rend > self._rpos or select.select([self.sock], [], [], 0)[0]:
+            if self._stderr_message():
+                raise NixDaemonError("daemon ended the request before the NAR was sent")
 
-    # --- Stderr draining ---
+    def _response(self, decode: Callable, *args):
+        """Drain stderr, then decode the reply."""
+        try:
+            self._drain_stderr()
+            return decode(self, *args)
+        except BaseException:
+            # After STDERR_ERROR the daemon closes the connection; after
+            # anything else we no longer know where the next reply starts.
+            self.broken = True
+            raise
 
-    def _drain_stderr(self) -> None:
-        """Read and discard daemon stderr log messages until STDERR_LAST."""
-        while True:
-            msg_type = self._recv_uint64()
-            if msg_type == STDERR_LAST:
-                return
-            elif msg_type == STDERR_ERROR:
-                error_type = self._recv_string()
-                _level = self._recv_uint64()
-                _name = self._recv_string()
-                msg = self._recv_string()
-                # traces
-                n_traces = self._recv_uint64()
-                for _ in range(n_traces):
-                    _trace_pos = self._recv_uint64()
-                    _trace_msg = self._recv_string()
-                raise NixDaemonError(f"{error_type}: {msg}")
-            elif msg_type == STDERR_NEXT:
-                _log = self._recv_string()
-            elif msg_type == STDERR_START_ACTIVITY:
-                _act_id = self._recv_uint64()
-                _level = self._recv_uint64()
-                _type = self._recv_uint64()
-                _text = self._recv_string()
-                _fields = self._recv_fields()
-                _parent = self._recv_uint64()
-            elif msg_type == STDERR_STOP_ACTIVITY:
-                _act_id = self._recv_uint64()
-            elif msg_type == STDERR_RESULT:
-                _act_id = self._recv_uint64()
-                _type = self._recv_uint64()
-                _fields = self._recv_fields()
-            else:
-                raise NixDaemonError(f"unexpected stderr message type: {msg_type:#x}")
-
-    def _recv_fields(self) -> list:
-        n = self._recv_uint64()
-        fields = []
-        for _ in range(n):
-            field_type = self._recv_uint64()
-            if field_type == 0:
-                fields.append(self._recv_uint64())
-            elif field_type == 1:
-                fields.append(self._recv_string())
-            else:
-                raise NixDaemonError(f"unknown field type: {field_type}")
-        return fields
+    def healthy(self) -> bool:
+        """Whether the connection can serve another request.
+
+        Cheap enough to call on every pool checkout: besides the broken
+        flag and buffered leftovers, polls the socket without blocking.
+        An idle connection has nothing to read, so readability means the
+        daemon hung up or sent something we never asked for.
+        """
+        if self.broken or self.sock is None or self._wbuf or self._rend > self._rpos:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
 
     # --- Operations ---
+    #
+    # Each operation is a _request_* (buffered) followed by _response()
+    # with the matching _read_* decoder. Batch pipelines the same pairs.
 
     def is_valid_path(self, path: str) -> bool:
-        self._send_uint64(WOP_IS_VALID_PATH)
-        self._send_string(path)
-        self._drain_stderr()
-        return self._recv_bool()
+        self._request_is_valid_path(path)
+        return self._response(_read_bool)
 
     def query_valid_paths(self, paths: list[str], substitute: bool = False) -> set[str]:
-        self._send_uint64(WOP_QUERY_VALID_PATHS)
-        self._send_string_list(paths)
-        self._send_bool(substitute)
-        self._drain_stderr()
-        return set(self._recv_string_list())
+        self._request_query_valid_paths(paths, substitute)
+        return self._response(_read_path_set)
 
     def query_path_info(self, path: str) -> PathInfo:
-        self._send_uint64(WOP_QUERY_PATH_INFO)
-        self._send_string(path)
-        self._drain_stderr()
+        self._request_query_path_info(path)
+        return _path_info(self._response(_read_path_info, path))
 
-        valid = self._recv_bool()
-        if not valid:
-            raise NixDaemonError(f"path not valid: {path}")
-
-        deriver = self._recv_string()
-        nar_hash = self._recv_string()
-        references = self._recv_string_list()
-        registration_time = self._recv_uint64()
-        nar_size = self._recv_uint64()
-
-        # ultimate flag (since 1.16)
-        _ultimate = self._recv_bool()
-        sigs = self._recv_string_list()
-        # content-address (since 1.25-ish)
-        _ca = self._recv_string()
-
-        return PathInfo(
-            deriver=deriver,
-            nar_hash=nar_hash,
-            references=references,
-            registration_time=registration_time,
-            nar_size=nar_size,
-            sigs=sigs,
-        )
+    def query_path_infos(self, paths: list[str], window: int = 32) -> dict[str, PathInfo]:
+        """query_path_info for many paths, pipelined (see batch()).
+
+        Raises NixDaemonError for the first invalid path, after reading
+        every reply, so the connection remains usable.
+        """
+        batch = self.batch(window)
+        for path in paths:
+            batch.query_path_info(path)
+        return dict(zip(paths, batch.execute()))
+
+    def query_derivation_output_map(self, drv_path: str) -> dict[str, str | None]:
+        """The outputs of a valid .drv: name -> path (None if not yet known)."""
+        self._request_query_derivation_output_map(drv_path)
+        return self._response(_read_output_map)
+
+    def compute_closure(
+        self,
+        paths: list[str],
+        include_outputs: bool = False,
+        cache: dict[str, PathInfo] | None = None,
+        window: int = 32,
+    ) -> Closure:
+        """The closure of paths under references, like `nix-store -qR`.
+
+        Breadth-first, one level at a time: every path of a level is
+        queried in one pipelined batch, so a closure costs a few round
+        trips per level (its depth), not one per path. With
+        include_outputs, the outputs of every .drv in the closure are
+        followed too (those that are valid; unbuilt ones are skipped),
+        as with `nix-store -qR --include-outputs`. Their output maps are
+        asked for in the batch after the .drv's own info.
+
+        cache, if given, maps paths to PathInfo: entries found there are
+        not queried, and every info fetched is added. Reuse one cache
+        across calls to size many overlapping closures.
+
+        Raises NixDaemonError if a path or one of its references is not
+        valid.
+        """
+        if include_outputs and self.daemon_version < (1 << 8 | 22):
+            raise NixDaemonError("include_outputs needs protocol 1.22 (QueryDerivationOutputMap)")
+        cache = {} if cache is None else cache
+        infos: dict[str, PathInfo] = {}
+        seen = set(paths)
+        outputs: set[str] = set()  # reached only as a .drv output: may be unbuilt
+        level = list(dict.fromkeys(paths))
+        drvs: list[str] = []  # valid .drvs whose outputs are yet to be asked for
+        while level or drvs:
+            batch = self.batch(window)
+            queried = [p for p in level if p not in cache]
+            for p in queried:
+                batch.query_path_info(p)
+            # Only known-valid .drvs: for anything else the daemon fails
+            # the request and closes the connection.
+            for drv in drvs:
+                batch.query_derivation_output_map(drv)
+            results = batch.execute(return_exceptions=True)
+            for p, info in zip(queried, results):
+                if isinstance(info, NixDaemonError):
+                    if p in outputs:
+                        continue
+                    raise info
+                cache[p] = info
+
+            next_level = []
+            for output_map in results[len(queried):]:
+                if isinstance(output_map, NixDaemonError):
+                    raise output_map
+                for out in output_map.values():
+                    if out and out not in seen:
+                        seen.add(out)
+                        outputs.add(out)
+                        next_level.append(out)
+            drvs = []
+            for p in level:
+                info = cache.get(p)
+                if info is None:
+                    continue
+                infos[p] = info
+                if include_outputs and p.endswith(".drv"):
+                    drvs.append(p)
+                for ref in info.references:
+                    if ref not in seen:
+                        seen.add(ref)
+                        next_level.append(ref)
+            level = next_level
+        return Closure(infos)
 
     def add_text_to_store(self, name: str, content: str, references: list[str] | None = None) -> str:
-        refs = references or []
-        self._send_uint64(WOP_ADD_TEXT_TO_STORE)
-        self._send_string(name)
-        self._send_string(content)
-        self._send_string_list(refs)
-        self._drain_stderr()
-        return self._recv_string()
+        self._request_add_text_to_store(name, content, references)
+        return self._response(_read_string)
 
     def build_paths(self, paths: list[str], build_mode: int = 0) -> None:
-        self._send_uint64(WOP_BUILD_PATHS)
+        self._request_build_paths(paths, build_mode)
+        self._response(_read_uint64)  # result (1 = success)
 
-        # Since protocol >= 1.30, paths are sent as DerivedPath serialization
-        # For simplicity, send as string list (opaque paths or drv!out)
-        self._send_string_list(paths)
+    def add_to_store_nar(
+        self,
+        info: PathInfo,
+        nar_source,
+        repair: bool = False,
+        dont_check_sigs: bool = False,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> str:
+        """Add info.path to the store with the NAR read from nar_source.
 
-        self._send_uint64(build_mode)  # bmNormal=0
-        self._drain_stderr()
-        self._recv_uint64()  # result (1 = success)
+        nar_source is bytes, a binary file, a socket, or an iterable of
+        chunks (such as pix.nar.nar_stream()). It is streamed to the
+        daemon in chunk_size frames, never held whole. info.nar_hash and
+        info.nar_size travel ahead of the NAR, so they must be known; the
+        NAR is hashed and counted as it goes, and NixDaemonError is
+        raised if it does not match them (add_path_to_store() computes
+        them in a first pass). Returns info.path.
+        """
+        if self.daemon_version < (1 << 8 | 23):
+            raise NixDaemonError("add_to_store_nar needs protocol 1.23 (framed NAR upload)")
+        self._request_add_to_store_nar(info, repair, dont_check_sigs)
+        with _FramedSink(self, chunk_size) as sink:
+            sent = sink.write_nar(nar_source)
+        self._response(lambda r: None)
+        _check_nar(info, *sent)
+        return info.path
+
+    def add_multiple_to_store(
+        self,
+        items,
+        repair: bool = False,
+        dont_check_sigs: bool = False,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> list[str]:
+        """Add many paths in one request (wopAddMultipleToStore).
+
+        items yields (PathInfo, nar_source) pairs, nar_source being
+        anything add_to_store_nar() accepts. Everything goes out as one
+        framed stream, the path count first, then each path's info
+        followed by its NAR, so importing N paths costs one round trip
+        rather than N. The count comes first, so items is listed up
+        front; NAR sources are only read when their turn comes, one at a
+        time. Paths should come after the paths they reference.
+
+        Each NAR is checked against its info as for add_to_store_nar().
+        Returns the paths, in order.
+        """
+        if self.daemon_version < (1 << 8 | 32):
+            raise NixDaemonError("add_multiple_to_store needs protocol 1.32")
+        items = list(items)
+        self._request_add_multiple_to_store(repair, dont_check_sigs)
+        sent = []
+        with _FramedSink(self, chunk_size) as sink:
+            sink.write(_U64.pack(len(items)))
+            for info, nar_source in items:
+                encoder = _Framing()
+                encoder._send_path_info(info)
+                sink.write(encoder._wbuf)
+                sent.append(sink.write_nar(nar_source))
+        self._response(lambda r: None)
+        for (info, _), s in zip(items, sent):
+            _check_nar(info, *s)
+        return [info.path for info, _ in items]
+
+    def add_path_to_store(
+        self,
+        path: str | Path,
+        name: str | None = None,
+        references: list[str] | None = None,
+        repair: bool = False,
+    ) -> str:
+        """Add a local file or tree to the store as a source path, like `nix store add`.
+
+        Two passes over path with constant memory: one hashes its NAR
+        (which names the store path and fills in narHash/narSize), the
+        second streams the NAR to the daemon. Returns the store path.
+        """
+        name = name or Path(path).name
+        references = sorted(references or [])
+        h = hashlib.sha256()
+        size = 0
+        for chunk in nar_stream(path):
+            h.update(chunk)
+            size += len(chunk)
+        digest = h.digest()
+        info = PathInfo(
+            deriver="",
+            nar_hash="sha256:" + digest.hex(),
+            references=references,
+            registration_time=0,
+            nar_size=size,
+            sigs=[],
+            path=make_source_store_path(name, digest, references),
+            ultimate=True,
+            ca="fixed:r:sha256:" + base32.encode(digest),
+        )
+        return self.add_to_store_nar(info, nar_stream(path), repair=repair)
+
+    def batch(self, window: int = 32) -> "Batch":
+        """Start a pipelined batch of requests on this connection."""
+        return Batch(self, window)
+
+
+def _nar_chunks(source, chunk_size: int):
+    """The chunks of a NAR source: an iterable of chunks, or anything pix.nar reads."""
+    if isinstance(source, (bytes, bytearray, memoryview, socket.socket)) or hasattr(source, "readinto"):
+        src = _source(source)
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while n := src.readinto(buf):
+            yield view[:n]
+    else:
+        yield from source
+
+
+class _FramedSink:
+    """Writes a framed stream (uint64 length + data, no padding) on conn.
+
+    Small writes are gathered into chunk_size frames; chunk_size or
+    bigger ones go out as frames of their own. Frames are sent as soon
+    as chunk_size bytes are queued, so at most about one frame is held
+    however long the stream. Stderr that arrives is read between frames
+    (DaemonConnection._poll_stderr). Leaving the
+    with block sends the closing empty frame; an exception instead marks
+    the connection broken, since the request is half sent.
+    """
+
+    def __init__(self, conn: DaemonConnection, chunk_size: int):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.buf = bytearray()
+
+    def write(self, data) -> None:
+        if not self.buf and len(data) >= self.chunk_size:
+            self._frame(data)
+            return
+        self.buf += data
+        if len(self.buf) >= self.chunk_size:
+            self._frame(self.buf)
+            self.buf.clear()
+
+    def write_nar(self, nar_source) -> tuple[int, bytes]:
+        """Stream a NAR source; returns its (size, sha256 digest)."""
+        h = hashlib.sha256()
+        size = 0
+        for chunk in _nar_chunks(nar_source, self.chunk_size):
+            h.update(chunk)
+            size += len(chunk)
+            self.write(chunk)
+        return size, h.digest()
+
+    def _frame(self, data) -> None:
+        if data:
+            self.conn._send_frame(data)
+            # Frames below SEND_DIRECT_SIZE only reach the write buffer.
+            if len(self.conn._wbuf) >= self.chunk_size:
+                self.conn._flush()
+            self.conn._poll_stderr()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.conn.broken = True
+            return
+        try:
+            self._frame(self.buf)
+            self.conn._send_frame(b"")
+        except BaseException:
+            self.conn.broken = True
+            raise
+
+
+def _check_nar(info: PathInfo, size: int, digest: bytes) -> None:
+    if size != info.nar_size or not _hash_matches(info.nar_hash, digest):
+        raise NixDaemonError(
+            f"NAR for {info.path} does not match its info: "
+            f"sent {size} bytes, sha256:{digest.hex()}; "
+            f"declared {info.nar_size} bytes, {info.nar_hash}"
+        )
+
+
+def _hash_matches(expected: str, digest: bytes) -> bool:
+    """Whether a sha256 hash string, in any encoding Nix prints, is digest."""
+    for prefix in ("sha256:", "sha256-"):
+        if expected.startswith(prefix):
+            expected = expected[len(prefix):]
+    return expected in (digest.hex(), base32.encode(digest), base64.b64encode(digest).decode())
+
+
+class DaemonPool:
+    """A thread-safe pool of DaemonConnections to one daemon socket.
+
+    checkout() lends a connection for the duration of a with block and
+    takes it back afterwards; at most max_size are open at once, and
+    callers beyond that wait. Connections are health-checked on the way
+    in and out (DaemonConnection.healthy()), and ones idle longer than
+    idle_timeout seconds are closed, keeping at least min_size open.
+
+        pool = DaemonPool(max_size=8)
+        with pool.checkout() as conn:
+            conn.query_path_info(path)
+    """
+
+    def __init__(
+        self,
+        socket_path: str | None = None,
+        min_size: int = 0,
+        max_size: int = 4,
+        idle_timeout: float | None = 60.0,
+    ):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("need 0 <= min_size <= max_size and max_size >= 1")
+        self.socket_path = socket_path
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.opened = 0  # connections opened over the pool's lifetime
+        self._idle: deque[tuple[DaemonConnection, float]] = deque()  # (conn, idle since)
+        self._size = 0  # idle + checked out
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _connect(self) -> DaemonConnection:
+        conn = DaemonConnection(self.socket_path)
+        try:
+            conn.connect()
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def fill(self) -> None:
+        """Open connections until min_size are open."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            self._add_idle(self._open_counted())
+
+    def _open_counted(self) -> DaemonConnection:
+        """Open a connection whose slot the caller has already counted."""
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.opened += 1
+        return conn
+
+    def _add_idle(self, conn: DaemonConnection) -> None:
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _expired(self, now: float) -> list[DaemonConnection]:
+        """Remove idle connections past idle_timeout (oldest first); lock held."""
+        stale = []
+        if self.idle_timeout is None:
+            return stale
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+        return stale
+
+    def acquire(self, timeout: float | None = None) -> DaemonConnection:
+        """Take a healthy connection, opening one if the pool has room.
+
+        Raises TimeoutError if none frees up within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise ConnectionError("daemon pool is closed")
+                    for stale in self._expired(time.monotonic()):
+                        stale.close()
+                    if self._idle:
+                        conn = self._idle.pop()[0]  # most recently used
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("no daemon connection available")
+                    self._cond.wait(remaining)
+            if conn is None:
+                return self._open_counted()
+            if conn.healthy():
+                return conn
+            self._discard(conn)
+
+    def release(self, conn: DaemonConnection) -> None:
+        """Return a connection taken with acquire()."""
+        conn.event_sink = None  # don't leak one borrower's sink to the next
+        if self._closed or not conn.healthy():
+            self._discard(conn)
+        else:
+            self._add_idle(conn)
+
+    def _discard(self, conn: DaemonConnection) -> None:
+        conn.close()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self, timeout: float | None = None):
+        """Borrow a connection for a with block; it is checked back in after."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Close idle connections; checked-out ones close on checkin."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def __enter__(self):
+        self.fill()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_pool: DaemonPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool() -> DaemonPool:
+    """The process-wide pool for the default daemon socket."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = DaemonPool()
+        return _default_pool
+
+
+class Batch:
+    """Pipelined requests on one DaemonConnection.
+
+    Each call queues a request and returns the batch, so calls chain;
+    execute() sends them back-to-back and reads the replies in order:
+
+        infos = conn.batch().query_path_info(p1).query_path_info(p2).execute()
+
+    The daemon handles requests one at a time from its socket, so
+    pipelining changes nothing on its side, but N lookups cost a few
+    round trips instead of N.
+
+    At most *window* requests are outstanding. If the client wrote every
+    request before reading any reply, the daemon could fill the socket
+    buffer with replies and block, while the client is still blocked
+    writing requests. Requests go out in groups of window/2 (one sendall
+    each) as replies are consumed.
+    """
+
+    def __init__(self, conn: DaemonConnection, window: int = 32):
+        self._conn = conn
+        self.window = max(1, window)
+        self._ops: list[tuple[Callable[[], None], Callable, tuple]] = []
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def _add(self, request: Callable[[], None], decode: Callable, *args) -> "Batch":
+        self._ops.append((request, decode, args))
+        return self
+
+    def is_valid_path(self, path: str) -> "Batch":
+        return self._add(partial(self._conn._request_is_valid_path, path), _read_bool)
+
+    def query_valid_paths(self, paths: list[str], substitute: bool = False) -> "Batch":
+        return self._add(partial(self._conn._request_query_valid_paths, paths, substitute), _read_path_set)
+
+    def query_path_info(self, path: str) -> "Batch":
+        return self._add(partial(self._conn._request_query_path_info, path), _read_path_info, path)
+
+    def query_derivation_output_map(self, drv_path: str) -> "Batch":
+        return self._add(partial(self._conn._request_query_derivation_output_map, drv_path), _read_output_map)
+
+    def add_text_to_store(self, name: str, content: str, references: list[str] | None = None) -> "Batch":
+        return self._add(partial(self._conn._request_add_text_to_store, name, content, references), _read_string)
+
+    def execute(self, return_exceptions: bool = False) -> list:
+        """Send every queued request and return the replies in order.
+
+        An invalid path in query_path_info raises NixDaemonError once all
+        replies are read, or with return_exceptions=True appears in the
+        list in place of its PathInfo. A daemon-side error (STDERR_ERROR)
+        ends the connection and is raised immediately.
+        """
+        ops, self._ops = self._ops, []
+        response = self._conn._response
+        results: list = []
+        outstanding: deque[tuple[Callable, tuple]] = deque()
+        i = 0
+        while i < len(ops) or outstanding:
+            while i < len(ops) and len(outstanding) < self.window:
+                request, decode, args = ops[i]
+                request()
+                outstanding.append((decode, args))
+                i += 1
+            # The first read flushes every request queued above in one
+            # sendall; read half a window before topping it up again.
+            take = len(outstanding) if i == len(ops) else max(1, self.window // 2)
+            for _ in range(take):
+                decode, args = outstanding.popleft()
+                results.append(response(decode, *args))
+        if not return_exceptions:
+            for r in results:
+                if isinstance(r, NixDaemonError):
+                    raise r
+        return results
@@ -0,0 +1,382 @@
+"""asyncio client for the Nix daemon.
+
+The same worker protocol as pix.daemon, over asyncio.open_unix_connection.
+Requests are encoded by pix.daemon's _Framing and replies decoded by its
+_read_* functions, so both clients share one reading of the wire format
+and of the stderr stream.
+
+The decoders read from bytes already received (_BufferReader). When a
+message is not complete yet they stop with _Incomplete, the connection
+awaits more data and runs the decoder again from its start. The reader
+remembers every value it has already read in the message and hands them
+back on the rerun without touching the bytes, and a string list resumes
+from its last complete string, so a large reply is parsed once however
+many reads it arrives in. Bytes are consumed only once a whole stderr
+message or reply has been decoded, so the receive buffer always begins
+on a message boundary.
+
+Cancellation: once a request is written its reply must be read before
+the connection can be reused. An operation cancelled (or failing) in
+between leaves the stream at an unknown position, so the connection is
+marked broken and closed rather than left out of sync.
+
+    async with AsyncDaemonConnection() as conn:
+        info = await conn.query_path_info(path)
+
+    async with AsyncDaemonPool(size=4) as pool:
+        infos = await pool.query_path_infos(paths)
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import Callable, Iterable
+from contextlib import asynccontextmanager
+
+from pix.daemon import (
+    _U64,
+    DEFAULT_SOCKET,
+    RECV_BUFFER_SIZE,
+    STDERR_ERROR,
+    STDERR_LAST,
+    WORKER_MAGIC_1,
+    WORKER_MAGIC_2,
+    NixDaemonError,
+    PathInfo,
+    _event,
+    _Framing,
+    _path_info,
+    _read_bool,
+    _read_path_info,
+    _read_path_set,
+    _read_server_hello,
+    _read_stderr_message,
+    _read_string,
+    _read_uint64,
+)
+
+
+class _Incomplete(Exception):
+    """The buffer ends before the message does; needed is the total size."""
+
+    def __init__(self, needed: int):
+        self.needed = needed
+
+
+class _BufferReader:
+    """The _recv_* interface of DaemonConnection, over received bytes.
+
+    One reader serves every attempt at decoding a message. Each _recv_*
+    call that completes is logged with the position after it; restart()
+    rewinds, and the rerun decoder gets the logged values back in order
+    (decoders are deterministic) until it reaches the call that ran out
+    of bytes. That call resumes: a string list keeps the strings it had.
+    """
+
+    __slots__ = ("buf", "pos", "_log", "_calls", "_partial")
+
+    def __init__(self, buf: bytearray):
+        self.buf = buf
+        self.pos = 0
+        self._log: list[tuple[object, int]] = []  # (value, position after)
+        self._calls = 0
+        self._partial: list | None = None  # string list in progress: [n, items, position]
+
+    def restart(self) -> None:
+        self.pos = 0
+        self._calls = 0
+
+    def _take(self, n: int) -> int:
+        start = self.pos
+        end = start + n
+        if end > len(self.buf):
+            raise _Incomplete(end)
+        self.pos = end
+        return start
+
+    def _replaying(self) -> bool:
+        return self._calls < len(self._log)
+
+    def _replay(self):
+        value, self.pos = self._log[self._calls]
+        self._calls += 1
+        return value
+
+    def _logged(self, value):
+        self._log.append((value, self.pos))
+        self._calls += 1
+        return value
+
+    def _u64(self) -> int:
+        return _U64.unpack_from(self.buf, self._take(8))[0]
+
+    def _bytes(self) -> bytes:
+        length = self._u64()
+        start = self._take(length + (-length % 8))
+        return bytes(self.buf[start:start + length])
+
+    def _recv_uint64(self) -> int:
+        return self._replay() if self._replaying() else self._logged(self._u64())
+
+    def _recv_bytes(self) -> bytes:
+        return self._replay() if self._replaying() else self._logged(self._bytes())
+
+    def _recv_string(self) -> str:
+        return self._replay() if self._replaying() else self._logged(self._bytes().decode())
+
+    def _recv_string_list(self) -> list[str]:
+        if self._replaying():
+            return self._replay()
+        if self._partial is None:
+            n = self._u64()
+            self._partial = [n, [], self.pos]
+        partial = self._partial
+        n, items, self.pos = partial
+        while len(items) < n:
+            items.append(self._bytes().decode())
+            partial[2] = self.pos
+        self._partial = None
+        return self._logged(items)
+
+    def _recv_bool(self) -> bool:
+        return self._recv_uint64() != 0
+
+
+class AsyncDaemonConnection(_Framing):
+    """asyncio connection to the Nix daemon.
+
+    Operations on one connection run one at a time (an asyncio.Lock keeps
+    their requests and replies from interleaving); use AsyncDaemonPool to
+    run several at once.
+    """
+
+    def __init__(self, socket_path: str | None = None):
+        super().__init__()
+        self.socket_path = socket_path or DEFAULT_SOCKET
+        self.daemon_version: int = 0
+        self.broken = False
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._rbuf = bytearray()
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            await self._handshake()
+        except BaseException:
+            self._break()
+            raise
+
+    async def close(self) -> None:
+        writer, self._writer = self._writer, None
+        self._reader = None
+        self._wbuf.clear()
+        self._rbuf.clear()
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # --- Wire format ---
+
+    async def _flush(self) -> None:
+        if self._wbuf:
+            self._writer.write(bytes(self._wbuf))
+            self._wbuf.clear()
+            await self._writer.drain()
+
+    async def _fill(self, n: int) -> None:
+        """Receive until at least n bytes are buffered."""
+        await self._flush()
+        while len(self._rbuf) < n:
+            chunk = await self._reader.read(max(n - len(self._rbuf), RECV_BUFFER_SIZE))
+            if not chunk:
+                raise ConnectionError("daemon closed connection")
+            self._rbuf += chunk
+
+    async def _read(self, decode: Callable, *args):
+        """Decode one complete message from the stream."""
+        r = _BufferReader(self._rbuf)
+        while True:
+            try:
+                value = decode(r, *args)
+            except _Incomplete as e:
+                await self._fill(e.needed)
+                r.restart()
+                continue
+            del self._rbuf[:r.pos]
+            return value
+
+    def _break(self) -> None:
+        """Abandon the connection: its stream position is unknown."""
+        self.broken = True
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+    # --- Handshake ---
+
+    async def _handshake(self) -> None:
+        self._send_uint64(WORKER_MAGIC_1)
+        magic = await self._read(_read_uint64)
+        if magic != WORKER_MAGIC_2:
+            raise NixDaemonError(f"bad daemon magic: {magic:#x}")
+
+        self.daemon_version = await self._read(_read_uint64)
+        self._send_client_hello()
+        await self._read(_read_server_hello, self.daemon_version)
+
+        # Drain startup messages
+        await self._drain_stderr()
+
+    # --- Stderr draining ---
+
+    async def _drain_stderr(self) -> None:
+        """Read daemon stderr messages until STDERR_LAST, passing them to the event sink."""
+        while True:
+            msg_type, payload = await self._read(_read_stderr_message)
+            if msg_type == STDERR_LAST:
+                return
+            if msg_type == STDERR_ERROR:
+                raise payload
+            if self._emit is not None:
+                self._emit(_event(msg_type, payload))
+
+    async def _response(self, decode: Callable, *args):
+        await self._drain_stderr()
+        return await self._read(decode, *args)
+
+    async def _call(self, ops: Iterable[tuple[Callable[[], None], Callable, tuple]], window: int = 1) -> list:
+        """Run (request, decode, args) operations, pipelined window deep.
+
+        Holds the lock for the whole exchange. Any exception or
+        cancellation before every reply is read breaks the connection.
+        """
+        async with self._lock:
+            if self.broken or self.closed:
+                raise ConnectionError("daemon connection is closed")
+            ops = list(ops)
+            window = max(1, window)
+            results: list = []
+            outstanding: deque[tuple[Callable, tuple]] = deque()
+            i = 0
+            try:
+                while i < len(ops) or outstanding:
+                    while i < len(ops) and len(outstanding) < window:
+                        request, decode, args = ops[i]
+                        request()
+                        outstanding.append((decode, args))
+                        i += 1
+                    take = len(outstanding) if i == len(ops) else max(1, window // 2)
+                    for _ in range(take):
+                        decode, args = outstanding.popleft()
+                        results.append(await self._response(decode, *args))
+            except BaseException:
+                self._break()
+                raise
+            return results
+
+    async def _call_one(self, request: Callable[[], None], decode: Callable, *args):
+        (result,) = await self._call([(request, decode, args)])
+        return result
+
+    # --- Operations ---
+
+    async def is_valid_path(self, path: str) -> bool:
+        return await self._call_one(lambda: self._request_is_valid_path(path), _read_bool)
+
+    async def query_valid_paths(self, paths: list[str], substitute: bool = False) -> set[str]:
+        return await self._call_one(lambda: self._request_query_valid_paths(paths, substitute), _read_path_set)
+
+    async def query_path_info(self, path: str) -> PathInfo:
+        return _path_info(await self._call_one(lambda: self._request_query_path_info(path), _read_path_info, path))
+
+    async def query_path_infos(self, paths: list[str], window: int = 32) -> dict[str, PathInfo]:
+        """query_path_info for many paths, pipelined window deep.
+
+        Raises NixDaemonError for the first invalid path, after reading
+        every reply, so the connection remains usable.
+        """
+        ops = [(lambda p=p: self._request_query_path_info(p), _read_path_info, (p,)) for p in paths]
+        results = await self._call(ops, window)
+        return {p: _path_info(info) for p, info in zip(paths, results)}
+
+    async def add_text_to_store(self, name: str, content: str, references: list[str] | None = None) -> str:
+        return await self._call_one(lambda: self._request_add_text_to_store(name, content, references), _read_string)
+
+    async def build_paths(self, paths: list[str], build_mode: int = 0) -> None:
+        await self._call_one(lambda: self._request_build_paths(paths, build_mode), _read_uint64)
+
+
+class AsyncDaemonPool:
+    """Up to size AsyncDaemonConnections, opened on demand and reused.
+
+    connection() lends one out for the duration of an async with block;
+    callers beyond size wait for one to come back. Broken connections
+    are closed instead of returned, and replaced on the next demand.
+    """
+
+    def __init__(self, socket_path: str | None = None, size: int = 4):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.socket_path = socket_path or DEFAULT_SOCKET
+        self.size = size
+        self._idle: list[AsyncDaemonConnection] = []
+        self._slots = asyncio.Semaphore(size)
+        self._closed = False
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._closed:
+            raise ConnectionError("daemon pool is closed")
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = AsyncDaemonConnection(self.socket_path)
+                await conn.connect()
+            try:
+                yield conn
+            finally:
+                if conn.broken or conn.closed or self._closed:
+                    await conn.close()
+                else:
+                    self._idle.append(conn)
+
+    async def query_path_infos(self, paths: list[str], window: int = 32) -> dict[str, PathInfo]:
+        """query_path_infos with paths split across the pool's connections."""
+        chunk = -(-len(paths) // self.size) or 1
+        parts = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+
+        async def run(part: list[str]) -> dict[str, PathInfo]:
+            async with self.connection() as conn:
+                return await conn.query_path_infos(part, window)
+
+        infos: dict[str, PathInfo] = {}
+        for part in await asyncio.gather(*(run(p) for p in parts)):
+            infos.update(part)
+        return infos
+
+    async def close(self) -> None:
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -21,18 +21,33 @@ Each output is a 4-tuple: (name, path, hashAlgo, hash).
 See: nix/src/libstore/derivations.cc
 """
 
+import json
+import os
+import re
+import sys
+from collections import deque
+from collections.abc import Callable, Iterable, Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from dataclasses import dataclass, field
+from types import MappingProxyType
 from pix.hash import sha256
+from pix.store_path import STORE_DIR, make_fixed_output_path, make_output_path
 
 
-@dataclass
+# Strings up to this long are interned by intern_strings(): store paths,
+# env keys, output names and the short flag-like values that recur across
+# every derivation of a closure. Long values (build scripts) are left alone.
+INTERN_MAX = 256
+
+
+@dataclass(slots=True)
 class DerivationOutput:
     path: str
     hash_algo: str  # "" for non-fixed-output
     hash_value: str  # "" for non-fixed-output
 
 
-@dataclass
+@dataclass(slots=True)
 class Derivation:
     outputs: dict[str, DerivationOutput] = field(default_factory=dict)
     input_drvs: dict[str, list[str]] = field(default_factory=dict)  # drv_path -> [output_names]
@@ -42,9 +57,96 @@ class Derivation:
     args: list[str] = field(default_factory=list)
     env: dict[str, str] = field(default_factory=dict)
 
+    def freeze(self) -> "FrozenDerivation":
+        """A read-only copy: tuples for lists, mapping proxies for dicts."""
+        return FrozenDerivation(
+            outputs=MappingProxyType({
+                name: FrozenDerivationOutput(o.path, o.hash_algo, o.hash_value) for name, o in self.outputs.items()
+            }),
+            input_drvs=MappingProxyType({path: tuple(outs) for path, outs in self.input_drvs.items()}),
+            input_srcs=tuple(self.input_srcs),
+            platform=self.platform,
+            builder=self.builder,
+            args=tuple(self.args),
+            env=MappingProxyType(dict(self.env)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenDerivationOutput:
+    path: str
+    hash_algo: str
+    hash_value: str
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenDerivation:
+    """Immutable Derivation, safe to share between caches and threads.
+
+    Reads like a Derivation (same field names, lookups and iteration), and
+    serialize() and hash_derivation_modulo() accept it unchanged. Not
+    hashable: the mappings are read-only views, not values.
+    """
+
+    outputs: Mapping[str, FrozenDerivationOutput]
+    input_drvs: Mapping[str, tuple[str, ...]]
+    input_srcs: tuple[str, ...]
+    platform: str
+    builder: str
+    args: tuple[str, ...]
+    env: Mapping[str, str]
+
+    def thaw(self) -> Derivation:
+        """A mutable copy."""
+        return Derivation(
+            outputs={name: DerivationOutput(o.path, o.hash_algo, o.hash_value) for name, o in self.outputs.items()},
+            input_drvs={path: list(outs) for path, outs in self.input_drvs.items()},
+            input_srcs=list(self.input_srcs),
+            platform=self.platform,
+            builder=self.builder,
+            args=list(self.args),
+            env=dict(self.env),
+        )
+
+
+def _intern(s: str) -> str:
+    return sys.intern(s) if len(s) <= INTERN_MAX else s
+
+
+def intern_strings(drv: Derivation) -> Derivation:
+    """Intern drv's short strings in place and return it.
+
+    Across a closure the same env keys, store paths and defaults appear
+    in thousands of derivations; after interning each is stored once.
+    Strings longer than INTERN_MAX are left alone.
+    """
+    drv.outputs = {
+        _intern(name): DerivationOutput(_intern(o.path), _intern(o.hash_algo), _intern(o.hash_value))
+        for name, o in drv.outputs.items()
+    }
+    drv.input_drvs = {_intern(path): [_intern(o) for o in outs] for path, outs in drv.input_drvs.items()}
+    drv.input_srcs = [_intern(p) for p in drv.input_srcs]
+    drv.platform = _intern(drv.platform)
+    drv.builder = _intern(drv.builder)
+    drv.args = [_intern(a) for a in drv.args]
+    drv.env = {_intern(k): _intern(v) for k, v in drv.env.items()}
+    return drv
+
 
 # --- ATerm parser ---
 
+# A string body up to and including its closing quote: runs of ordinary
+# characters, each optionally followed by a backslash pair.
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_ESCAPE_PAIR = re.compile(r"\\(.)", re.DOTALL)
+_UNESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+
+
+def _unescape(m: re.Match) -> str:
+    ch = m.group(1)
+    return _UNESCAPES.get(ch, ch)
+
+
 class _Parser:
     def __init__(self, s: str):
         self.s = s
@@ -67,36 +169,66 @@ class _Parser:
         self.pos = end
 
     def parse_string(self) -> str:
-        self.expect('"')
-        parts: list[str] = []
-        while self.s[self.pos] != '"':
-            if self.s[self.pos] == '\\':
-                self.pos += 1
-                ch = self.s[self.pos]
-                if ch == 'n':
-                    parts.append('\n')
-                elif ch == 'r':
-                    parts.append('\r')
-                elif ch == 't':
-                    parts.append('\t')
-                else:
-                    parts.append(ch)
-            else:
-                parts.append(self.s[self.pos])
-            self.pos += 1
-        self.expect('"')
-        return "".join(parts)
+        """Parse a quoted string, slicing whole runs between escapes."""
+        return self.string_after('"')
+
+    def string_after(self, lead: str) -> str:
+        """Expect *lead* (ending in the opening quote), then parse the string.
+
+        Most .drv strings (store paths, names, most env values) contain no
+        backslash, so one str.find for the closing quote is the whole job.
+        Folding the punctuation before a string into the same check keeps
+        the per-item overhead down for long env and argument lists.
+        """
+        s = self.s
+        if not s.startswith(lead, self.pos):
+            raise ValueError(f"expected {lead!r} at pos {self.pos}")
+        start = self.pos + len(lead)
+        end = s.find('"', start)
+        if end < 0:
+            raise ValueError(f"unterminated string at pos {start - 1}")
+        if s.find("\\", start, end) < 0:
+            self.pos = end + 1
+            return s[start:end]
+        # The quote found above may be escaped: find the real end, then
+        # resolve every backslash pair in one pass.
+        m = _STRING_BODY.match(s, start)
+        if m is None:
+            raise ValueError(f"unterminated string at pos {start - 1}")
+        self.pos = m.end()
+        return _ESCAPE_PAIR.sub(_unescape, s[start:m.end() - 1])
+
+    def close(self, end: str) -> bool:
+        """Consume *end* if it comes next."""
+        if self.s.startswith(end, self.pos):
+            self.pos += len(end)
+            return True
+        return False
 
     def parse_string_list(self) -> list[str]:
-        self.expect('[')
-        items = []
-        while self.peek() != ']':
-            if items:
-                self.expect(',')
-            items.append(self.parse_string())
-        self.expect(']')
+        if self.close("[]"):
+            return []
+        items = [self.string_after('["')]
+        while not self.close("]"):
+            items.append(self.string_after(',"'))
         return items
 
+    def skip_string_list(self) -> None:
+        """Move past a list of strings without decoding them."""
+        if self.close("[]"):
+            return
+        lead = '["'
+        while True:
+            if not self.s.startswith(lead, self.pos):
+                raise ValueError(f"expected {lead!r} at pos {self.pos}")
+            m = _STRING_BODY.match(self.s, self.pos + len(lead))
+            if m is None:
+                raise ValueError(f"unterminated string at pos {self.pos + len(lead) - 1}")
+            self.pos = m.end()
+            if self.close("]"):
+                return
+            lead = ',"'
+
     def parse_outputs(self) -> dict[str, DerivationOutput]:
         self.expect('[')
         outputs = {}
@@ -131,6 +263,53 @@ class _Parser:
         self.expect(']')
         return drvs
 
+    def parse_env(self) -> dict[str, str]:
+        if self.close("[]"):
+            return {}
+        env = {}
+        lead = '[("'
+        while True:
+            key = self.string_after(lead)
+            env[key] = self.string_after(',"')
+            if self.close(")]"):
+                return env
+            lead = '),("'
+
+
+class _ReferenceParser(_Parser):
+    """The original scanner: one character and one token at a time."""
+
+    def parse_string(self) -> str:
+        self.expect('"')
+        parts: list[str] = []
+        while self.s[self.pos] != '"':
+            if self.s[self.pos] == '\\':
+                self.pos += 1
+                ch = self.s[self.pos]
+                if ch == 'n':
+                    parts.append('\n')
+                elif ch == 'r':
+                    parts.append('\r')
+                elif ch == 't':
+                    parts.append('\t')
+                else:
+                    parts.append(ch)
+            else:
+                parts.append(self.s[self.pos])
+            self.pos += 1
+        self.expect('"')
+        return "".join(parts)
+
+    def parse_string_list(self) -> list[str]:
+        self.expect('[')
+        items = []
+        while self.peek() != ']':
+            if items:
+                self.expect(',')
+            items.append(self.parse_string())
+        self.expect(']')
+        return items
+
     def parse_env(self) -> dict[str, str]:
         self.expect('[')
         env = {}
@@ -147,9 +326,8 @@ class _Parser:
         return env
 
 
-def parse(drv_text: str) -> Derivation:
-    """Parse an ATerm .drv file into a Derivation."""
-    p = _Parser(drv_text)
+def _parse_head(p: _Parser) -> tuple:
+    """outputs, input_drvs, input_srcs, platform and builder; stops at args."""
     p.expect_str("Derive(")
     outputs = p.parse_outputs()
     p.expect(',')
@@ -161,66 +339,311 @@ def parse(drv_text: str) -> Derivation:
     p.expect(',')
     builder = p.parse_string()
     p.expect(',')
-    args = p.parse_string_list()
-    p.expect(',')
+    return outputs, input_drvs, input_srcs, platform, builder
+
+
+def _parse_env_tail(p: _Parser) -> dict[str, str]:
+    """env, then the closing parenthesis."""
     env = p.parse_env()
     p.expect(')')
-    return Derivation(outputs, input_drvs, input_srcs, platform, builder, args, env)
+    return env
+
+
+def _parse(p: _Parser) -> Derivation:
+    head = _parse_head(p)
+    args = p.parse_string_list()
+    p.expect(',')
+    return Derivation(*head, args, _parse_env_tail(p))
+
+
+def _text(drv_text: str | bytes | memoryview) -> str:
+    if isinstance(drv_text, str):
+        return drv_text
+    return str(drv_text, "utf-8")
+
+
+def parse(drv_text: str | bytes | memoryview, intern: bool = False) -> Derivation:
+    """Parse an ATerm .drv file into a Derivation.
+
+    Accepts the file contents as text or as raw UTF-8 bytes (e.g. straight
+    from open(path, "rb").read() or an mmap slice). With intern=True, short
+    strings are interned (see intern_strings) — worth it when holding many
+    derivations at once.
+    """
+    drv = _parse(_Parser(_text(drv_text)))
+    return intern_strings(drv) if intern else drv
+
+
+def parse_reference(drv_text: str | bytes | memoryview) -> Derivation:
+    """Parse with the per-character reference scanner (same result as parse)."""
+    return _parse(_ReferenceParser(_text(drv_text)))
+
+
+class LazyDerivation:
+    """A Derivation whose args and env are decoded on first access.
+
+    Graph walks and output lookups need only outputs and input_drvs, but
+    env holds nearly all of a .drv's bytes (build scripts, phases). The
+    scan decodes the small head sections, skips args without decoding
+    it, and stops: env is the last section, so its start is all there is
+    to record. args and env are parsed from the kept text when first
+    read, and the text is released once both are.
+
+    Reads and writes like a Derivation, and compares equal to one with
+    the same contents; to_derivation() returns a plain copy. It is not a
+    subclass (Derivation is a slotted dataclass), so isinstance(x,
+    Derivation) is False: code that needs the real type converts with
+    to_derivation(). Malformed args/env sections raise ValueError on
+    first access, not at parse time.
+    """
+
+    __slots__ = ("outputs", "input_drvs", "input_srcs", "platform", "builder",
+                 "_text", "_args_pos", "_env_pos", "_args", "_env")
+
+    def __init__(self, text: str):
+        p = _Parser(text)
+        self.outputs, self.input_drvs, self.input_srcs, self.platform, self.builder = _parse_head(p)
+        self._args_pos = p.pos
+        p.skip_string_list()
+        p.expect(',')
+        self._env_pos = p.pos
+        self._text: str | None = text
+        self._args: list[str] | None = None
+        self._env: dict[str, str] | None = None
+
+    def _parser(self, pos: int) -> _Parser:
+        p = _Parser(self._text)
+        p.pos = pos
+        return p
+
+    def _release(self) -> None:
+        if self._args is not None and self._env is not None:
+            self._text = None
+
+    @property
+    def args(self) -> list[str]:
+        if self._args is None:
+            self._args = self._parser(self._args_pos).parse_string_list()
+            self._release()
+        return self._args
+
+    @args.setter
+    def args(self, value: list[str]) -> None:
+        self._args = value
+        self._release()
+
+    @property
+    def env(self) -> dict[str, str]:
+        if self._env is None:
+            self._env = _parse_env_tail(self._parser(self._env_pos))
+            self._release()
+        return self._env
+
+    @env.setter
+    def env(self, value: dict[str, str]) -> None:
+        self._env = value
+        self._release()
+
+    @property
+    def decoded(self) -> bool:
+        """Whether args and env have both been decoded."""
+        return self._text is None
+
+    def to_derivation(self) -> Derivation:
+        return Derivation(self.outputs, self.input_drvs, self.input_srcs, self.platform, self.builder, self.args, self.env)
+
+    def freeze(self) -> FrozenDerivation:
+        """A read-only copy, as Derivation.freeze(); decodes args and env."""
+        return self.to_derivation().freeze()
+
+    def _fields(self) -> tuple:
+        return (self.outputs, self.input_drvs, self.input_srcs, self.platform, self.builder, self.args, self.env)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, LazyDerivation):
+            return self._fields() == other._fields()
+        if isinstance(other, Derivation):
+            return self.to_derivation() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        state = "decoded" if self.decoded else "lazy"
+        return f"<LazyDerivation {self.builder!r} outputs={list(self.outputs)} ({state})>"
+
+
+def parse_lazy(drv_text: str | bytes | memoryview) -> LazyDerivation:
+    """Parse only the head of a .drv; args and env wait until first read."""
+    return LazyDerivation(_text(drv_text))
+
+
+def read_drv(path: str, intern: bool = False, lazy: bool = False) -> Derivation | LazyDerivation:
+    """Read and parse a .drv file (lazily with lazy=True, see parse_lazy)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return parse_lazy(data) if lazy else parse(data, intern)
+
+
+def _read_drvs(paths: list[str], lazy: bool) -> list[Derivation | LazyDerivation]:
+    return [read_drv(p, lazy=lazy) for p in paths]
+
+
+def load_closure(
+    roots: str | Iterable[str],
+    workers: int = 1,
+    batch: int = 32,
+    intern: bool = False,
+    lazy: bool = False,
+) -> dict[str, Derivation | LazyDerivation]:
+    """Parse every .drv reachable from *roots* through input_drvs.
+
+    Walks the graph breadth-first and returns {drv_path: Derivation}. Each
+    path is read once: it is marked seen when first scheduled, so a .drv
+    shared by many dependents (stdenv, bash) is never queued twice.
+
+    With workers > 1, files are parsed in a process pool — parsing is
+    CPU-bound, so threads would serialize on the GIL. Paths are shipped
+    in batches of up to *batch* to amortize the pickling round trip, and
+    new batches are submitted as soon as any worker finishes rather than
+    level by level.
+
+    intern=True interns short strings (see intern_strings) as results
+    arrive, so the many copies of each store path and env key in a large
+    closure share one object — including those unpickled from workers.
+
+    lazy=True returns LazyDerivations: a walk that only follows
+    input_drvs never decodes any env. (Interning decodes them, so
+    combine the two only when the env will be read anyway.)
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    pending = deque(dict.fromkeys(roots))
+    seen = set(pending)
+    result: dict[str, Derivation] = {}
+
+    def discover(path: str, drv: Derivation | LazyDerivation) -> None:
+        result[path] = intern_strings(drv) if intern else drv
+        for dep in drv.input_drvs:
+            if dep not in seen:
+                seen.add(dep)
+                pending.append(dep)
+
+    if workers <= 1:
+        while pending:
+            path = pending.popleft()
+            discover(path, read_drv(path, lazy=lazy))
+        return result
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        while pending or in_flight:
+            # Keep every worker busy with one batch and one queued behind it.
+            while pending and len(in_flight) < 2 * workers:
+                size = max(1, min(batch, len(pending) // workers))
+                chunk = [pending.popleft() for _ in range(size)]
+                in_flight[pool.submit(_read_drvs, chunk, lazy)] = chunk
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                for path, drv in zip(in_flight.pop(fut), fut.result()):
+                    discover(path, drv)
+    return result
 
 
 def _escape(s: str) -> str:
-    """Escape a string for ATerm output."""
+    """Escape a string for ATerm output.
+
+    str.replace returns the string itself when there is nothing to
+    replace, so an unescaped string costs five fast scans and no copies.
+    """
     return s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
 
 
-def serialize(drv: Derivation) -> str:
-    """Serialize a Derivation to ATerm .drv format."""
-    parts = ["Derive("]
+def _escape_all(strings: list[str]) -> list[str]:
+    """_escape() every string with one pass over the whole section.
+
+    Nix strings cannot contain NUL, so it can separate the strings while
+    the escaping runs once over all of them; the count check falls back
+    to one call per string if some string does contain NUL.
+    """
+    blob = "\0".join(strings)
+    if blob.count("\0") != len(strings) - 1:
+        return list(map(_escape, strings))
+    return _escape(blob).split("\0")
+
+
+def _strings(out: list[str], items: list[str]) -> None:
+    """Append a bracketed list of quoted strings."""
+    if items:
+        out += ('["', '","'.join(_escape_all(items)), '"]')
+    else:
+        out.append("[]")
+
+
+def _aterm(
+    drv: Derivation | FrozenDerivation,
+    input_drvs: dict[str, list[str]] | None = None,
+    mask_outputs: bool = False,
+) -> list[str]:
+    """The ATerm text of *drv* as a list of pieces, in one pass.
+
+    input_drvs replaces drv.input_drvs, and mask_outputs blanks output
+    paths in .outputs and .env — the two rewrites hash_derivation_modulo
+    needs, done while writing instead of on a copied Derivation.
+    """
+    if input_drvs is None:
+        input_drvs = drv.input_drvs
+    out = ["Derive(["]
 
     # outputs (sorted by name)
-    out_parts = []
+    sep = '("'
     for name in sorted(drv.outputs):
         o = drv.outputs[name]
-        out_parts.append(f'("{_escape(name)}","{_escape(o.path)}","{_escape(o.hash_algo)}","{_escape(o.hash_value)}")')
-    parts.append("[" + ",".join(out_parts) + "]")
-
-    parts.append(",")
+        path = "" if mask_outputs else _escape(o.path)
+        out += (sep, _escape(name), '","', path, '","', _escape(o.hash_algo), '","', _escape(o.hash_value), '")')
+        sep = ',("'
+    out.append("],[")
 
     # inputDrvs (sorted by path)
-    drv_parts = []
-    for path in sorted(drv.input_drvs):
-        outs = ",".join(f'"{_escape(o)}"' for o in sorted(drv.input_drvs[path]))
-        drv_parts.append(f'("{_escape(path)}",[{outs}])')
-    parts.append("[" + ",".join(drv_parts) + "]")
-
-    parts.append(",")
+    sep = '("'
+    for path in sorted(input_drvs):
+        out += (sep, _escape(path), '",')
+        _strings(out, sorted(input_drvs[path]))
+        out.append(")")
+        sep = ',("'
+    out.append("],")
 
     # inputSrcs (sorted)
-    parts.append("[" + ",".join(f'"{_escape(s)}"' for s in sorted(drv.input_srcs)) + "]")
-
-    parts.append(",")
-    parts.append(f'"{_escape(drv.platform)}"')
-    parts.append(",")
-    parts.append(f'"{_escape(drv.builder)}"')
-    parts.append(",")
+    _strings(out, sorted(drv.input_srcs))
+    out += (',"', _escape(drv.platform), '","', _escape(drv.builder), '",')
 
     # args
-    parts.append("[" + ",".join(f'"{_escape(a)}"' for a in drv.args) + "]")
-
-    parts.append(",")
+    _strings(out, drv.args)
+    out.append(",[")
 
     # env (sorted by key)
-    env_parts = []
-    for key in sorted(drv.env):
-        env_parts.append(f'("{_escape(key)}","{_escape(drv.env[key])}")')
-    parts.append("[" + ",".join(env_parts) + "]")
+    keys = sorted(drv.env)
+    if keys:
+        masked = drv.outputs if mask_outputs else ()
+        values = ["" if key in masked else drv.env[key] for key in keys]
+        escaped = _escape_all(keys + values)
+        pairs = zip(escaped[:len(keys)], escaped[len(keys):])
+        out += ('("', '"),("'.join(map('","'.join, pairs)), '")')
+    out.append("])")
+    return out
+
+
+def serialize(drv: Derivation | FrozenDerivation) -> str:
+    """Serialize a Derivation to ATerm .drv format."""
+    return "".join(_aterm(drv))
+
 
-    parts.append(")")
-    return "".join(parts)
+def _is_fixed_output(drv: Derivation | FrozenDerivation) -> bool:
+    return len(drv.outputs) == 1 and "out" in drv.outputs and drv.outputs["out"].hash_algo != ""
 
 
 def hash_derivation_modulo(
-    drv: Derivation,
+    drv: Derivation | FrozenDerivation,
     drv_hashes: dict[str, bytes] | None = None,
     mask_outputs: bool = True,
 ) -> bytes:
@@ -257,11 +680,7 @@ def hash_derivation_modulo(
     drv_hashes = drv_hashes or {}
 
     # Fixed-output: hash depends only on the expected output, not the build process
-    if (
-        len(drv.outputs) == 1
-        and "out" in drv.outputs
-        and drv.outputs["out"].hash_algo != ""
-    ):
+    if _is_fixed_output(drv):
         o = drv.outputs["out"]
         return sha256(f"fixed:out:{o.hash_algo}:{o.hash_value}:{o.path}".encode())
 
@@ -274,33 +693,135 @@ def hash_derivation_modulo(
             raise ValueError(f"missing hash for input derivation: {drv_path}")
         replaced_input_drvs[hash_hex] = sorted(drv.input_drvs[drv_path])
 
-    if mask_outputs:
-        # staticOutputHashes path: blank output paths in both .outputs and .env
-        # to break the circular dependency when computing our OWN output paths.
-        masked_env = {k: v for k, v in drv.env.items()}
-        for name in drv.outputs:
-            if name in masked_env:
-                masked_env[name] = ""
-        masked = Derivation(
-            outputs={name: DerivationOutput("", o.hash_algo, o.hash_value) for name, o in drv.outputs.items()},
-            input_drvs=replaced_input_drvs,
-            input_srcs=list(drv.input_srcs),
-            platform=drv.platform,
-            builder=drv.builder,
-            args=list(drv.args),
-            env=masked_env,
-        )
-    else:
-        # pathDerivationModulo path: keep output paths and env as-is.
-        # Only replace input drv paths with their hashes.
-        masked = Derivation(
-            outputs={name: DerivationOutput(o.path, o.hash_algo, o.hash_value) for name, o in drv.outputs.items()},
-            input_drvs=replaced_input_drvs,
-            input_srcs=list(drv.input_srcs),
-            platform=drv.platform,
-            builder=drv.builder,
-            args=list(drv.args),
-            env=dict(drv.env),
-        )
+    # staticOutputHashes (mask_outputs=True) blanks output paths in both
+    # .outputs and .env to break the circular dependency when computing
+    # our OWN output paths; pathDerivationModulo keeps them. Either way
+    # the rewrite happens while serializing, without a masked copy.
+    return sha256("".join(_aterm(drv, replaced_input_drvs, mask_outputs)).encode())
+
+
+def _drv_name(drv_path: str, drv: Derivation) -> str:
+    """Derivation name: the store path's name part, minus ".drv"."""
+    base = os.path.basename(drv_path)
+    if base.endswith(".drv") and len(base) > 37 and base[32] == "-":
+        return base[33:-4]
+    return drv.env["name"]
+
+
+class DrvHashEngine:
+    """hash_derivation_modulo for a whole closure, each node hashed once.
+
+    hash_derivation_modulo() needs the (unmasked) hashes of all input
+    derivations up front. The engine loads .drv files through *loader*,
+    walks their inputs depth-first without recursion, and hashes every
+    node after its inputs — so each derivation in the DAG is hashed
+    exactly once per mask mode, however many dependents share it.
+
+    Results are cached by drv path. A .drv store path is derived from the
+    file's content, so the path alone identifies the result. A path
+    outside the store says nothing about what the file holds now, so
+    such results live only as long as the engine.
+
+    With *cache_file*, the store-path results are loaded from and saved
+    to a JSON file, so a later run over the same closure reads no .drv
+    files at all.
+
+        engine = DrvHashEngine()
+        engine.output_paths("/nix/store/...-hello-2.12.2.drv")
+    """
 
-    return sha256(serialize(masked).encode())
+    def __init__(self, loader: Callable[[str], Derivation] = read_drv, cache_file: str | None = None):
+        self._loader = loader
+        self._drvs: dict[str, Derivation] = {}
+        self._by_path: dict[tuple[str, bool], bytes] = {}
+        self.cache_file = cache_file
+        self.computed = 0  # hash_derivation_modulo calls, i.e. cache misses
+        if cache_file is not None and os.path.exists(cache_file):
+            self.load(cache_file)
+
+    def derivation(self, drv_path: str) -> Derivation:
+        drv = self._drvs.get(drv_path)
+        if drv is None:
+            drv = self._drvs[drv_path] = self._loader(drv_path)
+        return drv
+
+    def hash(self, drv_path: str, mask_outputs: bool = False) -> bytes:
+        """Modular hash of the .drv at *drv_path*.
+
+        mask_outputs=False is the hash dependents see (pathDerivationModulo);
+        True is the one its own output paths are computed from.
+        """
+        h = self._by_path.get((drv_path, mask_outputs))
+        if h is not None:
+            return h
+        drv = self.derivation(drv_path)
+        self._hash_inputs(drv)
+        h = self._by_path[(drv_path, mask_outputs)] = self._modulo(drv, mask_outputs)
+        return h
+
+    def hash_drv(self, drv: Derivation, mask_outputs: bool = True) -> bytes:
+        """Modular hash of an in-memory derivation; its inputs come from the cache.
+
+        The derivation itself is not cached: a content key would cost the
+        same serialization and SHA-256 as the hash it saves.
+        """
+        self._hash_inputs(drv)
+        return self._modulo(drv, mask_outputs)
+
+    def output_paths(self, drv_path: str) -> dict[str, str]:
+        """Recompute the output paths of *drv_path* from its inputs.
+
+        Compare with derivation(drv_path).outputs to verify a .drv.
+        """
+        drv = self.derivation(drv_path)
+        name = _drv_name(drv_path, drv)
+        if _is_fixed_output(drv):
+            o = drv.outputs["out"]
+            recursive = o.hash_algo.startswith("r:")
+            algo = o.hash_algo.removeprefix("r:")
+            return {"out": make_fixed_output_path(name, algo, bytes.fromhex(o.hash_value), recursive)}
+        h = self.hash(drv_path, mask_outputs=True)
+        return {out: make_output_path(h, out, name) for out in drv.outputs}
+
+    def _hash_inputs(self, drv: Derivation) -> None:
+        """Fill the unmasked hash of every transitive input, inputs first."""
+        stack = [(dep, False) for dep in drv.input_drvs]
+        while stack:
+            path, expanded = stack.pop()
+            if (path, False) in self._by_path:
+                continue
+            node = self.derivation(path)
+            if expanded:
+                self._by_path[(path, False)] = self._modulo(node, False)
+                continue
+            stack.append((path, True))
+            stack.extend((dep, False) for dep in node.input_drvs if (dep, False) not in self._by_path)
+
+    def _modulo(self, drv: Derivation, mask_outputs: bool) -> bytes:
+        self.computed += 1
+        inputs = {path: self._by_path[(path, False)] for path in drv.input_drvs}
+        return hash_derivation_modulo(drv, inputs, mask_outputs=mask_outputs)
+
+    def save(self, cache_file: str | None = None) -> None:
+        """Write the store-path results as JSON (atomically, via a temporary file)."""
+        cache_file = cache_file or self.cache_file
+        if cache_file is None:
+            raise ValueError("no cache file given")
+        paths: dict[str, dict[str, str]] = {}
+        for (path, masked), h in self._by_path.items():
+            if path.startswith(STORE_DIR + "/"):
+                paths.setdefault(path, {})["masked" if masked else "modulo"] = h.hex()
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 2, "paths": paths}, f)
+        os.replace(tmp, cache_file)
+
+    def load(self, cache_file: str) -> None:
+        """Merge the results saved in *cache_file* into this engine."""
+        with open(cache_file) as f:
+            data = json.load(f)
+        if data.get("version") != 2:
+            raise ValueError(f"unsupported drv hash cache version: {data.get('version')!r}")
+        for path, hashes in data["paths"].items():
+            for mode, h in hashes.items():
+                self._by_path[(path, mode == "masked")] = bytes.fromhex(h)
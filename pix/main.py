@@ -3,40 +3,109 @@
 
 import argparse
 import json
+import sqlite3
 import sys
 
-from pix import base32, hash as nixhash, nar, store_path, derivation, daemon
+from pix import hash as nixhash, activity, nar, nar_cache, narinfo, store_path, derivation, daemon
+
+
+def _nar_hash(args) -> bytes:
+    """NAR hash of args.path, through the persistent cache unless --no-cache."""
+    if args.no_cache:
+        return nar.nar_hash(args.path, workers=args.jobs)
+    try:
+        with nar_cache.NarHashCache() as cache:
+            return cache.nar_hash(args.path, workers=args.jobs)
+    except (OSError, sqlite3.Error):
+        # Unwritable cache dir, locked or corrupt database — still answer,
+        # just without caching.
+        return nar.nar_hash(args.path, workers=args.jobs)
+
+
+def _hash_encoding(args) -> str:
+    if args.sri:
+        return "sri"
+    if args.base64:
+        return "base64"
+    return "base32" if args.base32 else "base16"
+
+
+def _add_hash_format_flags(p) -> None:
+    group = p.add_mutually_exclusive_group()
+    group.add_argument("--base32", action="store_true", help="Output in Nix base32")
+    group.add_argument("--base64", action="store_true", help="Output in base64")
+    group.add_argument("--sri", action="store_true", help="Output as an SRI hash (algo-base64)")
 
 
 def cmd_hash_path(args):
-    h = nar.nar_hash(args.path)
-    if args.base32:
-        print(f"sha256:{base32.encode(h)}")
-    else:
-        print(f"sha256:{h.hex()}")
+    h = _nar_hash(args)
+    print(nixhash.format_hash("sha256", h, _hash_encoding(args)))
 
 
 def cmd_hash_file(args):
-    import hashlib
-    data = open(args.path, "rb").read()
-    h = hashlib.sha256(data).digest()
-    if args.base32:
-        print(f"sha256:{base32.encode(h)}")
-    else:
-        print(f"sha256:{h.hex()}")
+    h = nixhash.hash_file(args.path, args.algo)
+    print(h.format(_hash_encoding(args)))
 
 
 def cmd_store_path(args):
-    h = nar.nar_hash(args.path)
+    h = _nar_hash(args)
     name = args.name or args.path.rstrip("/").split("/")[-1]
     sp = store_path.make_source_store_path(name, h)
     print(sp)
 
 
-def cmd_drv_show(args):
-    text = open(args.drv_path).read()
-    drv = derivation.parse(text)
-    info = {
+def cmd_dump_path(args):
+    out = sys.stdout.buffer
+    if args.ls:
+        listing = nar.nar_dump_with_listing(args.path, out)
+        with open(args.ls, "w") as f:
+            json.dump(listing, f)
+    else:
+        nar.nar_dump(args.path, out)
+    out.flush()
+
+
+def _nar_accessor(args) -> nar.NarAccessor:
+    listing = None
+    if args.listing:
+        with open(args.listing) as f:
+            listing = json.load(f)
+    return nar.NarAccessor(args.nar, listing)
+
+
+def cmd_nar_ls(args):
+    with _nar_accessor(args) as acc:
+        node = acc.ls(args.path)
+        if args.json:
+            json.dump(node, sys.stdout, indent=2)
+            print()
+            return
+
+        def show(node, path, top=False):
+            suffix = ""
+            if node["type"] == "directory":
+                suffix = "/"
+            elif node["type"] == "symlink":
+                suffix = f" -> {node['target']}"
+            elif node.get("executable"):
+                suffix = "*"
+            print(f"{path or '.'}{suffix}")
+            if node["type"] == "directory" and (args.recursive or top):
+                for name, child in node["entries"].items():
+                    show(child, f"{path}/{name}" if path else name)
+
+        show(node, args.path.strip("/"), top=True)
+
+
+def cmd_nar_cat(args):
+    with _nar_accessor(args) as acc:
+        with acc.view(args.path) as data:
+            sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+def _drv_json(drv: derivation.Derivation) -> dict:
+    return {
         "outputs": {k: {"path": v.path, "hashAlgo": v.hash_algo, "hash": v.hash_value} for k, v in drv.outputs.items()},
         "inputDrvs": drv.input_drvs,
         "inputSrcs": drv.input_srcs,
@@ -45,12 +114,20 @@ def cmd_drv_show(args):
         "args": drv.args,
         "env": drv.env,
     }
+
+
+def cmd_drv_show(args):
+    if args.recursive:
+        closure = derivation.load_closure(args.drv_path, workers=args.jobs)
+        info = {path: _drv_json(closure[path]) for path in sorted(closure)}
+    else:
+        info = _drv_json(derivation.read_drv(args.drv_path))
     json.dump(info, sys.stdout, indent=2)
     print()
 
 
 def cmd_path_info(args):
-    with daemon.DaemonConnection() as conn:
+    with daemon.default_pool().checkout() as conn:
         info = conn.query_path_info(args.path)
         print(f"deriver: {info.deriver}")
         print(f"nar-hash: {info.nar_hash}")
@@ -59,8 +136,16 @@ def cmd_path_info(args):
         print(f"sigs: {' '.join(info.sigs)}")
 
 
+def cmd_closure(args):
+    with daemon.default_pool().checkout() as conn:
+        closure = conn.compute_closure(args.paths, include_outputs=args.include_outputs)
+    for path in closure.paths:
+        print(path)
+    print(f"{len(closure)} paths, {closure.nar_size} bytes (NAR)", file=sys.stderr)
+
+
 def cmd_is_valid(args):
-    with daemon.DaemonConnection() as conn:
+    with daemon.default_pool().checkout() as conn:
         valid = conn.is_valid_path(args.path)
         print("valid" if valid else "invalid")
         sys.exit(0 if valid else 1)
@@ -68,14 +153,67 @@ def cmd_is_valid(args):
 
 def cmd_add_text(args):
     content = sys.stdin.read() if args.content == "-" else args.content
-    with daemon.DaemonConnection() as conn:
+    with daemon.default_pool().checkout() as conn:
         path = conn.add_text_to_store(args.name, content)
         print(path)
 
 
+def cmd_add_path(args):
+    with daemon.default_pool().checkout() as conn:
+        print(conn.add_path_to_store(args.path, name=args.name))
+
+
+def _narinfo_nar(info: narinfo.NarInfo, cache_dir: str):
+    """The (decompressed) NAR of a .narinfo entry, opened only when read."""
+    with info.open_nar(cache_dir) as f:
+        while chunk := f.read(nar.CHUNK_SIZE):
+            yield chunk
+
+
+def cmd_import_paths(args):
+    infos = narinfo.read_dir(args.dir)
+    with daemon.default_pool().checkout() as conn:
+        valid = conn.query_valid_paths([i.store_path for i in infos]) if infos else set()
+        todo = [i for i in infos if i.store_path not in valid]
+        # Fail before the upload starts: a NAR that cannot be opened midway
+        # through the framed stream aborts the whole operation.
+        for i in todo:
+            i.check_nar(args.dir)
+        items = (
+            (
+                daemon.PathInfo(
+                    deriver=i.deriver,
+                    nar_hash=i.nar_hash,
+                    references=i.references,
+                    registration_time=0,
+                    nar_size=i.nar_size,
+                    sigs=i.sigs,
+                    path=i.store_path,
+                    ca=i.ca,
+                ),
+                _narinfo_nar(i, args.dir),
+            )
+            for i in todo
+        )
+        for path in conn.add_multiple_to_store(items, dont_check_sigs=args.no_check_sigs):
+            print(path)
+    print(f"imported {len(todo)} paths ({len(infos) - len(todo)} already valid)", file=sys.stderr)
+
+
 def cmd_build(args):
-    with daemon.DaemonConnection() as conn:
-        conn.build_paths(args.paths)
+    progress = None if args.no_progress else activity.ProgressRenderer()
+    report = activity.BuildReport() if args.report else None
+    with daemon.default_pool().checkout() as conn, conn.events(activity.tee(progress, report)):
+        try:
+            conn.build_paths(args.paths)
+        finally:
+            if progress:
+                progress.finish()
+            if report:
+                report.finish()
+                text = report.to_prometheus() if args.report_format == "prometheus" else report.to_json() + "\n"
+                with open(args.report, "w") as f:
+                    f.write(text)
         print("build succeeded")
 
 
@@ -86,24 +224,53 @@ def main():
     # hash-path
     p = sub.add_parser("hash-path", help="Hash a path in NAR format")
     p.add_argument("path")
-    p.add_argument("--base32", action="store_true")
+    _add_hash_format_flags(p)
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Threads reading files ahead")
+    p.add_argument("--no-cache", action="store_true", help="Ignore the persistent NAR hash cache")
     p.set_defaults(func=cmd_hash_path)
 
     # hash-file
     p = sub.add_parser("hash-file", help="Hash a file (flat, not NAR)")
     p.add_argument("path")
-    p.add_argument("--base32", action="store_true")
+    p.add_argument("--algo", default="sha256", choices=sorted(nixhash.ALGORITHMS))
+    _add_hash_format_flags(p)
     p.set_defaults(func=cmd_hash_file)
 
     # store-path
     p = sub.add_parser("store-path", help="Compute store path for a local path")
     p.add_argument("path")
     p.add_argument("--name", help="Override the store name")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Threads reading files ahead")
+    p.add_argument("--no-cache", action="store_true", help="Ignore the persistent NAR hash cache")
     p.set_defaults(func=cmd_store_path)
 
+    # dump-path
+    p = sub.add_parser("dump-path", help="Write the NAR serialization of a path to stdout")
+    p.add_argument("path")
+    p.add_argument("--ls", metavar="FILE", help="Also write the NAR listing (.ls JSON) to FILE")
+    p.set_defaults(func=cmd_dump_path)
+
+    # nar-ls
+    p = sub.add_parser("nar-ls", help="List the contents of a NAR file")
+    p.add_argument("nar")
+    p.add_argument("path", nargs="?", default="", help="Path inside the NAR (default: root)")
+    p.add_argument("-R", "--recursive", action="store_true")
+    p.add_argument("--json", action="store_true", help="Print the listing node as JSON")
+    p.add_argument("--listing", metavar="FILE", help="Use this .ls file instead of scanning the NAR")
+    p.set_defaults(func=cmd_nar_ls)
+
+    # nar-cat
+    p = sub.add_parser("nar-cat", help="Print a file from inside a NAR file")
+    p.add_argument("nar")
+    p.add_argument("path", help="Path inside the NAR")
+    p.add_argument("--listing", metavar="FILE", help="Use this .ls file instead of scanning the NAR")
+    p.set_defaults(func=cmd_nar_cat)
+
     # drv-show
     p = sub.add_parser("drv-show", help="Show parsed .drv file as JSON")
     p.add_argument("drv_path")
+    p.add_argument("-r", "--recursive", action="store_true", help="Include every input derivation, keyed by path")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Parser processes for --recursive")
     p.set_defaults(func=cmd_drv_show)
 
     # path-info
@@ -111,6 +278,12 @@ def main():
     p.add_argument("path")
     p.set_defaults(func=cmd_path_info)
 
+    # closure
+    p = sub.add_parser("closure", help="List the closure of store paths and its total NAR size")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--include-outputs", action="store_true", help="Also follow the outputs of derivations in the closure")
+    p.set_defaults(func=cmd_closure)
+
     # is-valid
     p = sub.add_parser("is-valid", help="Check if a store path is valid")
     p.add_argument("path")
@@ -122,9 +295,24 @@ def main():
     p.add_argument("content", nargs="?", default="-", help="Text content (or - for stdin)")
     p.set_defaults(func=cmd_add_text)
 
+    # add-path
+    p = sub.add_parser("add-path", help="Add a file or directory to the store (streams its NAR)")
+    p.add_argument("path")
+    p.add_argument("--name", help="Override the store name")
+    p.set_defaults(func=cmd_add_path)
+
+    # import-paths
+    p = sub.add_parser("import-paths", help="Import every path of a binary cache directory (.narinfo + NAR)")
+    p.add_argument("dir")
+    p.add_argument("--no-check-sigs", action="store_true", help="Ask the daemon not to require signatures")
+    p.set_defaults(func=cmd_import_paths)
+
     # build
     p = sub.add_parser("build", help="Build store paths")
     p.add_argument("paths", nargs="+")
+    p.add_argument("--no-progress", action="store_true", help="Don't show build logs and progress")
+    p.add_argument("--report", metavar="FILE", help="Write build timings and transfer totals to FILE")
+    p.add_argument("--report-format", choices=["json", "prometheus"], default="json", help="Format of --report")
     p.set_defaults(func=cmd_build)
 
     args = parser.parse_args()
@@ -19,13 +19,24 @@ Grammar (where str(x) is the wire encoding above):
     | str("directory") { str("entry") str("(") str("name") str(<n>) str("node") <recurse> str(")") }
     str(")")
 
-See: nix/src/libutil/archive.cc — dump(), dumpContents()
+Reading goes the other way: NarReader parses a stream back into entries,
+and nar_restore() unpacks one onto the filesystem.
+
+See: nix/src/libutil/archive.cc — dump(), dumpContents(), parseDump()
 """
 
 import hashlib
+import mmap
 import os
+import socket
+import stat
 import struct
+from collections import deque
+from collections.abc import Generator, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import BinaryIO
 
 
 def _pad8(n: int) -> int:
@@ -41,64 +52,595 @@ def _str(s: str | bytes) -> bytes:
     return struct.pack("<Q", len(s)) + s + b"\0" * _pad8(len(s))
 
 
+# Files are read, and NAR output is buffered, in pieces of this size.
+CHUNK_SIZE = 64 * 1024
+
+# Parallel hashing reads files up to this size ahead of the serializer.
+PREFETCH_LIMIT = 1024 * 1024
+
+
 def nar_serialize(path: str | Path) -> bytes:
-    """Serialize a filesystem path to NAR bytes."""
-    parts: list[bytes] = []
-    _serialize(Path(path), parts)
-    return b"".join(parts)
-
-
-def _serialize(path: Path, parts: list[bytes]) -> None:
-    parts.append(_str("nix-archive-1"))
-    _serialize_entry(path, parts)
-
-
-def _serialize_entry(path: Path, parts: list[bytes]) -> None:
-    parts.append(_str("("))
-
-    if path.is_symlink():
-        parts.append(_str("type"))
-        parts.append(_str("symlink"))
-        parts.append(_str("target"))
-        parts.append(_str(os.readlink(path)))
-
-    elif path.is_file():
-        parts.append(_str("type"))
-        parts.append(_str("regular"))
-        # NAR only preserves the executable bit — all other permission
-        # bits, ownership, and timestamps are discarded for reproducibility.
-        if os.access(path, os.X_OK):
-            parts.append(_str("executable"))
-            parts.append(_str(""))
-        parts.append(_str("contents"))
-        data = path.read_bytes()
-        parts.append(_str(data))
-
-    elif path.is_dir():
-        parts.append(_str("type"))
-        parts.append(_str("directory"))
-        # Entries MUST be sorted — this is what makes NAR deterministic.
-        # Without sorting, directory enumeration order would vary by
-        # filesystem and OS, producing different hashes for identical content.
+    """Serialize a filesystem path to NAR bytes.
+
+    Holds the whole archive in memory — use nar_stream() or nar_dump()
+    for large trees.
+    """
+    return b"".join(nar_stream(path))
+
+
+def nar_stream(path: str | Path, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Serialize a filesystem path to NAR, yielding it in pieces.
+
+    The small wire tokens (keywords, names, length prefixes) are coalesced
+    into buffers of about chunk_size bytes, and file contents are read
+    chunk_size bytes at a time, so memory use is bounded no matter how
+    large the tree is. b"".join(nar_stream(p)) == nar_serialize(p).
+    """
+    for chunk in _chunks(_Dumper(chunk_size), Path(path)):
+        # Large-file chunks are views into a buffer that gets reused for
+        # the next read — copy them before handing them to the caller.
+        yield chunk if isinstance(chunk, bytes) else bytes(chunk)
+
+
+def nar_dump(path: str | Path, fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> int:
+    """Write the NAR serialization of path to a binary file object.
+
+    Returns the number of bytes written (the NAR size).
+    """
+    size = 0
+    for chunk in _chunks(_Dumper(chunk_size), Path(path)):
+        fileobj.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def nar_dump_with_listing(path: str | Path, fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> dict:
+    """Like nar_dump(), and also return the NAR's listing (a binary cache .ls file).
+
+    The listing describes every node, and gives each regular file's
+    narOffset — where its contents start in the NAR — so one file can later
+    be read straight out of the archive (see NarAccessor):
+
+        {"version": 1, "root": {"type": "directory", "entries": {
+            "hello.txt": {"type": "regular", "size": 5, "narOffset": 192},
+            "bin": {"type": "directory", "entries": {...}},
+            "link": {"type": "symlink", "target": "hello.txt"}}}}
+
+    It is built while dumping, from the dumper's own output position.
+    See: nix/src/libstore/nar-accessor.cc — listNar()
+    """
+    dumper = _Dumper(chunk_size, listing=True)
+    for chunk in _chunks(dumper, Path(path)):
+        fileobj.write(chunk)
+    return {"version": 1, "root": dumper.root}
+
+
+def _chunks(dumper: "_Dumper", path: Path) -> Iterator[bytes | memoryview]:
+    """The NAR of path as buffers of about chunk_size bytes.
+
+    A memoryview chunk is only valid until the next one is requested:
+    it points into the read buffer, which is refilled in place.
+    """
+    chunk_size = len(dumper.view)
+    buf = bytearray()
+    for piece in dumper.dump(path):
+        if not buf and len(piece) >= chunk_size:
+            yield piece
+            continue
+        buf += piece
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+class _Dumper:
+    """Walks a tree and yields its NAR serialization in pieces.
+
+    Keeps count of the bytes it has produced (pos), which is what lets it
+    note each file's narOffset for the listing without a second pass. With
+    listing=True, each _entry() returns its node of the listing and the
+    whole tree ends up in .root.
+    """
+
+    def __init__(self, chunk_size: int, prefetch: "_Prefetcher | None" = None, listing: bool = False):
+        self.view = memoryview(bytearray(chunk_size))  # reused for large-file reads
+        self.prefetch = prefetch
+        self.listing = listing
+        self.pos = 0
+        self.root: dict | None = None
+
+    def _tokens(self, *words: str | bytes) -> bytes:
+        out = b"".join(_str(w) for w in words)
+        self.pos += len(out)
+        return out
+
+    def dump(self, path: Path) -> Iterator[bytes | memoryview]:
+        yield self._tokens("nix-archive-1")
+        self.root = yield from self._entry(path)
+
+    def _entry(self, path: Path) -> Generator[bytes | memoryview, None, dict | None]:
+        if path.is_symlink():
+            target = os.readlink(path)
+            yield self._tokens("(", "type", "symlink", "target", target, ")")
+            return {"type": "symlink", "target": target} if self.listing else None
+
+        elif path.is_file():
+            # NAR only preserves the executable bit — all other permission
+            # bits, ownership, and timestamps are discarded for reproducibility.
+            executable = os.access(path, os.X_OK)
+            flag = ("executable", "") if executable else ()
+            yield self._tokens("(", "type", "regular", *flag, "contents")
+            offset = self.pos + 8  # contents start after their length prefix
+            size = yield from self._contents(path)
+            yield self._tokens(")")
+            if not self.listing:
+                return None
+            node = {"type": "regular", "size": size}
+            if executable:
+                node["executable"] = True
+            node["narOffset"] = offset
+            return node
+
+        elif path.is_dir():
+            yield self._tokens("(", "type", "directory")
+            entries = {}
+            # Entries MUST be sorted — this is what makes NAR deterministic.
+            # Without sorting, directory enumeration order would vary by
+            # filesystem and OS, producing different hashes for identical content.
+            for entry_name in sorted(os.listdir(path)):
+                yield self._tokens("entry", "(", "name", entry_name, "node")
+                entries[entry_name] = yield from self._entry(path / entry_name)
+                yield self._tokens(")")
+            yield self._tokens(")")
+            return {"type": "directory", "entries": entries} if self.listing else None
+
+        else:
+            raise ValueError(f"unsupported file type: {path}")
+
+    def _contents(self, path: Path) -> Generator[bytes | memoryview, None, int]:
+        """File contents in wire format: length prefix, data, padding. Returns the size.
+
+        Same bytes as _str(path.read_bytes()), without ever holding the whole
+        file: the length comes from fstat(), and anything bigger than the read
+        buffer is streamed through it with readinto(), so a large file costs
+        no allocations at all. Files that fit in the buffer take a single
+        read() — one syscall, and cheaper than slicing a view for tiny files.
+        """
+        data = self.prefetch.take(path) if self.prefetch else None
+        if data is not None:
+            yield self._tokens(data)
+            return len(data)
+
+        view = self.view
+        with open(path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            yield struct.pack("<Q", size)
+            if size <= len(view):
+                data = f.read(size)
+                if len(data) != size:
+                    raise ValueError(f"file shrank while reading: {path}")
+                yield data
+            else:
+                remaining = size
+                while remaining:
+                    n = f.readinto(view[:min(len(view), remaining)])
+                    if not n:
+                        raise ValueError(f"file shrank while reading: {path}")
+                    remaining -= n
+                    yield view[:n]
+        yield b"\0" * _pad8(size)
+        self.pos += 8 + size + _pad8(size)
+        return size
+
+
+class _Prefetcher:
+    """Reads small files on a thread pool, ahead of the serializer.
+
+    The NAR hash is one SHA-256 over one sequential stream, so the hashing
+    itself cannot be split across threads without changing the result.
+    What can overlap is the I/O: while the consumer hashes the current
+    file, workers are already reading the next few, in NAR order. Large
+    files are left to the consumer, which streams them through its buffer
+    (the kernel's readahead already keeps one big sequential read busy).
+    """
+
+    def __init__(self, root: Path, pool: ThreadPoolExecutor, window: int, limit: int = PREFETCH_LIMIT):
+        self._files = _small_files(root, limit)
+        self._pool = pool
+        self._window = window
+        self._pending: deque[tuple[Path, Future]] = deque()
+
+    def take(self, path: Path) -> bytes | None:
+        """Contents of path if it was read ahead, else None (read it yourself).
+
+        Read-aheads of paths that sort before path are dropped: the tree
+        changed under the walk and the serializer will never ask for
+        them. Left queued, they would hide every later read-ahead.
+        """
+        key = path.parts
+        while True:
+            while len(self._pending) < self._window:
+                nxt = next(self._files, None)
+                if nxt is None:
+                    break
+                self._pending.append((nxt, self._pool.submit(_read_file, nxt)))
+            if not self._pending or self._pending[0][0].parts >= key:
+                break
+            while self._pending and self._pending[0][0].parts < key:
+                self._pending.popleft()[1].cancel()
+        if self._pending and self._pending[0][0] == path:
+            return self._pending.popleft()[1].result()
+        return None
+
+
+def _small_files(path: Path, limit: int) -> Iterator[Path]:
+    """Regular files of at most limit bytes, in the order _Dumper visits them."""
+    st = path.lstat()
+    if stat.S_ISREG(st.st_mode):
+        if st.st_size <= limit:
+            yield path
+    elif stat.S_ISDIR(st.st_mode):
         for entry_name in sorted(os.listdir(path)):
-            parts.append(_str("entry"))
-            parts.append(_str("("))
-            parts.append(_str("name"))
-            parts.append(_str(entry_name))
-            parts.append(_str("node"))
-            _serialize_entry(path / entry_name, parts)
-            parts.append(_str(")"))
-    else:
-        raise ValueError(f"unsupported file type: {path}")
+            yield from _small_files(path / entry_name, limit)
+
+
+def _read_file(path: Path) -> bytes:
+    with open(path, "rb", buffering=0) as f:
+        return f.readall()
 
-    parts.append(_str(")"))
 
+def _nar_sha256(path: str | Path, workers: int = 1):
+    h = hashlib.sha256()
+    if workers <= 1:
+        for chunk in _chunks(_Dumper(CHUNK_SIZE), Path(path)):
+            h.update(chunk)
+        return h
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        prefetch = _Prefetcher(Path(path), pool, window=4 * workers)
+        for chunk in _chunks(_Dumper(CHUNK_SIZE, prefetch), Path(path)):
+            h.update(chunk)
+    return h
 
-def nar_hash(path: str | Path) -> bytes:
-    """SHA-256 of the NAR serialization. This is what `nix hash path` computes."""
-    return hashlib.sha256(nar_serialize(path)).digest()
 
+def nar_hash(path: str | Path, workers: int = 1) -> bytes:
+    """SHA-256 of the NAR serialization. This is what `nix hash path` computes.
 
-def nar_hash_hex(path: str | Path) -> str:
+    Streams the archive through the hash, so memory use is constant.
+    With workers > 1, small files are read ahead on that many threads
+    (see _Prefetcher); the result is byte-for-byte the same.
+    """
+    return _nar_sha256(path, workers).digest()
+
+
+def nar_hash_hex(path: str | Path, workers: int = 1) -> str:
     """SHA-256 of the NAR serialization, as hex."""
-    return hashlib.sha256(nar_serialize(path)).hexdigest()
+    return _nar_sha256(path, workers).hexdigest()
+
+
+# --- Reading NARs ---
+#
+# The reverse direction: parse a NAR stream back into a tree. The grammar is
+# the same as above; the reader walks it with one read buffer, so arbitrarily
+# large files pass through in chunk_size pieces.
+#
+# See: nix/src/libutil/archive.cc — parseDump(), restorePath()
+
+# Longest name or symlink target accepted (PATH_MAX). Only file contents
+# may be longer — everything else is a keyword, a name or a target.
+MAX_NAME = 4096
+
+
+@dataclass
+class NarEntry:
+    """One node of a NAR, as produced by NarReader."""
+
+    path: str  # "/"-separated, relative to the root; "" is the root itself
+    type: str  # "regular", "directory" or "symlink"
+    executable: bool = False
+    size: int = 0  # length of the contents (regular files)
+    target: str = ""  # symlink target
+    nar_offset: int = 0  # where the contents start in the NAR (regular files)
+
+
+class NarReader:
+    """Incremental NAR parser.
+
+    Iterating yields a NarEntry per node, parents before children. After a
+    "regular" entry, read_contents() yields its data in chunks; contents
+    that are not read are skipped when iteration continues.
+
+    source can be a binary file object, a socket, or a bytes-like object
+    (a memoryview is read in place, without copying).
+
+        reader = NarReader(open("foo.nar", "rb"))
+        for entry in reader:
+            if entry.type == "regular":
+                data = b"".join(reader.read_contents())
+
+    Reads fill the whole buffer, so from a stream that carries more than
+    the NAR (a daemon socket: STDERR_LAST and the reply follow) the
+    reader takes bytes past its end. Once iteration is done, leftover()
+    returns them, and size() is the length of the NAR itself.
+    """
+
+    def __init__(self, source, chunk_size: int = CHUNK_SIZE):
+        self._src = _source(source)
+        # Every token must fit in the buffer with its length and padding.
+        self._buf = bytearray(max(chunk_size, MAX_NAME + 16))
+        self._view = memoryview(self._buf)
+        self._start = 0  # unread data is _buf[_start:_end]
+        self._end = 0
+        self._base = 0  # stream offset of _buf[0]
+        self._remaining = 0  # unread contents of the current regular file
+
+    def __iter__(self) -> Iterator[NarEntry]:
+        self._expect("nix-archive-1")
+        yield from self._entry("")
+
+    def leftover(self) -> bytes:
+        """Bytes read from the source but not consumed (after the NAR, once iterated)."""
+        return bytes(self._view[self._start:self._end])
+
+    def size(self) -> int:
+        """Bytes consumed so far: the NAR's length, once iterated."""
+        return self._base + self._start
+
+    def read_contents(self) -> Iterator[bytes]:
+        """The contents of the regular file just yielded, in chunks."""
+        for view in self._content_views():
+            yield bytes(view)
+
+    # --- Buffer ---
+
+    def _fill(self) -> None:
+        """Read more data, after moving the unread tail to the front."""
+        if self._start:
+            n = self._end - self._start
+            self._buf[:n] = self._view[self._start:self._end]
+            self._base += self._start
+            self._start, self._end = 0, n
+        n = self._src.readinto(self._view[self._end:])
+        if not n:
+            raise ValueError("unexpected end of NAR")
+        self._end += n
+
+    def _read(self, n: int) -> bytes:
+        while self._end - self._start < n:
+            self._fill()
+        data = bytes(self._view[self._start:self._start + n])
+        self._start += n
+        return data
+
+    def _read_int(self) -> int:
+        return struct.unpack("<Q", self._read(8))[0]
+
+    def _read_str(self) -> bytes:
+        n = self._read_int()
+        if n > MAX_NAME:
+            raise ValueError(f"NAR string too long: {n} bytes")
+        data = self._read(n)
+        if self._read(_pad8(n)).strip(b"\0"):
+            raise ValueError("non-zero NAR padding")
+        return data
+
+    def _expect(self, word: str) -> None:
+        got = self._read_str()
+        if got != word.encode():
+            raise ValueError(f"bad NAR: expected {word!r}, got {got!r}")
+
+    def _content_views(self) -> Iterator[memoryview]:
+        """Like read_contents(), but each view is only valid until the next."""
+        while self._remaining:
+            if self._start == self._end:
+                self._base += self._end
+                self._start = self._end = 0
+                self._fill()
+            n = min(self._remaining, self._end - self._start)
+            view = self._view[self._start:self._start + n]
+            self._start += n
+            self._remaining -= n
+            yield view
+
+    # --- Grammar ---
+
+    def _entry(self, path: str) -> Iterator[NarEntry]:
+        self._expect("(")
+        self._expect("type")
+        node_type = self._read_str()
+
+        if node_type == b"regular":
+            executable = False
+            tag = self._read_str()
+            if tag == b"executable":
+                self._expect("")
+                executable = True
+                tag = self._read_str()
+            if tag != b"contents":
+                raise ValueError(f"bad NAR: expected 'contents', got {tag!r}")
+            size = self._read_int()
+            self._remaining = size
+            yield NarEntry(path, "regular", executable, size, nar_offset=self._base + self._start)
+            for _ in self._content_views():
+                pass
+            if self._read(_pad8(size)).strip(b"\0"):
+                raise ValueError("non-zero NAR padding")
+
+        elif node_type == b"symlink":
+            self._expect("target")
+            target = os.fsdecode(self._read_str())
+            yield NarEntry(path, "symlink", target=target)
+
+        elif node_type == b"directory":
+            yield NarEntry(path, "directory")
+            prev = None
+            while (tag := self._read_str()) != b")":
+                if tag != b"entry":
+                    raise ValueError(f"bad NAR: expected 'entry', got {tag!r}")
+                self._expect("(")
+                self._expect("name")
+                name = self._read_str()
+                # The same checks Nix makes: names must be plain, non-empty
+                # components (no escaping the destination), in strictly
+                # increasing order (sorted, no duplicates).
+                if not name or b"/" in name or b"\0" in name or name in (b".", b".."):
+                    raise ValueError(f"bad NAR: invalid entry name {name!r}")
+                if prev is not None and name <= prev:
+                    raise ValueError(f"bad NAR: entry {name!r} out of order")
+                prev = name
+                self._expect("node")
+                child = os.fsdecode(name)
+                yield from self._entry(f"{path}/{child}" if path else child)
+                self._expect(")")
+            return  # the directory's own ")" was consumed by the loop
+
+        else:
+            raise ValueError(f"bad NAR: unknown node type {node_type!r}")
+
+        self._expect(")")
+
+
+def nar_restore(source, dest: str | Path) -> None:
+    """Unpack a NAR into dest, which must not exist yet. Like `nix-store --restore`.
+
+    Files are written with os.write() straight from the reader's buffer, so
+    memory use is bounded by chunk size. As in Nix, only the executable bit
+    is restored; the umask decides the rest.
+    """
+    dest = Path(dest)
+    reader = NarReader(source)
+    for entry in reader:
+        target = dest / entry.path if entry.path else dest
+        if entry.type == "directory":
+            os.mkdir(target)
+        elif entry.type == "symlink":
+            os.symlink(entry.target, target)
+        else:
+            mode = 0o777 if entry.executable else 0o666
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, mode)
+            try:
+                for view in reader._content_views():
+                    while view:
+                        view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+
+
+def nar_listing(source) -> dict:
+    """The listing (.ls document) of an existing NAR, in one pass over it.
+
+    Same format as nar_dump_with_listing() returns.
+    """
+    root: dict = {}
+    nodes: dict[str, dict] = {}
+    for entry in NarReader(source):
+        if entry.type == "regular":
+            node = {"type": "regular", "size": entry.size}
+            if entry.executable:
+                node["executable"] = True
+            node["narOffset"] = entry.nar_offset
+        elif entry.type == "symlink":
+            node = {"type": "symlink", "target": entry.target}
+        else:
+            node = {"type": "directory", "entries": {}}
+        if entry.path:
+            parent, _, name = entry.path.rpartition("/")
+            nodes[parent]["entries"][name] = node
+        else:
+            root = node
+        nodes[entry.path] = node
+    return {"version": 1, "root": root}
+
+
+class NarAccessor:
+    """Random access to the files inside a NAR file.
+
+    The NAR is mmap'd, and the listing says where every file's contents
+    are, so reading one file is a slice — no parsing of everything in
+    front of it. Pass the listing if you have it (e.g. the binary cache's
+    .ls file); otherwise it is built with one pass over the archive.
+
+        with NarAccessor("foo.nar") as nar:
+            nar.ls("bin")          # the listing node for /bin
+            nar.read("bin/hello")  # bytes of /bin/hello
+    """
+
+    def __init__(self, nar_path: str | Path, listing: dict | None = None):
+        with open(nar_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if listing is None:
+            try:
+                with memoryview(self._mmap) as view:
+                    listing = nar_listing(view)
+            except Exception:
+                self._mmap.close()
+                raise
+        self.listing = listing
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ls(self, path: str = "") -> dict:
+        """The listing node at path ("" or "/" is the root)."""
+        node = self.listing["root"]
+        for name in path.strip("/").split("/") if path.strip("/") else []:
+            if node["type"] != "directory" or name not in node["entries"]:
+                raise FileNotFoundError(f"no such path in NAR: {path}")
+            node = node["entries"][name]
+        return node
+
+    def view(self, path: str) -> memoryview:
+        """Contents of a regular file, as a view into the mapped NAR.
+
+        No copy is made; the view must be released before close().
+        """
+        node = self.ls(path)
+        if node["type"] != "regular":
+            raise ValueError(f"not a regular file: {path}")
+        start = node["narOffset"]
+        return memoryview(self._mmap)[start:start + node["size"]]
+
+    def read(self, path: str) -> bytes:
+        """Contents of a regular file."""
+        with self.view(path) as v:
+            return bytes(v)
+
+
+class _BufferSource:
+    """readinto() over an in-memory buffer, without copying it first."""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class _SocketSource:
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+
+    def readinto(self, b) -> int:
+        return self._sock.recv_into(b)
+
+
+def _source(source):
+    """Adapt a NAR source to something with readinto()."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _BufferSource(source)
+    if isinstance(source, socket.socket):
+        return _SocketSource(source)
+    if hasattr(source, "readinto"):
+        return source
+    raise TypeError(f"cannot read a NAR from {type(source).__name__}")
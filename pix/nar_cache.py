@@ -0,0 +1,110 @@
+"""Persistent cache of NAR hashes, keyed by filesystem metadata.
+
+Hashing a source tree means reading every byte of it. Most of the time
+nothing changed since the last run, and that can be told from lstat()
+alone: if every entry still has the same device, inode, size, mtime,
+ctime and executable bit, the bytes are the same and so is the NAR hash.
+
+The key is a Merkle-style fingerprint of that metadata: a file's
+fingerprint hashes its stat fields, a directory's hashes its sorted
+(name, child fingerprint) pairs. Computing it costs one lstat() per
+entry instead of reading the contents.
+
+Why only whole trees are cached: the NAR hash is one SHA-256 over one
+sequential stream, so a subtree's hash cannot be spliced into its
+parent's. An unchanged subtree is still reused when it is itself hashed
+(its fingerprint is path-independent), but hashing the parent re-reads it.
+
+Safety rules:
+  - ctime is part of the key. Unlike mtime it cannot be set back by the
+    user (touch -d, tar, rsync -t), and any write updates it.
+  - "Racy" entries are never stored: if anything in the tree was
+    modified within RACY_WINDOW_NS of the hash starting, a later edit in
+    the same timestamp tick could leave every stat field unchanged. Git
+    has the same rule for its index ("racy git").
+  - The fingerprint is taken again after hashing; if the tree changed
+    while it was being read, the result is returned but not stored.
+
+The cache lives in $XDG_CACHE_HOME/pix/nar-hash.sqlite (~/.cache/... by
+default). `pix hash-path --no-cache` bypasses it.
+"""
+
+import hashlib
+import os
+import sqlite3
+import stat
+import struct
+import time
+from pathlib import Path
+
+from pix.nar import _str, nar_hash
+
+# Coarsest common mtime granularity (FAT has 2 s) — anything touched this
+# recently is too fresh to trust its timestamps.
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def default_cache_path() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base, "pix", "nar-hash.sqlite")
+
+
+def fingerprint(path: str | Path) -> tuple[bytes, int]:
+    """Metadata fingerprint of a tree, and its newest mtime/ctime in ns."""
+    st = os.lstat(path)
+    newest = max(st.st_mtime_ns, st.st_ctime_ns)
+    h = hashlib.sha256(struct.pack("<QQqq", st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns))
+
+    if stat.S_ISLNK(st.st_mode):
+        h.update(b"symlink" + _str(os.readlink(path)))
+    elif stat.S_ISREG(st.st_mode):
+        h.update(b"regular" + struct.pack("<QB", st.st_size, os.access(path, os.X_OK)))
+    elif stat.S_ISDIR(st.st_mode):
+        h.update(b"directory")
+        for name in sorted(os.listdir(path)):
+            child, child_newest = fingerprint(os.path.join(path, name))
+            h.update(_str(name) + child)
+            newest = max(newest, child_newest)
+    else:
+        raise ValueError(f"unsupported file type: {path}")
+
+    return h.digest(), newest
+
+
+class NarHashCache:
+    """On-disk map from tree fingerprint to NAR hash."""
+
+    def __init__(self, db_path: str | Path | None = None):
+        self.db_path = Path(db_path) if db_path else default_cache_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS nar_hash (fingerprint BLOB PRIMARY KEY, hash BLOB NOT NULL)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def nar_hash(self, path: str | Path, workers: int = 1) -> bytes:
+        """Like pix.nar.nar_hash, but reuses the stored hash if the tree is unchanged."""
+        start = time.time_ns()
+        fp, newest = fingerprint(path)
+        row = self.db.execute("SELECT hash FROM nar_hash WHERE fingerprint = ?", (fp,)).fetchone()
+        if row:
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
+        h = nar_hash(path, workers=workers)
+        if newest < start - RACY_WINDOW_NS and fingerprint(path)[0] == fp:
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO nar_hash VALUES (?, ?)", (fp, h))
+        return h
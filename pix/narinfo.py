@@ -0,0 +1,157 @@
+""".narinfo files: the metadata half of a binary cache entry.
+
+A binary cache (and `nix copy --to file://DIR`) stores each path as two
+files: <hash>.narinfo, a "Key: value" text file describing the path, and
+the (usually compressed) NAR it points to with URL:
+
+    StorePath: /nix/store/ffff...-hello-2.12.2
+    URL: nar/1w1f...nar.xz
+    Compression: xz
+    FileHash: sha256:1w1f...
+    FileSize: 50184
+    NarHash: sha256:0ahv...
+    NarSize: 226488
+    References: 9v5n...-glibc-2.39 ffff...-hello-2.12.2
+    Deriver: s0x1...-hello-2.12.2.drv
+    Sig: cache.nixos.org-1:Qk1Q...
+
+References and Deriver are base names, relative to the store directory.
+
+See: nix/src/libstore/nar-info.cc — NarInfo::NarInfo(), NarInfo::to_string()
+"""
+
+import bz2
+import lzma
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+
+from pix.store_path import STORE_DIR
+
+# Compression values we can read, and how to open them. Each opens a
+# path, so closing the result closes the file too.
+_DECOMPRESSORS = {
+    "none": lambda path: open(path, "rb"),
+    "xz": lzma.open,
+    "bzip2": bz2.open,
+}
+
+
+@dataclass
+class NarInfo:
+    store_path: str
+    url: str
+    nar_hash: str
+    nar_size: int
+    compression: str = "bzip2"  # Nix's default when the field is missing
+    file_hash: str = ""
+    file_size: int = 0
+    references: list[str] = field(default_factory=list)  # full store paths
+    deriver: str = ""  # full store path, or ""
+    sigs: list[str] = field(default_factory=list)
+    ca: str = ""
+
+    def to_text(self) -> str:
+        """The .narinfo file for this entry."""
+        lines = [
+            f"StorePath: {self.store_path}",
+            f"URL: {self.url}",
+            f"Compression: {self.compression}",
+        ]
+        if self.file_hash:
+            lines.append(f"FileHash: {self.file_hash}")
+        if self.file_size:
+            lines.append(f"FileSize: {self.file_size}")
+        lines.append(f"NarHash: {self.nar_hash}")
+        lines.append(f"NarSize: {self.nar_size}")
+        lines.append("References: " + " ".join(_base_name(r) for r in self.references))
+        if self.deriver:
+            lines.append(f"Deriver: {_base_name(self.deriver)}")
+        lines += [f"Sig: {s}" for s in self.sigs]
+        if self.ca:
+            lines.append(f"CA: {self.ca}")
+        return "\n".join(lines) + "\n"
+
+    def check_nar(self, cache_dir: str | Path) -> None:
+        """Raise if open_nar would fail: unsupported compression or no NAR file."""
+        if self.compression not in _DECOMPRESSORS:
+            raise ValueError(f"unsupported NAR compression: {self.compression}")
+        path = Path(cache_dir) / self.url
+        if not path.is_file():
+            raise FileNotFoundError(f"NAR of {self.store_path} not found: {path}")
+
+    def open_nar(self, cache_dir: str | Path) -> BinaryIO:
+        """Open the NAR this entry points to, decompressing as it is read."""
+        self.check_nar(cache_dir)
+        return _DECOMPRESSORS[self.compression](Path(cache_dir) / self.url)
+
+
+def _base_name(path: str) -> str:
+    return path.rsplit("/", 1)[-1]
+
+
+def parse(text: str, store_dir: str = STORE_DIR) -> NarInfo:
+    """Parse a .narinfo file."""
+    fields: dict[str, str] = {}
+    sigs = []
+    for line in text.splitlines():
+        if not line:
+            continue
+        key, sep, value = line.partition(": ")
+        if not sep:
+            raise ValueError(f"bad .narinfo line: {line!r}")
+        if key == "Sig":
+            sigs.append(value)
+        else:
+            fields[key] = value
+    for key in ("StorePath", "URL", "NarHash", "NarSize"):
+        if key not in fields:
+            raise ValueError(f".narinfo has no {key}")
+    refs = fields.get("References", "").split()
+    deriver = fields.get("Deriver", "")
+    return NarInfo(
+        store_path=fields["StorePath"],
+        url=fields["URL"],
+        nar_hash=fields["NarHash"],
+        nar_size=int(fields["NarSize"]),
+        compression=fields.get("Compression", "bzip2"),
+        file_hash=fields.get("FileHash", ""),
+        file_size=int(fields.get("FileSize", 0)),
+        references=[f"{store_dir}/{r}" for r in refs],
+        deriver=f"{store_dir}/{deriver}" if deriver and deriver != "unknown-deriver" else "",
+        sigs=sigs,
+        ca=fields.get("CA", ""),
+    )
+
+
+def read_dir(cache_dir: str | Path, store_dir: str = STORE_DIR) -> list[NarInfo]:
+    """Every .narinfo in a binary cache directory, dependencies first.
+
+    The order is topological over references (within the directory), so
+    importing in this order never adds a path before what it refers to.
+    """
+    infos = {}
+    for p in sorted(Path(cache_dir).glob("*.narinfo")):
+        info = parse(p.read_text(), store_dir)
+        infos[info.store_path] = info
+
+    ordered: list[NarInfo] = []
+    state: dict[str, int] = {}  # 1 = in progress, 2 = done
+    for root in infos:
+        if state.get(root):
+            continue
+        # Iterative DFS, emitting a path once all its references are out.
+        stack = [(root, iter(infos[root].references))]
+        state[root] = 1
+        while stack:
+            path, refs = stack[-1]
+            for ref in refs:
+                if ref in infos and not state.get(ref):
+                    state[ref] = 1
+                    stack.append((ref, iter(infos[ref].references)))
+                    break
+            else:
+                stack.pop()
+                state[path] = 2
+                ordered.append(infos[path])
+    return ordered
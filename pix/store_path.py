@@ -21,18 +21,124 @@ has NO trailing colon — "text" not "text:".
 See: nix/src/libstore/store-api.cc — makeStorePath(), makeTextPath()
 """
 
-from pix.base32 import encode as b32encode
-from pix.hash import compress_hash, sha256, sha256_hex
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from pix.base32 import encode as b32encode, encode_int
+from pix.hash import sha256, sha256_hex
 
 STORE_DIR = "/nix/store"
 HASH_BYTES = 20  # 160 bits, XOR-folded (not truncated)
 
 
+# --- Optional memoization ---
+#
+# Evaluating a package set asks for the same store paths over and over
+# (every drv() of a dependent recomputes its inputs' paths). A store path is
+# a pure function of (type_prefix, inner_hash, name), so the results can be
+# cached. Off by default; enable_cache() turns it on for the whole process.
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class _LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> str | None:
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: str) -> None:
+        with self.lock:
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+
+_cache: _LRUCache | None = None
+
+
+def enable_cache(maxsize: int = 65536) -> None:
+    """Memoize make_store_path() (and so every typed helper) and placeholder().
+
+    Keeps the maxsize most recently used results. Calling it again starts
+    a fresh, empty cache.
+    """
+    global _cache
+    _cache = _LRUCache(maxsize)
+
+
+def disable_cache() -> None:
+    global _cache
+    _cache = None
+
+
+def cache_info() -> CacheInfo:
+    """Hit/miss/eviction counts of the cache (all zero when disabled)."""
+    c = _cache
+    if c is None:
+        return CacheInfo(0, 0, 0, 0, 0)
+    with c.lock:
+        return CacheInfo(c.hits, c.misses, c.evictions, c.maxsize, len(c.data))
+
+
 def make_store_path(type_prefix: str, inner_hash: bytes, name: str) -> str:
     """Core store path computation. Most callers use the typed helpers below."""
+    cache = _cache
+    if cache is not None:
+        key = (type_prefix, inner_hash, name)
+        path = cache.get(key)
+        if path is None:
+            path = _make_store_path(type_prefix, inner_hash, name)
+            cache.put(key, path)
+        return path
+    return _make_store_path(type_prefix, inner_hash, name)
+
+
+def _make_store_path(type_prefix: str, inner_hash: bytes, name: str) -> str:
     fingerprint = f"{type_prefix}:sha256:{inner_hash.hex()}:{STORE_DIR}:{name}"
-    compressed = compress_hash(sha256(fingerprint.encode()), HASH_BYTES)
-    return f"{STORE_DIR}/{b32encode(compressed)}-{name}"
+    return f"{STORE_DIR}/{store_path_digest(fingerprint.encode())}-{name}"
+
+
+def store_path_digest(fingerprint: bytes) -> str:
+    """The <hash> part of a store path: base32(compress_hash(sha256(fingerprint), 20)).
+
+    Fused into integer arithmetic. Read little-endian, the digest's first
+    20 bytes and last 12 bytes are two integers whose XOR is the folded
+    hash — and a little-endian integer is exactly what Nix base32 writes
+    out (see pix.base32), so the 20-byte result never needs to exist.
+    """
+    digest = hashlib.sha256(fingerprint).digest()
+    folded = int.from_bytes(digest[:HASH_BYTES], "little") ^ int.from_bytes(digest[HASH_BYTES:], "little")
+    return encode_int(folded, 32)
+
+
+def make_store_paths(items: list[tuple[str, bytes, str]]) -> list[str]:
+    """make_store_path() for many (type_prefix, inner_hash, name) triples."""
+    prefix = STORE_DIR + "/"
+    suffix = ":" + STORE_DIR + ":"
+    return [
+        f"{prefix}{store_path_digest(f'{t}:sha256:{h.hex()}{suffix}{name}'.encode())}-{name}"
+        for t, h, name in items
+    ]
 
 
 def _make_type(base: str, refs: list[str]) -> str:
@@ -89,7 +195,7 @@ def make_fixed_output_path(
     return make_store_path("output:out", inner_hash, name)
 
 
-def path_to_store_path(path: str, name: str | None = None) -> str:
+def path_to_store_path(path: str, name: str | None = None, cache=None) -> str:
     """Compute the store path for a local file or directory.
 
     Like ``nix-store --add`` or ``builtins.path`` — NAR-serializes the path,
@@ -98,13 +204,15 @@ def path_to_store_path(path: str, name: str | None = None) -> str:
     Args:
         path: Local filesystem path to hash.
         name: Nix store name (defaults to the basename of path).
+        cache: Optional pix.nar_cache.NarHashCache to skip re-hashing
+               unchanged trees.
     """
     from pathlib import Path as P
 
     from pix.nar import nar_hash as _nar_hash
 
     p = P(path)
-    h = _nar_hash(str(p))
+    h = cache.nar_hash(str(p)) if cache else _nar_hash(str(p))
     return make_source_store_path(name or p.name, h)
 
 
@@ -118,6 +226,14 @@ def placeholder(output_name: str) -> str:
 
     See: nix/src/libstore/store-api.cc — hashPlaceholder()
     """
+    cache = _cache
+    if cache is not None:
+        key = ("placeholder", output_name)
+        value = cache.get(key)
+        if value is None:
+            value = "/" + b32encode(sha256(f"nix-output:{output_name}".encode()))
+            cache.put(key, value)
+        return value
     inner = sha256(f"nix-output:{output_name}".encode())
     return "/" + b32encode(inner)
 
@@ -14,10 +14,28 @@ from pixpkgs.bootstrap.pkgs import Pkgs
 from pixpkgs.bootstrap.stage0 import EXPECTED_STAGE0, Stage0
 from pixpkgs.bootstrap.stage1 import EXPECTED_STAGE1, Stage1
 from pixpkgs.bootstrap.stage_xgcc import EXPECTED_STAGE_XGCC, StageXgcc
+from pixpkgs.drv import Package
 
 __all__ = [
     "Stage0", "EXPECTED_STAGE0",
     "Stage1", "EXPECTED_STAGE1",
     "StageXgcc", "EXPECTED_STAGE_XGCC",
     "Pkgs",
+    "all_bootstrap_packages",
 ]
+
+
+def all_bootstrap_packages() -> dict[str, Package]:
+    """drv path -> Package for every derivation in the bootstrap chain.
+
+    The stages' all_packages, plus the sources and helpers reached only
+    through deps.
+    """
+    packages = dict(StageXgcc().all_packages)
+    stack = list(packages.values())
+    while stack:
+        for dep in stack.pop().deps:
+            if dep.drv_path not in packages:
+                packages[dep.drv_path] = dep
+                stack.append(dep)
+    return packages
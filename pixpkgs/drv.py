@@ -34,7 +34,7 @@ def _collect_input_hashes(deps: list[Package], drv_hashes: dict[str, bytes]) ->
         if dep.drv_path in drv_hashes:
             continue
         # Process sub-deps first
-        _collect_input_hashes(dep._args.get("deps") or [], drv_hashes)
+        _collect_input_hashes(dep.deps, drv_hashes)
         drv_hashes[dep.drv_path] = hash_derivation_modulo(
             dep.drv, drv_hashes, mask_outputs=False,
         )
@@ -58,6 +58,11 @@ class Package:
     def out(self) -> str:
         return self.outputs["out"]
 
+    @property
+    def deps(self) -> list[Package]:
+        """The packages passed as deps= (the input derivations)."""
+        return self._args.get("deps") or []
+
     def __str__(self) -> str:
         return self.out
 
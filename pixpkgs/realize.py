@@ -5,7 +5,7 @@ it registers the derivation file in the store, then asks the daemon
 to build it.
 """
 
-from pix.daemon import DaemonConnection
+from pix.daemon import DaemonConnection, default_pool
 from pix.derivation import serialize
 from pixpkgs.drv import Package
 
@@ -17,7 +17,7 @@ def _register_drv(pkg: Package, conn: DaemonConnection, seen: set[str]) -> None:
     seen.add(pkg.drv_path)
 
     # Register dependencies first
-    for dep in (pkg._args.get("deps") or []):
+    for dep in pkg.deps:
         _register_drv(dep, conn, seen)
 
     drv_content = serialize(pkg.drv)
@@ -28,7 +28,8 @@ def _register_drv(pkg: Package, conn: DaemonConnection, seen: set[str]) -> None:
 def realize(pkg: Package, conn: DaemonConnection | None = None) -> str:
     """Register pkg's .drv in the store and build it. Returns output path.
 
-    If conn is provided, uses that connection. Otherwise opens a new one.
+    If conn is provided, uses that connection. Otherwise borrows one from
+    pix.daemon.default_pool(), so repeated calls reuse a warm connection.
     """
     def _do(c: DaemonConnection) -> str:
         _register_drv(pkg, c, set())
@@ -40,5 +41,5 @@ def realize(pkg: Package, conn: DaemonConnection | None = None) -> str:
     if conn is not None:
         return _do(conn)
 
-    with DaemonConnection() as c:
+    with default_pool().checkout() as c:
         return _do(c)
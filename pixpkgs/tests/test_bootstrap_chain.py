@@ -7,6 +7,7 @@ hash-identical to real nixpkgs — without reading .drv files.
 from pixpkgs.bootstrap import (
     Stage0, Stage1, StageXgcc,
     EXPECTED_STAGE0, EXPECTED_STAGE1, EXPECTED_STAGE_XGCC,
+    all_bootstrap_packages,
 )
 
 
@@ -238,3 +239,17 @@ class TestStageXgcc:
         assert sx.stdenv is sx.stdenv
         assert sx.expand_response_params is sx.expand_response_params
         assert sx.all_packages is sx.all_packages
+
+
+
+class TestDrvHashEngine:
+    """pix.derivation.DrvHashEngine agrees with drv() on the whole chain."""
+
+    def test_reproduces_output_paths(self):
+        """Every bootstrap output path is recomputed from the .drv alone."""
+        from pix.derivation import DrvHashEngine
+
+        packages = all_bootstrap_packages()
+        engine = DrvHashEngine({p: pkg.drv for p, pkg in packages.items()}.__getitem__)
+        for path, pkg in packages.items():
+            assert engine.output_paths(path) == pkg.outputs
@@ -45,6 +45,14 @@ def test_drv_str_is_out():
     assert str(pkg) == pkg.out
 
 
+def test_drv_deps():
+    """deps lists the packages given as deps=, or nothing."""
+    lib = drv(name="lib", builder="/bin/sh", args=["-c", "echo > $out"])
+    app = drv(name="app", builder="/bin/sh", args=["-c", "echo > $out"], deps=[lib])
+    assert app.deps == [lib]
+    assert lib.deps == []
+
+
 def test_drv_env_has_standard_vars():
     """The derivation env should include name, builder, system, out."""
     pkg = drv(name="test", builder="/bin/sh", args=["-c", "echo > $out"])
@@ -0,0 +1,352 @@
+"""A small in-process stand-in for nix-daemon, for tests without Nix.
+
+Listens on a Unix socket, performs the worker protocol handshake and
+answers a subset of operations from an in-memory store. Its wire code is
+written independently of pix.daemon (plain file reads and writes), so
+the tests check the client against a second reading of the protocol.
+
+    with FakeDaemon(tmp_path / "socket") as fake:
+        fake.add_path("/nix/store/...-hello", references=[...])
+        with DaemonConnection(fake.socket_path) as conn:
+            ...
+"""
+
+import hashlib
+import io
+import socket
+import struct
+import threading
+from dataclasses import dataclass, field
+
+from pix import base32, daemon
+from pix.store_path import make_text_store_path
+
+
+@dataclass
+class FakePath:
+    deriver: str = ""
+    nar_hash: str = "sha256:" + "0" * 52
+    references: list[str] = field(default_factory=list)
+    registration_time: int = 0
+    nar_size: int = 0
+    sigs: list[str] = field(default_factory=list)
+    ca: str = ""
+    ultimate: bool = False
+    outputs: dict[str, str] = field(default_factory=dict)  # for .drv paths
+
+
+class _Wire:
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, n: int) -> bytes:
+        data = self.f.read(n)
+        if len(data) != n:
+            raise EOFError
+        return data
+
+    def u64(self) -> int:
+        return struct.unpack("<Q", self.read(8))[0]
+
+    def bytes(self) -> bytes:
+        n = self.u64()
+        data = self.read(n)
+        self.read(-n % 8)
+        return data
+
+    def str(self) -> str:
+        return self.bytes().decode()
+
+    def strs(self) -> list[str]:
+        return [self.str() for _ in range(self.u64())]
+
+    def put_u64(self, n: int) -> None:
+        self.f.write(struct.pack("<Q", n))
+
+    def put_bytes(self, data: bytes) -> None:
+        self.put_u64(len(data))
+        self.f.write(data + bytes(-len(data) % 8))
+
+    def put_str(self, s: str) -> None:
+        self.put_bytes(s.encode())
+
+    def put_strs(self, items) -> None:
+        self.put_u64(len(items))
+        for s in items:
+            self.put_str(s)
+
+
+class FakeDaemon:
+    """Serve the worker protocol on *socket_path* from a background thread.
+
+    store maps valid paths to FakePath. ops records every opcode
+    received, and connections counts accepted clients. Set stderr_log to
+    a list of log lines to send (as STDERR_NEXT) before every response.
+    nars keeps the NAR of every path added with AddToStoreNar.
+    build_activity is a list of activity messages BuildPaths sends before
+    its reply: ("start", id, level, type, text, fields, parent),
+    ("stop", id) or ("result", id, type, fields).
+    """
+
+    def __init__(self, socket_path, version: int = daemon.PROTOCOL_VERSION):
+        self.socket_path = str(socket_path)
+        self.version = version
+        self.store: dict[str, FakePath] = {}
+        self.ops: list[int] = []
+        self.connections = 0
+        self.stderr_log: list[str] = []
+        self.nars: dict[str, bytes] = {}
+        self.build_activity: list[tuple] = []
+        self._lock = threading.Lock()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        self._server.listen()
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+
+    def add_path(self, path: str, **info) -> FakePath:
+        self.store[path] = FakePath(**info)
+        return self.store[path]
+
+    # --- Serving ---
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        # Closing the file flushes it, which fails too if the client has
+        # gone: keep that inside the try.
+        try:
+            with conn, conn.makefile("rwb") as f:
+                w = _Wire(f)
+                self._handshake(w)
+                while True:
+                    op = w.u64()
+                    with self._lock:
+                        self.ops.append(op)
+                    handler = getattr(self, f"_op_{op}", None)
+                    if handler is None:
+                        self._error(w, f"unsupported operation {op}")
+                        return
+                    handler(w)
+                    f.flush()
+        except (EOFError, ConnectionError, ValueError, OSError):
+            return
+
+    def _handshake(self, w: _Wire) -> None:
+        if w.u64() != daemon.WORKER_MAGIC_1:
+            raise EOFError
+        w.put_u64(daemon.WORKER_MAGIC_2)
+        w.put_u64(self.version)
+        w.f.flush()
+        w.u64()  # client version
+        w.u64()  # cpu affinity
+        w.u64()  # reserve space
+        if self.version >= (1 << 8 | 33):
+            w.put_str("2.28.0-fake")
+        if self.version >= (1 << 8 | 35):
+            w.put_u64(1)
+        w.put_u64(daemon.STDERR_LAST)
+        w.f.flush()
+
+    def _last(self, w: _Wire) -> None:
+        for line in self.stderr_log:
+            w.put_u64(daemon.STDERR_NEXT)
+            w.put_str(line)
+        w.put_u64(daemon.STDERR_LAST)
+
+    @staticmethod
+    def _put_fields(w: _Wire, fields) -> None:
+        w.put_u64(len(fields))
+        for f in fields:
+            if isinstance(f, int):
+                w.put_u64(0)
+                w.put_u64(f)
+            else:
+                w.put_u64(1)
+                w.put_str(f)
+
+    def _error(self, w: _Wire, msg: str) -> None:
+        w.put_u64(daemon.STDERR_ERROR)
+        w.put_str("Error")
+        w.put_u64(0)
+        w.put_str("Error")
+        w.put_str(msg)
+        w.put_u64(0)
+        w.f.flush()
+
+    # --- Operations ---
+
+    def _op_1(self, w: _Wire) -> None:  # IsValidPath
+        path = w.str()
+        self._last(w)
+        w.put_u64(path in self.store)
+
+    def _op_31(self, w: _Wire) -> None:  # QueryValidPaths
+        paths = w.strs()
+        w.u64()  # substitute
+        self._last(w)
+        w.put_strs([p for p in paths if p in self.store])
+
+    def _op_26(self, w: _Wire) -> None:  # QueryPathInfo
+        path = w.str()
+        self._last(w)
+        info = self.store.get(path)
+        w.put_u64(info is not None)
+        if info is None:
+            return
+        w.put_str(info.deriver)
+        w.put_str(info.nar_hash)
+        w.put_strs(info.references)
+        w.put_u64(info.registration_time)
+        w.put_u64(info.nar_size)
+        w.put_u64(info.ultimate)
+        w.put_strs(info.sigs)
+        w.put_str(info.ca)
+
+    def _op_41(self, w: _Wire) -> None:  # QueryDerivationOutputMap
+        path = w.str()
+        info = self.store.get(path)
+        if info is None:
+            self._error(w, f"path '{path}' is not valid")
+            return
+        self._last(w)
+        w.put_u64(len(info.outputs))
+        for name, out in info.outputs.items():
+            w.put_str(name)
+            w.put_str(out)
+
+    def _op_8(self, w: _Wire) -> None:  # AddTextToStore
+        name = w.str()
+        content = w.bytes()
+        refs = w.strs()
+        path = make_text_store_path(name, content, refs)
+        self.store.setdefault(path, FakePath(references=refs, nar_size=len(content)))
+        self._last(w)
+        w.put_str(path)
+
+    def _op_9(self, w: _Wire) -> None:  # BuildPaths
+        w.strs()
+        w.u64()  # build mode
+        for kind, act_id, *rest in self.build_activity:
+            if kind == "start":
+                level, act_type, text, fields, parent = rest
+                w.put_u64(daemon.STDERR_START_ACTIVITY)
+                w.put_u64(act_id)
+                w.put_u64(level)
+                w.put_u64(act_type)
+                w.put_str(text)
+                self._put_fields(w, fields)
+                w.put_u64(parent)
+            elif kind == "stop":
+                w.put_u64(daemon.STDERR_STOP_ACTIVITY)
+                w.put_u64(act_id)
+            else:
+                result_type, fields = rest
+                w.put_u64(daemon.STDERR_RESULT)
+                w.put_u64(act_id)
+                w.put_u64(result_type)
+                self._put_fields(w, fields)
+        self._last(w)
+        w.put_u64(1)
+
+    def _op_39(self, w: _Wire) -> None:  # AddToStoreNar
+        path = w.str()
+        info = FakePath(deriver=w.str(), nar_hash=w.str(), references=w.strs())
+        info.registration_time = w.u64()
+        info.nar_size = w.u64()
+        info.ultimate = bool(w.u64())
+        info.sigs = w.strs()
+        info.ca = w.str()
+        w.u64()  # repair
+        w.u64()  # dontCheckSigs
+        nar = self._read_framed(w)
+        if not self._add_nar(w, path, info, nar):
+            return
+        self._last(w)
+
+    def _op_44(self, w: _Wire) -> None:  # AddMultipleToStore
+        w.u64()  # repair
+        w.u64()  # dontCheckSigs
+        r = _Wire(io.BytesIO(self._read_framed(w)))
+        for _ in range(r.u64()):
+            path = r.str()
+            info = FakePath(deriver=r.str(), nar_hash=r.str(), references=r.strs())
+            info.registration_time = r.u64()
+            info.nar_size = r.u64()
+            info.ultimate = bool(r.u64())
+            info.sigs = r.strs()
+            info.ca = r.str()
+            start = r.f.tell()
+            _skip_nar(r)
+            end = r.f.tell()
+            if not self._add_nar(w, path, info, r.f.getvalue()[start:end]):
+                return
+        self._last(w)
+
+    @staticmethod
+    def _read_framed(w: _Wire) -> bytes:
+        data = bytearray()
+        while n := w.u64():  # framed: length + data, no padding
+            data += w.read(n)
+        return bytes(data)
+
+    def _add_nar(self, w: _Wire, path: str, info: FakePath, nar: bytes) -> bool:
+        digest = hashlib.sha256(nar).digest()
+        if len(nar) != info.nar_size or info.nar_hash.removeprefix("sha256:") not in (digest.hex(), base32.encode(digest)):
+            self._error(w, f"hash mismatch importing path '{path}'")
+            return False
+        self.store[path] = info
+        self.nars[path] = nar
+        return True
+
+
+def _skip_nar(r: _Wire) -> None:
+    """Read past one NAR (it carries no length; its grammar ends it)."""
+    if r.str() != "nix-archive-1":
+        raise ValueError("not a NAR")
+    _skip_node(r)
+
+
+def _skip_node(r: _Wire) -> None:
+    r.str()  # "("
+    r.str()  # "type"
+    kind = r.str()
+    if kind == "regular":
+        tag = r.str()
+        if tag == "executable":
+            r.str()  # ""
+            tag = r.str()
+        r.bytes()  # contents
+    elif kind == "symlink":
+        r.str()  # "target"
+        r.str()
+    elif kind == "directory":
+        while r.str() == "entry":
+            r.str()  # "("
+            r.str()  # "name"
+            r.str()
+            r.str()  # "node"
+            _skip_node(r)
+            r.str()  # ")"
+        return  # the loop consumed the closing ")"
+    r.str()  # ")"
@@ -0,0 +1,239 @@
+"""Tests for daemon activity events, the activity tree and the progress line."""
+
+import io
+import json
+import queue
+import pytest
+
+from pix import activity, daemon
+from pix.activity import (
+    ACT_BUILD,
+    ACT_BUILDS,
+    ACT_BUILD_WAITING,
+    ACT_COPY_PATH,
+    ACT_FILE_TRANSFER,
+    ACT_SUBSTITUTE,
+    RES_BUILD_LOG_LINE,
+    RES_PROGRESS,
+    RES_SET_PHASE,
+    ActivityResult,
+    ActivityStart,
+    ActivityStop,
+    ActivityTree,
+    BuildReport,
+    LogLine,
+    ProgressRenderer,
+)
+from pix.daemon import DaemonConnection
+from tests.fake_daemon import FakeDaemon
+
+DRV = "/nix/store/" + "d" * 32 + "-hello-2.12.2.drv"
+
+BUILD = [
+    ("start", 1, 0, ACT_BUILDS, "", [], 0),
+    ("start", 2, 3, ACT_BUILD, "building hello", [DRV, "", 1, 1], 1),
+    ("result", 2, RES_SET_PHASE, ["configurePhase"]),
+    ("result", 2, RES_BUILD_LOG_LINE, ["checking for gcc... yes"]),
+    ("start", 3, 3, ACT_SUBSTITUTE, "fetching", ["/nix/store/" + "s" * 32 + "-glibc", "https://cache"], 1),
+    ("stop", 3),
+    ("result", 1, RES_PROGRESS, [1, 1, 0, 0]),
+    ("stop", 2),
+    ("stop", 1),
+]
+
+
+@pytest.fixture
+def fake(tmp_path):
+    with FakeDaemon(tmp_path / "socket") as fake:
+        yield fake
+
+
+def test_events_from_daemon(fake):
+    fake.build_activity = BUILD
+    fake.stderr_log = ["a log line"]
+    events = []
+    with DaemonConnection(fake.socket_path) as conn:
+        with conn.events(events.append):
+            conn.build_paths([DRV + "!out"])
+        assert conn.event_sink is None
+    kinds = [type(e) for e in events]
+    assert kinds.count(ActivityStart) == 3 and kinds.count(ActivityStop) == 3
+    assert events[-1] == LogLine(events[-1].time, "a log line")
+    start = events[1]
+    assert (start.id, start.type, start.fields, start.parent) == (2, ACT_BUILD, (DRV, "", 1, 1), 1)
+    assert [e.time for e in events] == sorted(e.time for e in events)
+
+
+def test_queue_sink(fake):
+    fake.build_activity = BUILD
+    q = queue.Queue()
+    with DaemonConnection(fake.socket_path) as conn:
+        conn.event_sink = q
+        conn.build_paths([DRV + "!out"])
+    assert q.qsize() == len(BUILD)
+
+
+def test_no_sink_builds_no_events(fake, monkeypatch):
+    fake.build_activity = BUILD
+
+    def fail(*args):
+        raise AssertionError("event built without a sink")
+
+    monkeypatch.setattr(daemon, "_event", fail)
+    with DaemonConnection(fake.socket_path) as conn:
+        conn.build_paths([DRV + "!out"])
+
+
+def test_bad_sink():
+    with pytest.raises(TypeError):
+        DaemonConnection().event_sink = 42
+
+
+def _events(messages) -> list:
+    out = []
+    for t, (kind, act_id, *rest) in enumerate(messages):
+        if kind == "start":
+            level, act_type, text, fields, parent = rest
+            out.append(ActivityStart(t, act_id, level, act_type, text, tuple(fields), parent))
+        elif kind == "stop":
+            out.append(ActivityStop(t, act_id))
+        else:
+            out.append(ActivityResult(t, act_id, rest[0], tuple(rest[1])))
+    return out
+
+
+def test_activity_tree():
+    tree = ActivityTree()
+    for e in _events(BUILD):
+        tree(e)
+    assert tree.roots == [1]
+    assert [(d, a.id) for d, a in tree.walk()] == [(0, 1), (1, 2), (1, 3)]
+    build = tree.activities[2]
+    assert build.phase == "configurePhase"
+    assert build.duration == 7 - 1
+    assert tree.activities[1].done == 1
+    assert tree.running() == []
+
+
+def test_tree_orphans_are_roots():
+    tree = ActivityTree()
+    tree(ActivityStart(0, 5, 0, ACT_BUILD, "", (DRV,), 4))  # parent started before we listened
+    tree(ActivityStop(1, 99))  # unknown ids are ignored
+    assert tree.roots == [5]
+
+
+def test_progress_plain():
+    out = io.StringIO()
+    r = ProgressRenderer(out, tty=False)
+    for e in _events(BUILD):
+        r(e)
+    assert out.getvalue().splitlines() == [
+        "building hello-2.12.2",
+        "checking for gcc... yes",
+        "fetching glibc",
+    ]
+
+
+def test_progress_tty_status_line():
+    out = io.StringIO()
+    r = ProgressRenderer(out, interval=0, tty=True)
+    events = _events(BUILD)
+    for e in events[:5]:
+        r(e)
+    assert r.status() == "[0/1 built, 1 fetching] building hello-2.12.2 (configurePhase)"
+    assert out.getvalue().endswith("\r\x1b[K[0/1 built, 1 fetching] building hello-2.12.2 (configurePhase)")
+    for e in events[5:]:
+        r(e)
+    assert r.status() == "[1/1 built]"
+    r.finish()
+    assert out.getvalue().endswith("\r\x1b[K")
+    assert "checking for gcc... yes\n" in out.getvalue()
+
+
+def test_describe_falls_back_to_text():
+    tree = ActivityTree()
+    tree(ActivityStart(0, 1, 0, activity.ACT_UNKNOWN, "evaluating", (), 0))
+    assert activity.describe(tree.activities[1]) == "evaluating"
+
+
+TRANSFERS = [
+    ("start", 10, 0, ACT_FILE_TRANSFER, "", ["https://cache/nar/x.nar.xz"], 0),
+    ("result", 10, RES_PROGRESS, [4096, 4096, 0, 0]),
+    ("stop", 10),
+    ("start", 11, 0, ACT_COPY_PATH, "", ["/nix/store/" + "s" * 32 + "-glibc", "", ""], 0),
+    ("result", 11, RES_PROGRESS, [100, 200, 0, 0]),
+    ("result", 11, RES_PROGRESS, [200, 200, 0, 0]),
+    ("stop", 11),
+]
+
+
+def _report(messages) -> BuildReport:
+    report = BuildReport()
+    report.start = 0
+    for e in _events(messages):
+        report(e)
+    return report
+
+
+def test_build_report():
+    d = _report(BUILD).to_dict()
+    (build,) = d["builds"]
+    assert build == {"drv": DRV, "started_after": 1, "queue_seconds": 0.0, "duration": 6, "phases": {"configurePhase": 5}, "log_lines": 1}
+    assert d["duration"] == 8
+    assert d["substitutions"] == 1
+
+    report = _report(TRANSFERS)
+    d = report.to_dict()
+    assert d["downloads"] == {"count": 1, "bytes": 4096}
+    assert d["copies"] == {"count": 1, "bytes": 200}
+    assert json.loads(report.to_json()) == d
+
+
+def test_build_report_queue_time():
+    waiting = [
+        ("start", 1, 0, ACT_BUILDS, "", [], 0),
+        ("start", 5, 4, ACT_BUILD_WAITING, f"waiting for a free build user ID for '{DRV}'", [], 1),
+        ("start", 6, 4, ACT_BUILD_WAITING, "waiting for lock on '/nix/store/" + "o" * 32 + "-hello'", [], 1),
+        ("stop", 6),
+        ("stop", 5),
+        ("start", 2, 3, ACT_BUILD, "building hello", [DRV, "", 1, 1], 1),
+        ("stop", 2),
+    ]
+    report = _report(waiting)
+    (build,) = report.builds()
+    assert (build.queue_seconds, build.started_after) == (3, 5)
+    assert report.to_dict()["builds"][0]["queue_seconds"] == 3
+    assert f'pix_build_derivation_queue_seconds{{drv="{DRV}"}} 3.0' in report.to_prometheus().splitlines()
+
+
+def test_build_report_unfinished_build():
+    d = _report(BUILD[:4]).to_dict()
+    assert d["builds"][0]["duration"] is None
+
+
+def test_build_report_prometheus():
+    text = _report(BUILD + TRANSFERS).to_prometheus()
+    lines = text.splitlines()
+    assert f'pix_build_derivation_duration_seconds{{drv="{DRV}"}} 6' in lines
+    assert f'pix_build_phase_duration_seconds{{drv="{DRV}",phase="configurePhase"}} 5.0' in lines
+    assert "pix_build_downloaded_bytes 4096" in lines
+    assert "# TYPE pix_build_derivations gauge" in lines
+
+    big = [("start", 12, 0, ACT_FILE_TRANSFER, "", ["https://cache/nar/big.nar.xz"], 0),
+           ("result", 12, RES_PROGRESS, [123456789, 123456789, 0, 0])]
+    report = _report(big)
+    report.end = 1.0000001
+    lines = report.to_prometheus().splitlines()
+    assert "pix_build_downloaded_bytes 123456789" in lines
+    assert "pix_build_duration_seconds 1.0000001" in lines
+    report = BuildReport()
+    report(ActivityStart(report.start, 1, 0, ACT_BUILD, "", ('a"b\\c\nd',), 0))
+    assert 'drv="a\\"b\\\\c\\nd"' in report.to_prometheus()
+
+
+def test_tee():
+    seen, q = [], queue.Queue()
+    sink = activity.tee(seen.append, None, q)
+    sink(LogLine(0, "x"))
+    assert seen == [LogLine(0, "x")] and q.get_nowait() == LogLine(0, "x")
+    assert activity.tee(None, None) is None
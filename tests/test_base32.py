@@ -1,7 +1,10 @@
 """Tests for Nix base32 encoding/decoding."""
 
 import hashlib
-from pix.base32 import encode, decode
+
+import pytest
+
+from pix.base32 import CHARS, decode, decode_many, decode_reference, encode, encode_int, encode_many, encode_reference
 
 
 # sha256("hello") = 2cf24dba...
@@ -41,6 +44,48 @@ def test_known_20byte():
 
 
 def test_decode_invalid_char():
-    import pytest
     with pytest.raises(ValueError, match="invalid nix base32 character"):
         decode("hello!")  # '!' not in alphabet
+
+
+def test_fast_path_matches_reference():
+    """Differential fuzz: encode/decode agree with the reference loops."""
+    import os
+    import random
+
+    rng = random.Random(1234)
+    for n in range(0, 70):
+        for _ in range(30):
+            data = os.urandom(n)
+            assert encode(data) == encode_reference(data)
+            # Arbitrary digit strings of a valid length, including ones with
+            # high bits set beyond what fits in the output
+            s = "".join(rng.choice(CHARS) for _ in range((n * 8 + 4) // 5))
+            assert decode(s) == decode_reference(s)
+
+
+def test_batch_apis():
+    hashes = [hashlib.sha256(bytes([i])).digest()[:20] for i in range(100)]
+    encoded = encode_many(hashes)
+    assert encoded == [encode_reference(h) for h in hashes]
+    assert decode_many(encoded) == hashes
+
+    # mixed lengths, including empty and odd digit counts
+    mixed = [b"", b"\x01", HELLO_SHA256] + [h[:n] for n, h in enumerate(hashes[:33])]
+    encoded = encode_many(mixed)
+    assert encoded == [encode_reference(d) for d in mixed]
+    assert decode_many(encoded) == [decode_reference(s) for s in encoded]
+    with pytest.raises(ValueError, match="'e'"):
+        decode_many(encoded[:5] + ["0e"])
+
+
+def test_encode_int():
+    assert encode_int(int.from_bytes(HELLO_SHA256, "little"), 52) == HELLO_NIX_B32
+    assert encode_int(31, 3) == "00z"
+
+
+def test_decode_rejects_int_syntax():
+    """decode() parses with int(); make sure int()'s extras aren't accepted."""
+    for s in ["-0", "+1", "1_0", " 0", "0\n", "e", "ABC"]:
+        with pytest.raises(ValueError):
+            decode(s)
@@ -1,10 +1,17 @@
-"""Tests for daemon connection (require running Nix daemon)."""
+"""Tests for the daemon client: against a real Nix daemon when one is
+running, and against tests.fake_daemon otherwise."""
 
+import hashlib
+import io
 import os
 import socket
+import threading
+import time
 import pytest
 
-from pix.daemon import DaemonConnection, NixDaemonError
+from pix import daemon, nar, store_path
+from pix.daemon import DaemonConnection, DaemonPool, NixDaemonError, PathInfo, _read_uint64
+from tests.fake_daemon import FakeDaemon
 
 SOCKET_PATH = "/nix/var/nix/daemon-socket/socket"
 
@@ -63,3 +70,372 @@ def test_query_path_info():
         info = conn.query_path_info(path)
         assert info.nar_size > 0
         assert len(info.nar_hash) > 0
+
+
+# --- Against the in-process fake daemon (no Nix needed) ---
+
+@pytest.fixture
+def fake(tmp_path):
+    with FakeDaemon(tmp_path / "socket") as fake:
+        yield fake
+
+
+class CountingSocket:
+    """Wrap a socket, counting send and receive syscalls."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sends = 0
+        self.recvs = 0
+
+    def sendall(self, data):
+        self.sends += 1
+        return self.sock.sendall(data)
+
+    def recv_into(self, buf, *args):
+        self.recvs += 1
+        return self.sock.recv_into(buf, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def test_fake_roundtrip(fake):
+    fake.add_path("/nix/store/" + "a" * 32 + "-dep")
+    with DaemonConnection(fake.socket_path) as conn:
+        assert conn.daemon_version == fake.version
+        path = conn.add_text_to_store("hello.txt", "hello", ["/nix/store/" + "a" * 32 + "-dep"])
+        assert path.endswith("-hello.txt")
+        assert conn.is_valid_path(path)
+        assert not conn.is_valid_path("/nix/store/" + "b" * 32 + "-missing")
+        info = conn.query_path_info(path)
+        assert info.references == ["/nix/store/" + "a" * 32 + "-dep"]
+        assert info.nar_size == 5
+        with pytest.raises(NixDaemonError):
+            conn.query_path_info("/nix/store/" + "b" * 32 + "-missing")
+
+
+def test_request_is_one_send(fake):
+    paths = [f"/nix/store/{i:032d}-p{i}" for i in range(10_000)]
+    for p in paths[::2]:
+        fake.add_path(p)
+    with DaemonConnection(fake.socket_path) as conn:
+        conn.sock = counting = CountingSocket(conn.sock)
+        assert conn.query_valid_paths(paths) == set(paths[::2])
+        assert counting.sends == 1
+        # ~400 KiB of response through a 64 KiB buffer
+        assert counting.recvs < 50
+
+
+def test_large_strings(fake):
+    """Payloads bigger than the buffers go around them, intact."""
+    content = "x" * 300_000 + "y"
+    with DaemonConnection(fake.socket_path) as conn:
+        path = conn.add_text_to_store("big.txt", content)
+        assert conn.query_path_info(path).nar_size == len(content)
+        fake.add_path("/nix/store/" + "c" * 32 + "-big", deriver="d" * 200_000)
+        assert conn.query_path_info("/nix/store/" + "c" * 32 + "-big").deriver == "d" * 200_000
+        assert conn.is_valid_path(path)
+
+
+def test_daemon_error(fake):
+    with DaemonConnection(fake.socket_path) as conn:
+        conn._send_uint64(999)
+        with pytest.raises(NixDaemonError, match="unsupported operation 999"):
+            conn._drain_stderr()
+
+
+def test_batch_in_order(fake):
+    a, b = "/nix/store/" + "a" * 32 + "-a", "/nix/store/" + "b" * 32 + "-b"
+    fake.add_path(a, references=[b], nar_size=7)
+    fake.add_path(b)
+    with DaemonConnection(fake.socket_path) as conn:
+        results = (
+            conn.batch()
+            .query_path_info(a)
+            .is_valid_path(b)
+            .is_valid_path(a + "x")
+            .query_valid_paths([a, b, a + "x"])
+            .add_text_to_store("t.txt", "text")
+            .execute()
+        )
+        info, valid_b, valid_x, valid_set, text_path = results
+        assert (info.references, info.nar_size) == ([b], 7)
+        assert (valid_b, valid_x, valid_set) == (True, False, {a, b})
+        assert conn.is_valid_path(text_path)
+
+
+def test_query_path_infos_amortizes_round_trips(fake):
+    paths = [f"/nix/store/{i:032d}-p{i}" for i in range(1000)]
+    for i, p in enumerate(paths):
+        fake.add_path(p, nar_size=i)
+    with DaemonConnection(fake.socket_path) as conn:
+        conn.sock = counting = CountingSocket(conn.sock)
+        infos = conn.query_path_infos(paths, window=64)
+        assert [infos[p].nar_size for p in paths] == list(range(1000))
+        # one sendall per half window, instead of one round trip per path
+        assert counting.sends <= 1000 // 32 + 1
+
+
+def test_batch_invalid_path_keeps_connection(fake):
+    good = "/nix/store/" + "a" * 32 + "-good"
+    bad = "/nix/store/" + "b" * 32 + "-bad"
+    fake.add_path(good)
+    with DaemonConnection(fake.socket_path) as conn:
+        with pytest.raises(NixDaemonError, match="path not valid"):
+            conn.query_path_infos([bad, good])
+        results = conn.batch().query_path_info(bad).query_path_info(good).execute(return_exceptions=True)
+        assert isinstance(results[0], NixDaemonError)
+        assert results[1].nar_hash
+        assert conn.is_valid_path(good)
+
+
+def _sp(name: str) -> str:
+    return f"/nix/store/{hashlib.sha256(name.encode()).hexdigest()[:32]}-{name}"
+
+
+def test_compute_closure(fake):
+    libc, lib, app, other = (_sp(n) for n in ("libc", "lib", "app", "other"))
+    fake.add_path(libc, nar_size=100, references=[libc])
+    fake.add_path(lib, nar_size=20, references=[libc])
+    fake.add_path(app, nar_size=3, references=[lib, libc, app])
+    fake.add_path(other, nar_size=1000)
+    with DaemonConnection(fake.socket_path) as conn:
+        closure = conn.compute_closure([app])
+        assert list(closure.infos) == [app, lib, libc]
+        assert closure.paths == sorted([app, lib, libc]) and other not in closure
+        assert closure.nar_size == 123
+
+        cache = {}
+        conn.compute_closure([lib], cache=cache)
+        fake.ops.clear()
+        assert len(conn.compute_closure([app, lib], cache=cache)) == 3
+        assert fake.ops == [26]  # only app was not cached
+
+        with pytest.raises(NixDaemonError, match="path not valid"):
+            conn.compute_closure([_sp("missing")])
+        assert conn.is_valid_path(app)
+
+
+def test_compute_closure_include_outputs(fake):
+    src, dep_drv, dep_out, drv, out, unbuilt = (_sp(n) for n in ("src", "dep.drv", "dep", "app.drv", "app", "app-doc"))
+    fake.add_path(src)
+    fake.add_path(dep_drv, references=[src], outputs={"out": dep_out})
+    fake.add_path(dep_out, nar_size=5)
+    fake.add_path(drv, references=[dep_drv, src], outputs={"out": out, "doc": unbuilt})
+    fake.add_path(out, nar_size=7, references=[dep_out])
+    with DaemonConnection(fake.socket_path) as conn:
+        assert set(conn.compute_closure([drv]).infos) == {drv, dep_drv, src}
+        closure = conn.compute_closure([drv], include_outputs=True)
+        assert set(closure.infos) == {drv, dep_drv, src, out, dep_out}
+        assert closure.nar_size == 12
+
+
+def test_compute_closure_output_map_error(fake, monkeypatch):
+    drv = _sp("app.drv")
+    fake.add_path(drv, outputs={"out": _sp("app")})
+    read = daemon._read_output_map
+    monkeypatch.setattr(daemon, "_read_output_map", lambda r: read(r) and NixDaemonError("no output map"))
+    with DaemonConnection(fake.socket_path) as conn:
+        with pytest.raises(NixDaemonError, match="no output map"):
+            conn.compute_closure([drv], include_outputs=True)
+
+
+def test_compute_closure_round_trips_per_level(fake):
+    # 10 levels of 1000 paths; each path refers to two on the next level
+    levels = [[_sp(f"p{d}-{i}") for i in range(1000)] for d in range(10)]
+    for d, level in enumerate(levels):
+        below = levels[d + 1] if d + 1 < len(levels) else []
+        for i, p in enumerate(level):
+            fake.add_path(p, nar_size=1, references=below[i:i + 2] if below else [])
+    with DaemonConnection(fake.socket_path) as conn:
+        conn.sock = counting = CountingSocket(conn.sock)
+        closure = conn.compute_closure(levels[0], window=64)
+        assert len(closure) == closure.nar_size == 10_000
+        assert counting.sends <= 10_000 // 32 + len(levels)
+
+
+# --- DaemonPool ---
+
+def test_pool_reuses_connections(fake):
+    path = "/nix/store/" + "a" * 32 + "-p"
+    fake.add_path(path)
+    with DaemonPool(fake.socket_path, max_size=2) as pool:
+        for _ in range(5):
+            with pool.checkout() as conn:
+                assert conn.is_valid_path(path)
+    assert fake.connections == 1
+
+
+def test_pool_discards_connection_after_daemon_error(fake):
+    with DaemonPool(fake.socket_path) as pool:
+        with pool.checkout() as conn:
+            conn._send_uint64(999)
+            with pytest.raises(NixDaemonError):
+                conn._response(_read_uint64)
+            assert conn.broken
+        with pool.checkout() as fresh:
+            assert fresh is not conn
+            assert not fresh.is_valid_path("/nix/store/" + "b" * 32 + "-x")
+    assert fake.connections == 2
+
+
+def test_healthy_notices_hangup(fake):
+    with DaemonConnection(fake.socket_path) as conn:
+        assert conn.healthy()
+        conn._send_uint64(999)
+        with pytest.raises(NixDaemonError):
+            conn._response(_read_uint64)
+        conn.broken = False
+        # the daemon closes its end after the error: the socket polls
+        # readable (EOF) once it has
+        deadline = time.monotonic() + 5
+        while conn.healthy() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not conn.healthy()
+
+
+def test_pool_idle_timeout_keeps_min_size(fake):
+    with DaemonPool(fake.socket_path, min_size=1, max_size=3, idle_timeout=0) as pool:
+        assert pool.opened == 1
+        with pool.checkout() as a, pool.checkout() as b:
+            assert a is not b
+        with pool.checkout():
+            pass
+        # the extra idle connection expired; the min_size one stayed
+        assert pool.opened == 2
+        assert len(pool._idle) == 1
+
+
+def test_pool_max_size_and_timeout(fake):
+    with DaemonPool(fake.socket_path, max_size=1) as pool:
+        with pool.checkout():
+            with pytest.raises(TimeoutError):
+                pool.acquire(timeout=0.05)
+
+
+def test_pool_threads(fake):
+    paths = [f"/nix/store/{i:032d}-p{i}" for i in range(50)]
+    for p in paths:
+        fake.add_path(p)
+    errors = []
+
+    def worker():
+        try:
+            for p in paths:
+                with pool.checkout() as conn:
+                    assert conn.query_path_info(p).nar_hash
+        except Exception as e:  # surfaced below
+            errors.append(e)
+
+    with DaemonPool(fake.socket_path, max_size=3) as pool:
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert not errors
+    assert pool.opened <= 3
+
+
+# --- NAR upload ---
+
+def test_add_path_to_store(fake, tmp_path):
+    tree = tmp_path / "src"
+    (tree / "sub").mkdir(parents=True)
+    (tree / "small.txt").write_text("hello")
+    (tree / "sub" / "big.bin").write_bytes(os.urandom(300_000))
+    fake.stderr_log = ["copying path"]
+    with DaemonConnection(fake.socket_path) as conn:
+        path = conn.add_path_to_store(tree)
+        assert path == store_path.make_source_store_path("src", nar.nar_hash(tree))
+        assert fake.nars[path] == nar.nar_serialize(tree)
+        info = conn.query_path_info(path)
+        assert info.nar_size == len(fake.nars[path])
+        assert info.ca.startswith("fixed:r:sha256:")
+        assert info.path == path
+
+
+def test_add_to_store_nar_sources(fake, tmp_path):
+    (tmp_path / "f").write_bytes(b"x" * 100_000)
+    data = nar.nar_serialize(tmp_path / "f")
+    digest = hashlib.sha256(data).digest()
+    with DaemonConnection(fake.socket_path) as conn:
+        sources = [data, io.BytesIO(data), nar.nar_stream(tmp_path / "f")]
+        for i, source in enumerate(sources):
+            info = PathInfo("", "sha256:" + digest.hex(), [], 0, len(data), [], path=f"/nix/store/{i:032d}-f")
+            assert conn.add_to_store_nar(info, source, chunk_size=4096) == info.path
+            assert fake.nars[info.path] == data
+
+
+def _record_wbuf(conn) -> list[int]:
+    """Record the write buffer's size at every flush (its peaks)."""
+    sizes = []
+    flush = conn._flush
+
+    def recording_flush():
+        sizes.append(len(conn._wbuf))
+        flush()
+
+    conn._flush = recording_flush
+    return sizes
+
+
+def test_add_to_store_nar_bounded_memory(fake):
+    data = os.urandom(5_000_000)
+    info = PathInfo("", "sha256:" + hashlib.sha256(data).hexdigest(), [], 0, len(data), [],
+                    path="/nix/store/" + "a" * 32 + "-big")
+    with DaemonConnection(fake.socket_path) as conn:
+        sizes = _record_wbuf(conn)
+        conn.add_to_store_nar(info, io.BytesIO(data), chunk_size=4096)
+        assert fake.nars[info.path] == data
+        assert max(sizes) < 3 * 4096
+
+
+def test_add_to_store_nar_mismatch(fake):
+    info = PathInfo("", "sha256:" + "0" * 64, [], 0, 3, [], path="/nix/store/" + "a" * 32 + "-x")
+    with DaemonConnection(fake.socket_path) as conn:
+        with pytest.raises(NixDaemonError, match="hash mismatch"):
+            conn.add_to_store_nar(info, b"abc")
+        assert conn.broken
+
+
+def test_add_multiple_to_store(fake, tmp_path):
+    items = []
+    for i in range(20):
+        (tmp_path / f"f{i}").write_text(f"file {i}\n" * i)
+        data = nar.nar_serialize(tmp_path / f"f{i}")
+        info = PathInfo("", "sha256:" + hashlib.sha256(data).hexdigest(), [], 0, len(data), [],
+                        path=f"/nix/store/{i:032d}-f{i}")
+        items.append((info, nar.nar_stream(tmp_path / f"f{i}")))
+    (tmp_path / "tree" / "d").mkdir(parents=True)
+    (tmp_path / "tree" / "d" / "x").write_bytes(os.urandom(200_000))
+    (tmp_path / "tree" / "l").symlink_to("d/x")
+    tree = nar.nar_serialize(tmp_path / "tree")
+    info = PathInfo("", "sha256:" + hashlib.sha256(tree).hexdigest(), [items[0][0].path], 0, len(tree), [],
+                    path="/nix/store/" + "t" * 32 + "-tree")
+    items.append((info, io.BytesIO(tree)))
+    with DaemonConnection(fake.socket_path) as conn:
+        paths = conn.add_multiple_to_store(iter(items), chunk_size=8192)
+        assert paths == [info.path for info, _ in items]
+        assert fake.ops.count(44) == 1
+        assert fake.nars[info.path] == tree
+        assert conn.query_valid_paths(paths) == set(paths)
+        assert conn.query_path_info(info.path).references == [items[0][0].path]
+
+
+def test_add_multiple_to_store_bounded_memory(fake, tmp_path):
+    nars = []
+    for i in range(5):
+        (tmp_path / f"f{i}").write_bytes(os.urandom(1_000_000))
+        nars.append(nar.nar_serialize(tmp_path / f"f{i}"))
+    items = [
+        (PathInfo("", "sha256:" + hashlib.sha256(data).hexdigest(), [], 0, len(data), [],
+                  path=f"/nix/store/{i:032d}-big"), io.BytesIO(data))
+        for i, data in enumerate(nars)
+    ]
+    with DaemonConnection(fake.socket_path) as conn:
+        sizes = _record_wbuf(conn)
+        paths = conn.add_multiple_to_store(items, chunk_size=4096)
+        assert [fake.nars[p] for p in paths] == nars
+        assert max(sizes) < 3 * 4096
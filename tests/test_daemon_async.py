@@ -0,0 +1,144 @@
+"""Tests for the asyncio daemon client, against tests.fake_daemon."""
+
+import asyncio
+import pytest
+
+from pix import daemon_async
+from pix.daemon import NixDaemonError
+from pix.daemon_async import AsyncDaemonConnection, AsyncDaemonPool
+from tests.fake_daemon import FakeDaemon
+
+
+@pytest.fixture
+def fake(tmp_path):
+    with FakeDaemon(tmp_path / "socket") as fake:
+        yield fake
+
+
+def test_roundtrip(fake):
+    dep = "/nix/store/" + "a" * 32 + "-dep"
+    missing = "/nix/store/" + "b" * 32 + "-missing"
+    fake.add_path(dep)
+    fake.stderr_log = ["building...", "x" * 100_000]
+
+    async def main():
+        async with AsyncDaemonConnection(fake.socket_path) as conn:
+            assert conn.daemon_version == fake.version
+            path = await conn.add_text_to_store("hello.txt", "hello", [dep])
+            assert await conn.is_valid_path(path)
+            assert not await conn.is_valid_path(missing)
+            assert await conn.query_valid_paths([dep, missing]) == {dep}
+            info = await conn.query_path_info(path)
+            assert (info.references, info.nar_size) == ([dep], 5)
+            with pytest.raises(NixDaemonError, match="path not valid"):
+                await conn.query_path_info(missing)
+            # an invalid path is a complete reply: the connection carries on
+            assert not conn.broken
+            await conn.build_paths([path])
+
+    asyncio.run(main())
+
+
+def test_query_path_infos_large(fake):
+    paths = [f"/nix/store/{i:032d}-p{i}" for i in range(500)]
+    for i, p in enumerate(paths):
+        fake.add_path(p, nar_size=i, deriver="d" * (i * 200))
+
+    async def main():
+        async with AsyncDaemonConnection(fake.socket_path) as conn:
+            infos = await conn.query_path_infos(paths, window=16)
+            assert [infos[p].nar_size for p in paths] == list(range(500))
+            assert infos[paths[-1]].deriver == "d" * (499 * 200)
+
+    asyncio.run(main())
+
+
+def test_cancellation_breaks_connection(fake):
+    path = "/nix/store/" + "a" * 32 + "-p"
+    fake.add_path(path)
+
+    async def main():
+        async with AsyncDaemonConnection(fake.socket_path) as conn:
+            task = asyncio.create_task(conn.query_path_info(path))
+            await asyncio.sleep(0)  # request sent, reply not yet read
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert conn.broken
+            with pytest.raises(ConnectionError):
+                await conn.is_valid_path(path)
+
+    asyncio.run(main())
+
+
+def test_pool_runs_concurrently_and_reuses(fake):
+    paths = [f"/nix/store/{i:032d}-p{i}" for i in range(200)]
+    for i, p in enumerate(paths):
+        fake.add_path(p, nar_size=i)
+
+    async def main():
+        async with AsyncDaemonPool(fake.socket_path, size=3) as pool:
+            infos = await pool.query_path_infos(paths)
+            assert [infos[p].nar_size for p in paths] == list(range(200))
+            results = await asyncio.gather(*(_valid(pool, p) for p in paths[:20]))
+            assert all(results)
+
+    asyncio.run(main())
+    assert fake.connections == 3
+
+
+async def _valid(pool, path):
+    async with pool.connection() as conn:
+        return await conn.is_valid_path(path)
+
+
+def test_pool_replaces_broken_connection(fake):
+    path = "/nix/store/" + "a" * 32 + "-p"
+    fake.add_path(path)
+
+    async def main():
+        async with AsyncDaemonPool(fake.socket_path, size=1) as pool:
+            async with pool.connection() as conn:
+                task = asyncio.create_task(conn.is_valid_path(path))
+                await asyncio.sleep(0)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            async with pool.connection() as fresh:
+                assert fresh is not conn
+                assert await fresh.is_valid_path(path)
+
+    asyncio.run(main())
+    assert fake.connections == 2
+
+
+def test_large_reply_decoded_once(fake, monkeypatch):
+    paths = [f"/nix/store/{i:032d}-{'p' * 40}{i}" for i in range(10_000)]
+    for p in paths:
+        fake.add_path(p)
+    decoded = restarts = 0
+    real_bytes = daemon_async._BufferReader._bytes
+    real_restart = daemon_async._BufferReader.restart
+
+    def counting_bytes(self):
+        nonlocal decoded
+        decoded += 1
+        return real_bytes(self)
+
+    def counting_restart(self):
+        nonlocal restarts
+        restarts += 1
+        real_restart(self)
+
+    monkeypatch.setattr(daemon_async._BufferReader, "_bytes", counting_bytes)
+    monkeypatch.setattr(daemon_async._BufferReader, "restart", counting_restart)
+
+    async def main():
+        async with AsyncDaemonConnection(fake.socket_path) as conn:
+            decoded_before, restarts_before = decoded, restarts
+            assert await conn.query_valid_paths(paths) == set(paths)
+            # the ~900 KB reply arrives in many reads: each string is parsed
+            # once, plus one retry of the string cut off by each read
+            assert restarts - restarts_before > 1
+            assert decoded - decoded_before <= len(paths) + (restarts - restarts_before) + 10
+
+    asyncio.run(main())
@@ -1,6 +1,13 @@
 """Tests for .drv ATerm parsing and serialization."""
 
-from pix.derivation import parse, serialize, Derivation, DerivationOutput, hash_derivation_modulo
+import random
+
+import pytest
+
+from pix.derivation import (
+    parse, parse_lazy, parse_reference, read_drv, serialize, load_closure,
+    Derivation, DerivationOutput, DrvHashEngine, hash_derivation_modulo,
+)
 
 
 MINIMAL_DRV = (
@@ -79,3 +86,244 @@ def test_parse_empty_lists():
     assert drv.input_drvs == {}
     assert drv.input_srcs == []
     assert drv.args == []
+
+
+def test_parse_matches_reference():
+    """The slicing parser agrees with the per-character scanner on escapes."""
+    rng = random.Random(0)
+    alphabet = 'ab"\\\n\r\t$ {}'
+    for _ in range(300):
+        env = {
+            "".join(rng.choices(alphabet, k=rng.randrange(5))) or "k":
+            "".join(rng.choices(alphabet, k=rng.randrange(40)))
+            for _ in range(rng.randrange(1, 5))
+        }
+        text = serialize(Derivation(outputs={"out": DerivationOutput("/nix/store/x", "", "")}, env=env))
+        assert parse(text) == parse_reference(text)
+        assert parse(text).env == env
+
+
+def test_parse_bytes():
+    assert parse(MINIMAL_DRV.encode()) == parse(MINIMAL_DRV)
+    assert parse(memoryview(MINIMAL_DRV.encode())) == parse(MINIMAL_DRV)
+
+
+def test_parse_unterminated_string():
+    for text in ('Derive([("out', 'Derive([("out\\"', 'Derive([("out\\'):
+        with pytest.raises(ValueError):
+            parse(text)
+
+
+def _write_chain(tmp_path, n=6):
+    """A diamond-ish DAG of .drv files: drv i depends on i+1 and i+2."""
+    paths = [str(tmp_path / f"d{i}.drv") for i in range(n)]
+    for i, path in enumerate(paths):
+        deps = {p: ["out"] for p in paths[i + 1:i + 3]}
+        drv = Derivation(outputs={"out": DerivationOutput(f"/nix/store/o{i}", "", "")}, input_drvs=deps)
+        with open(path, "w") as f:
+            f.write(serialize(drv))
+    return paths
+
+
+def test_load_closure(tmp_path):
+    paths = _write_chain(tmp_path)
+    closure = load_closure(paths[0])
+    assert set(closure) == set(paths)
+    assert closure[paths[3]].outputs["out"].path == "/nix/store/o3"
+    assert set(load_closure([paths[4], paths[4]])) == set(paths[4:])
+
+
+def test_load_closure_parallel(tmp_path):
+    paths = _write_chain(tmp_path, n=40)
+    assert load_closure(paths[0], workers=2, batch=4) == load_closure(paths[0])
+
+
+def test_load_closure_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_closure(str(tmp_path / "missing.drv"), workers=2)
+
+
+def _engine_chain(tmp_path, n=6):
+    paths = _write_chain(tmp_path, n)
+    for i, path in enumerate(paths):
+        drv = parse(open(path).read())
+        drv.env["name"] = f"d{i}"
+        with open(path, "w") as f:
+            f.write(serialize(drv))
+    return paths
+
+
+def test_drv_hash_engine_matches_manual(tmp_path):
+    paths = _engine_chain(tmp_path)
+    engine = DrvHashEngine()
+    hashes: dict[str, bytes] = {}
+    for path in reversed(paths):
+        hashes[path] = hash_derivation_modulo(read_drv(path), hashes, mask_outputs=False)
+    assert engine.hash(paths[0]) == hashes[paths[0]]
+    assert engine.hash(paths[0], mask_outputs=True) == hash_derivation_modulo(read_drv(paths[0]), hashes)
+
+
+def test_drv_hash_engine_hashes_each_node_once(tmp_path):
+    paths = _engine_chain(tmp_path, n=30)
+    engine = DrvHashEngine()
+    engine.hash(paths[0])
+    assert engine.computed == 30
+    for path in paths:
+        engine.hash(path)
+    assert engine.computed == 30
+    outs = engine.output_paths(paths[0])
+    assert set(outs) == {"out"} and outs["out"].endswith("-d0")
+    assert engine.computed == 31
+
+
+def test_drv_hash_engine_hash_drv(tmp_path):
+    paths = _engine_chain(tmp_path)
+    engine = DrvHashEngine()
+    drv = Derivation(outputs={"out": DerivationOutput("", "", "")}, input_drvs={paths[0]: ["out"]})
+    h = engine.hash_drv(drv)
+    assert h == hash_derivation_modulo(drv, {paths[0]: engine.hash(paths[0])})
+    computed = engine.computed
+    assert engine.hash_drv(parse(serialize(drv))) == h
+    assert engine.computed == computed + 1  # the inputs are not hashed again
+
+
+def _store_chain(n=6):
+    """The chain of _write_chain, in memory under store paths."""
+    paths = [f"/nix/store/{i:032d}-d{i}.drv" for i in range(n)]
+    return paths, {
+        path: Derivation(
+            outputs={"out": DerivationOutput(f"/nix/store/o{i}", "", "")},
+            input_drvs={p: ["out"] for p in paths[i + 1:i + 3]},
+            env={"name": f"d{i}"},
+        )
+        for i, path in enumerate(paths)
+    }
+
+
+def test_drv_hash_engine_persistence(tmp_path):
+    paths, drvs = _store_chain()
+    cache_file = str(tmp_path / "hashes.json")
+    engine = DrvHashEngine(drvs.__getitem__, cache_file=cache_file)
+    expected = engine.hash(paths[0], mask_outputs=True)
+    engine.save()
+
+    def no_loader(path):
+        raise AssertionError(f"loaded {path}")
+
+    warm = DrvHashEngine(no_loader, cache_file=cache_file)
+    assert warm.hash(paths[0], mask_outputs=True) == expected
+    assert warm.hash(paths[3]) == engine.hash(paths[3])
+    assert warm.computed == 0
+
+
+def test_drv_hash_engine_saves_store_paths_only(tmp_path):
+    """A .drv outside the store can change under the same path: not persisted."""
+    paths = _engine_chain(tmp_path)
+    cache_file = str(tmp_path / "hashes.json")
+    engine = DrvHashEngine(cache_file=cache_file)
+    engine.hash(paths[0])
+    engine.save()
+
+    with open(paths[5], "w") as f:
+        f.write(serialize(Derivation(outputs={"out": DerivationOutput("/nix/store/changed", "", "")})))
+    warm = DrvHashEngine(cache_file=cache_file)
+    assert warm.hash(paths[0]) == DrvHashEngine().hash(paths[0]) != engine.hash(paths[0])
+
+
+def test_serialize_minimal():
+    assert serialize(parse(MINIMAL_DRV)) == MINIMAL_DRV
+
+
+def test_serialize_escapes_per_string():
+    """Section-wide escaping still escapes each string on its own."""
+    drv = Derivation(
+        outputs={"out": DerivationOutput("/nix/store/x", "", "")},
+        args=["a\0b", 'say "hi"\n'],
+        env={"k\0": "v\t", "plain": "x"},
+    )
+    text = serialize(drv)
+    assert '["a\0b","say \\"hi\\"\\n"]' in text
+    assert '[("k\0","v\\t"),("plain","x")]' in text
+    assert parse(text) == drv
+
+
+def test_slots():
+    drv = parse(MINIMAL_DRV)
+    assert not hasattr(drv, "__dict__")
+    assert not hasattr(drv.outputs["out"], "__dict__")
+
+
+def test_freeze_thaw():
+    drv = parse(MINIMAL_DRV)
+    frozen = drv.freeze()
+    assert serialize(frozen) == MINIMAL_DRV
+    assert hash_derivation_modulo(frozen, {"/nix/store/xyz.drv": b"h" * 32}) == \
+        hash_derivation_modulo(drv, {"/nix/store/xyz.drv": b"h" * 32})
+    assert frozen.env["key"] == "value" and frozen.args == ("--build",)
+    with pytest.raises(AttributeError):
+        frozen.platform = "aarch64-linux"
+    with pytest.raises(TypeError):
+        frozen.env["key"] = "other"
+    assert frozen.thaw() == drv
+    assert drv.freeze() == frozen
+
+
+def test_parse_intern():
+    a = parse(MINIMAL_DRV.encode(), intern=True)
+    b = parse(MINIMAL_DRV.encode(), intern=True)
+    assert a == parse(MINIMAL_DRV)
+    assert a.outputs["out"].path is b.outputs["out"].path
+    assert next(iter(a.env)) is next(iter(b.env))
+    long_value = "x" * 1000
+    drv = Derivation(env={"script": long_value})
+    c, d = (parse(serialize(drv), intern=True) for _ in range(2))
+    assert c.env["script"] == long_value and c.env["script"] is not d.env["script"]
+
+
+def test_parse_lazy():
+    lazy = parse_lazy(MINIMAL_DRV.encode())
+    assert lazy.input_drvs == {"/nix/store/xyz.drv": ["out"]}
+    assert lazy.outputs["out"].path == "/nix/store/abc-hello"
+    assert not lazy.decoded
+    assert lazy.env == {"key": "value", "out": "/nix/store/abc-hello"}
+    assert not lazy.decoded
+    assert lazy.args == ["--build"]
+    assert lazy.decoded
+    assert lazy == parse(MINIMAL_DRV) and parse(MINIMAL_DRV) == lazy
+    assert serialize(lazy) == MINIMAL_DRV
+
+
+def test_parse_lazy_escapes_and_setters():
+    drv = Derivation(
+        outputs={"out": DerivationOutput("/nix/store/x", "", "")},
+        args=['-c', 'echo "]" \\ done'],
+        env={"script": 'a\n"b"'},
+    )
+    lazy = parse_lazy(serialize(drv))
+    assert lazy.to_derivation() == drv
+    lazy.env = {"k": "v"}
+    assert parse(serialize(lazy)).env == {"k": "v"}
+
+
+def test_parse_lazy_freeze():
+    lazy = parse_lazy(MINIMAL_DRV)
+    assert not isinstance(lazy, Derivation)
+    assert lazy.freeze() == parse(MINIMAL_DRV).freeze()
+    assert lazy.decoded
+
+
+def test_parse_lazy_defers_env_errors():
+    text = MINIMAL_DRV.replace('[("key"', '[("key"x')
+    lazy = parse_lazy(text)
+    assert lazy.platform == "x86_64-linux"
+    with pytest.raises(ValueError):
+        lazy.env
+
+
+def test_load_closure_lazy(tmp_path):
+    paths = _write_chain(tmp_path, n=10)
+    eager = load_closure(paths[0])
+    for workers in (1, 2):
+        lazy = load_closure(paths[0], workers=workers, lazy=True)
+        assert all(not d.decoded for d in lazy.values())
+        assert lazy == eager
@@ -0,0 +1,42 @@
+"""Tests for the streaming Hasher and hash formatting."""
+
+import hashlib
+import io
+
+import pytest
+
+from pix.hash import Hasher, format_hash, hash_file
+
+# From: echo -n "hello" | nix hash file --type sha256 --sri /dev/stdin
+HELLO_SRI = "sha256-LPJNul+wow4m6DsqxbninhsWHlwfp0JecwQzYpOLmCQ="
+HELLO_NIX_B32 = "094qif9n4cq4fdg459qzbhg1c6wywawwaaivx0k0x8xhbyx4vwic"
+
+
+def test_encodings():
+    h = Hasher()
+    h.update(b"hello")
+    assert h.sri() == HELLO_SRI
+    assert h.base32() == HELLO_NIX_B32
+    assert h.format("base32") == f"sha256:{HELLO_NIX_B32}"
+    assert h.format() == "sha256:" + hashlib.sha256(b"hello").hexdigest()
+    assert h.format("base64") == "sha256:" + HELLO_SRI[len("sha256-"):]
+
+
+@pytest.mark.parametrize("algo", ["md5", "sha1", "sha256", "sha512"])
+def test_update_file_streams(tmp_path, algo):
+    data = bytes(range(256)) * 5000
+    path = tmp_path / "blob"
+    path.write_bytes(data)
+
+    h = Hasher(algo)
+    # A buffer much smaller than the file forces many readinto() rounds
+    assert h.update_file(io.BytesIO(data), buffer_size=4096) == len(data)
+    assert h.digest() == hashlib.new(algo, data).digest()
+    assert hash_file(path, algo).hexdigest() == hashlib.new(algo, data).hexdigest()
+
+
+def test_unsupported():
+    with pytest.raises(ValueError):
+        Hasher("blake3")
+    with pytest.raises(ValueError):
+        format_hash("sha256", b"\0" * 32, "base58")
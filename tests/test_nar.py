@@ -2,12 +2,21 @@
 
 import base64
 import hashlib
+import io
 import os
+import socket
 import struct
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from pix.nar import nar_serialize, nar_hash, nar_hash_hex
+import pytest
+
+from pix.nar import (
+    NarAccessor, NarEntry, NarReader, nar_dump, nar_dump_with_listing, nar_listing,
+    nar_restore, nar_serialize, nar_stream, nar_hash, nar_hash_hex, _Prefetcher,
+)
 
 
 # From: nix hash path /tmp/pix-test-hello.txt (file containing "hello", no newline)
@@ -120,3 +129,191 @@ def test_executable_file():
         assert _str("executable") in nar
     finally:
         os.unlink(path)
+
+
+def test_stream_matches_serialize():
+    with tempfile.TemporaryDirectory() as d:
+        Path(d, "big.bin").write_bytes(os.urandom(300_000))
+        Path(d, "small.txt").write_text("hi")
+        Path(d, "sub").mkdir()
+        Path(d, "sub", "x").write_text("x" * 13)
+
+        chunks = list(nar_stream(d, chunk_size=4096))
+        assert b"".join(chunks) == nar_serialize(d)
+        # Buffers stay bounded: at most one chunk plus one wire token
+        assert max(len(c) for c in chunks) < 2 * 4096
+
+
+def test_dump_to_fileobj():
+    with tempfile.TemporaryDirectory() as d:
+        Path(d, "a.txt").write_text("aaa")
+        Path(d, "b.bin").write_bytes(os.urandom(70_000))
+
+        out = io.BytesIO()
+        size = nar_dump(d, out)
+        assert out.getvalue() == nar_serialize(d)
+        assert size == len(out.getvalue())
+        assert nar_hash(d) == hashlib.sha256(out.getvalue()).digest()
+        assert nar_hash_hex(d) == hashlib.sha256(out.getvalue()).hexdigest()
+
+
+def test_parallel_hash_matches_serial():
+    with tempfile.TemporaryDirectory() as d:
+        for i in range(200):
+            sub = Path(d, f"dir{i % 7}")
+            sub.mkdir(exist_ok=True)
+            Path(sub, f"file{i}").write_bytes(os.urandom(i * 37))
+        Path(d, "huge.bin").write_bytes(os.urandom(3 * 1024 * 1024))
+        Path(d, "run.sh").write_text("#!/bin/sh\n")
+        os.chmod(Path(d, "run.sh"), 0o755)
+        Path(d, "link").symlink_to("dir0")
+
+        expected = hashlib.sha256(nar_serialize(d)).digest()
+        assert nar_hash(d, workers=4) == expected
+        assert nar_hash_hex(d, workers=4) == expected.hex()
+
+
+def test_prefetcher_skips_paths_never_visited(tmp_path):
+    """A read-ahead file the serializer never reaches must not stall the rest."""
+    for name in ("a", "b", "c", "d"):
+        (tmp_path / name).write_text(name)
+    with ThreadPoolExecutor(2) as pool:
+        prefetch = _Prefetcher(tmp_path, pool, window=2)
+        # the serializer never asks for "a" and "b", as if they had become
+        # directories after the read-ahead listed them
+        assert prefetch.take(tmp_path / "c") == b"c"
+        assert prefetch.take(tmp_path / "d") == b"d"
+
+
+def _sample_tree(d: str) -> None:
+    Path(d, "a.txt").write_text("aaa")
+    Path(d, "big.bin").write_bytes(os.urandom(200_003))
+    Path(d, "empty").write_bytes(b"")
+    Path(d, "sub").mkdir()
+    Path(d, "sub", "run.sh").write_text("#!/bin/sh\n")
+    os.chmod(Path(d, "sub", "run.sh"), 0o755)
+    Path(d, "sub", "link").symlink_to("../a.txt")
+
+
+def test_reader_events():
+    with tempfile.TemporaryDirectory() as d:
+        _sample_tree(d)
+        nar = nar_serialize(d)
+
+        reader = NarReader(memoryview(nar), chunk_size=4096)
+        seen = {}
+        for entry in reader:
+            if entry.path == "a.txt":
+                assert b"".join(reader.read_contents()) == b"aaa"
+            seen[entry.path] = entry
+
+        assert list(seen) == ["", "a.txt", "big.bin", "empty", "sub", "sub/link", "sub/run.sh"]
+        assert seen[""].type == "directory"
+        assert seen["big.bin"].size == 200_003
+        assert seen["sub/run.sh"].executable
+        assert not seen["a.txt"].executable
+        assert seen["sub/link"] == NarEntry("sub/link", "symlink", target="../a.txt")
+
+
+def test_restore_roundtrip():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _sample_tree(src)
+        nar = nar_serialize(src)
+
+        dest = Path(out, "restored")
+        nar_restore(io.BytesIO(nar), dest)
+        assert nar_serialize(dest) == nar
+        assert os.access(dest / "sub" / "run.sh", os.X_OK)
+
+
+def test_restore_from_socket():
+    with tempfile.TemporaryDirectory() as src, tempfile.TemporaryDirectory() as out:
+        _sample_tree(src)
+        nar = nar_serialize(src)
+
+        a, b = socket.socketpair()
+        sender = threading.Thread(target=lambda: (a.sendall(nar), a.close()))
+        sender.start()
+        nar_restore(b, Path(out, "r"))
+        sender.join()
+        b.close()
+        assert nar_serialize(Path(out, "r")) == nar
+
+
+def test_reader_leaves_what_follows_the_nar():
+    """A NAR embedded in a stream: the bytes after it are handed back."""
+    with tempfile.TemporaryDirectory() as src:
+        _sample_tree(src)
+        nar = nar_serialize(src)
+        trailer = b"STDERR_LAST and the reply"
+        a, b = socket.socketpair()
+        with a, b:
+            a.sendall(nar + trailer)
+            a.shutdown(socket.SHUT_WR)
+            reader = NarReader(b, chunk_size=4096)
+            for entry in reader:
+                pass
+            assert reader.size() == len(nar)
+            rest = reader.leftover()
+            while chunk := b.recv(4096):
+                rest += chunk
+            assert rest == trailer
+
+
+def _entries_nar(*names: str) -> bytes:
+    body = b"".join(
+        _str("entry") + _str("(") + _str("name") + _str(n) + _str("node")
+        + _str("(") + _str("type") + _str("regular") + _str("contents") + _str("") + _str(")")
+        + _str(")")
+        for n in names
+    )
+    return _str("nix-archive-1") + _str("(") + _str("type") + _str("directory") + body + _str(")")
+
+
+def test_reader_rejects_bad_input():
+    for bad in [
+        _str("nix-archive-2"),
+        _entries_nar("b", "a"),       # unsorted
+        _entries_nar("a", "a"),       # duplicate
+        _entries_nar(".."),           # escapes dest
+        _entries_nar("x/y"),
+        _entries_nar("a")[:-16],      # truncated
+    ]:
+        with pytest.raises(ValueError):
+            list(NarReader(bad))
+
+    assert [e.path for e in NarReader(_entries_nar("a", "b"))] == ["", "a", "b"]
+
+
+def test_listing_offsets():
+    with tempfile.TemporaryDirectory() as d:
+        _sample_tree(d)
+        out = io.BytesIO()
+        listing = nar_dump_with_listing(d, out)
+        nar = out.getvalue()
+
+        assert nar == nar_serialize(d)
+        assert listing == nar_listing(nar)
+        run = listing["root"]["entries"]["sub"]["entries"]["run.sh"]
+        assert run["executable"] and run["size"] == 10
+        assert nar[run["narOffset"]:run["narOffset"] + run["size"]] == b"#!/bin/sh\n"
+        assert listing["root"]["entries"]["sub"]["entries"]["link"] == {"type": "symlink", "target": "../a.txt"}
+
+
+def test_accessor():
+    with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as out:
+        _sample_tree(d)
+        nar_file = Path(out, "t.nar")
+        with open(nar_file, "wb") as f:
+            listing = nar_dump_with_listing(d, f)
+
+        for given in (listing, None):
+            with NarAccessor(nar_file, given) as acc:
+                assert acc.read("big.bin") == Path(d, "big.bin").read_bytes()
+                assert acc.read("/sub/run.sh") == b"#!/bin/sh\n"
+                assert acc.read("empty") == b""
+                assert set(acc.ls("")["entries"]) == {"a.txt", "big.bin", "empty", "sub"}
+                with pytest.raises(FileNotFoundError):
+                    acc.ls("nope")
+                with pytest.raises(ValueError):
+                    acc.read("sub")
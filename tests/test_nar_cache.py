@@ -0,0 +1,96 @@
+"""Tests for the persistent NAR hash cache."""
+
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+from pix import hash as nixhash, main, nar_cache
+from pix.nar import nar_hash
+from pix.nar_cache import NarHashCache, fingerprint
+
+
+@pytest.fixture
+def tree(tmp_path):
+    d = tmp_path / "src"
+    d.mkdir()
+    (d / "a.txt").write_text("aaa")
+    (d / "sub").mkdir()
+    (d / "sub" / "b.txt").write_text("bbb")
+    (d / "link").symlink_to("a.txt")
+    return d
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # Files in these tests were all just written; disable the racy window
+    # so they are eligible for caching.
+    monkeypatch.setattr(nar_cache, "RACY_WINDOW_NS", -10**18)
+    with NarHashCache(tmp_path / "cache.sqlite") as c:
+        yield c
+
+
+def test_hit_after_miss(tree, cache):
+    h = cache.nar_hash(tree)
+    assert h == nar_hash(tree)
+    assert cache.nar_hash(tree) == h
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_persists_across_instances(tree, cache):
+    h = cache.nar_hash(tree)
+    with NarHashCache(cache.db_path) as again:
+        assert again.nar_hash(tree) == h
+        assert again.hits == 1
+
+
+def test_same_size_edit_invalidates(tree, cache):
+    cache.nar_hash(tree)
+    st = (tree / "sub" / "b.txt").stat()
+    (tree / "sub" / "b.txt").write_text("BBB")
+    # Put mtime back: ctime still moves, so the edit is still seen
+    os.utime(tree / "sub" / "b.txt", ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert cache.nar_hash(tree) == nar_hash(tree)
+    assert cache.misses == 2
+
+
+def test_exec_bit_invalidates(tree, cache):
+    cache.nar_hash(tree)
+    os.chmod(tree / "a.txt", 0o755)
+    assert cache.nar_hash(tree) == nar_hash(tree)
+    assert cache.misses == 2
+
+
+def test_racy_tree_not_stored(tree, tmp_path):
+    with NarHashCache(tmp_path / "racy.sqlite") as c:
+        c.nar_hash(tree)
+        c.nar_hash(tree)
+        assert c.hits == 0
+
+
+def test_fingerprint_same_tree_through_another_path(tree, tmp_path):
+    """The fingerprint depends on the tree, not on the path used to reach it."""
+    (tmp_path / "alias").symlink_to(tree.parent, target_is_directory=True)
+    fp1, _ = fingerprint(tree)
+    fp2, _ = fingerprint(str(tmp_path / "alias" / tree.name))
+    assert fp1 == fp2
+    assert fingerprint(tree / "sub")[0] == fingerprint(tmp_path / "alias" / tree.name / "sub")[0]
+
+
+def test_hash_path_without_a_usable_cache(tree, tmp_path, monkeypatch, capsys):
+    """A database that fails on lookup or store still gets an answer."""
+    def locked(self, path, workers=1):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    monkeypatch.setattr(NarHashCache, "nar_hash", locked)
+    monkeypatch.setattr(sys, "argv", ["pix", "hash-path", str(tree)])
+    main.main()
+    assert capsys.readouterr().out.strip() == nixhash.format_hash("sha256", nar_hash(tree), "base16")
+
+
+def test_default_path_honours_xdg(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", "/tmp/xdg")
+    assert nar_cache.default_cache_path() == Path("/tmp/xdg/pix/nar-hash.sqlite")
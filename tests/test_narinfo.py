@@ -0,0 +1,131 @@
+"""Tests for .narinfo parsing, binary cache directories and pix import-paths."""
+
+import hashlib
+import lzma
+import sys
+import pytest
+
+from pix import base32, daemon, main, nar, narinfo
+from pix.narinfo import NarInfo
+from tests.fake_daemon import FakeDaemon
+
+STORE = "/nix/store/"
+
+HELLO = f"""StorePath: {STORE}{'f' * 32}-hello-2.12.2
+URL: nar/abc.nar.xz
+Compression: xz
+FileHash: sha256:1w1f
+FileSize: 50184
+NarHash: sha256:0ahv
+NarSize: 226488
+References: {'9' * 32}-glibc-2.39 {'f' * 32}-hello-2.12.2
+Deriver: {'s' * 32}-hello-2.12.2.drv
+Sig: cache.nixos.org-1:Qk1Q
+Sig: other-1:AAAA
+"""
+
+
+def test_parse():
+    info = narinfo.parse(HELLO)
+    assert info.store_path == f"{STORE}{'f' * 32}-hello-2.12.2"
+    assert (info.url, info.compression, info.nar_size) == ("nar/abc.nar.xz", "xz", 226488)
+    assert info.references == [f"{STORE}{'9' * 32}-glibc-2.39", info.store_path]
+    assert info.deriver == f"{STORE}{'s' * 32}-hello-2.12.2.drv"
+    assert info.sigs == ["cache.nixos.org-1:Qk1Q", "other-1:AAAA"]
+
+
+def test_roundtrip():
+    info = narinfo.parse(HELLO)
+    assert narinfo.parse(info.to_text()) == info
+
+
+def test_missing_field():
+    with pytest.raises(ValueError, match="NarHash"):
+        narinfo.parse("StorePath: /nix/store/x\nURL: nar/x.nar\nNarSize: 1\n")
+
+
+def _entry(name: str, refs: list[str]) -> NarInfo:
+    return NarInfo(STORE + name, f"nar/{name}.nar", "sha256:0", 1, "none", references=[STORE + r for r in refs])
+
+
+def test_read_dir_dependencies_first(tmp_path):
+    entries = [
+        _entry("a" * 32 + "-app", ["c" * 32 + "-lib", "a" * 32 + "-app"]),
+        _entry("b" * 32 + "-libc", []),
+        _entry("c" * 32 + "-lib", ["b" * 32 + "-libc", "z" * 32 + "-elsewhere"]),
+    ]
+    for e in entries:
+        (tmp_path / (e.store_path[len(STORE):32 + len(STORE)] + ".narinfo")).write_text(e.to_text())
+    order = [e.store_path[len(STORE) + 33:] for e in narinfo.read_dir(tmp_path)]
+    assert order == ["libc", "lib", "app"]
+
+
+def test_open_nar_decompresses(tmp_path):
+    (tmp_path / "nar").mkdir()
+    (tmp_path / "nar" / "x.nar.xz").write_bytes(lzma.compress(b"nar bytes"))
+    info = NarInfo(STORE + "x" * 32 + "-x", "nar/x.nar.xz", "sha256:0", 9, "xz")
+    with info.open_nar(tmp_path) as f:
+        assert f.read() == b"nar bytes"
+    info.compression = "zstd"
+    with pytest.raises(ValueError, match="zstd"):
+        info.open_nar(tmp_path)
+
+
+def _cache_entry(cache_dir, tmp_path, name: str, compression: str, **fields) -> NarInfo:
+    src = tmp_path / "src" / name
+    src.parent.mkdir(exist_ok=True)
+    src.write_text(f"contents of {name}\n")
+    data = nar.nar_serialize(src)
+    digest = hashlib.sha256(data).digest()
+    url = f"nar/{name}.nar" + (".xz" if compression == "xz" else "")
+    (cache_dir / "nar").mkdir(parents=True, exist_ok=True)
+    (cache_dir / url).write_bytes(lzma.compress(data) if compression == "xz" else data)
+    info = NarInfo(STORE + hashlib.sha256(name.encode()).hexdigest()[:32] + "-" + name, url,
+                   "sha256:" + base32.encode(digest), len(data), compression, **fields)
+    (cache_dir / (info.store_path[len(STORE):len(STORE) + 32] + ".narinfo")).write_text(info.to_text())
+    return info
+
+
+def test_import_paths(tmp_path, monkeypatch, capsys):
+    cache_dir = tmp_path / "cache"
+    lib = _cache_entry(cache_dir, tmp_path, "lib", "none", sigs=["cache-1:AAAA"])
+    app = _cache_entry(cache_dir, tmp_path, "app", "xz", references=[lib.store_path],
+                       deriver=STORE + "d" * 32 + "-app.drv", ca="text:sha256:0abc")
+    old = _cache_entry(cache_dir, tmp_path, "old", "xz")
+    with FakeDaemon(tmp_path / "socket") as fake, daemon.DaemonPool(fake.socket_path) as pool:
+        fake.add_path(old.store_path)
+        monkeypatch.setattr(daemon, "_default_pool", pool)
+        monkeypatch.setattr(sys, "argv", ["pix", "import-paths", str(cache_dir)])
+        main.main()
+        out, err = capsys.readouterr()
+        assert out.split() == [lib.store_path, app.store_path]
+        assert "imported 2 paths (1 already valid)" in err
+        assert fake.ops.count(44) == 1
+        assert fake.nars[lib.store_path] == nar.nar_serialize(tmp_path / "src" / "lib")
+        assert fake.nars[app.store_path] == nar.nar_serialize(tmp_path / "src" / "app")
+        assert old.store_path not in fake.nars
+        stored = fake.store[app.store_path]
+        assert (stored.references, stored.deriver, stored.ca) == ([lib.store_path], app.deriver, app.ca)
+        assert (stored.registration_time, stored.nar_hash) == (0, app.nar_hash)
+        assert fake.store[lib.store_path].sigs == ["cache-1:AAAA"]
+
+
+@pytest.mark.parametrize("broken", ["zstd", "missing"])
+def test_import_paths_checks_nars_first(tmp_path, monkeypatch, broken):
+    cache_dir = tmp_path / "cache"
+    lib = _cache_entry(cache_dir, tmp_path, "lib", "none")
+    app = _cache_entry(cache_dir, tmp_path, "app", "none", references=[lib.store_path])
+    if broken == "zstd":
+        app.compression = "zstd"
+        (cache_dir / (app.store_path[len(STORE):len(STORE) + 32] + ".narinfo")).write_text(app.to_text())
+    else:
+        (cache_dir / app.url).unlink()
+    with FakeDaemon(tmp_path / "socket") as fake, daemon.DaemonPool(fake.socket_path, max_size=1) as pool:
+        monkeypatch.setattr(daemon, "_default_pool", pool)
+        monkeypatch.setattr(sys, "argv", ["pix", "import-paths", str(cache_dir)])
+        with pytest.raises(ValueError if broken == "zstd" else FileNotFoundError):
+            main.main()
+        assert 44 not in fake.ops
+        assert not fake.nars
+        with pool.checkout() as conn:
+            assert conn.query_valid_paths([lib.store_path]) == set()
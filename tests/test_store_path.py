@@ -1,6 +1,9 @@
 """Tests for store path computation."""
 
-from pix.store_path import make_text_store_path, make_source_store_path, make_store_path, STORE_DIR
+from pix.store_path import (
+    STORE_DIR, make_source_store_path, make_store_path, make_store_paths, make_text_store_path,
+    store_path_digest,
+)
 from pix.hash import sha256
 
 
@@ -44,3 +47,50 @@ def test_source_store_path_format():
     hash_part, name = rest.split("-", 1)
     assert len(hash_part) == 32
     assert name == "my-source"
+
+
+def test_compress_hash_matches_bytewise_fold():
+    import os
+    from pix.hash import compress_hash
+
+    for n in range(0, 70):
+        data = os.urandom(n)
+        for size in (1, 7, 20, 32):
+            expected = bytearray(size)
+            for i, b in enumerate(data):
+                expected[i % size] ^= b
+            assert compress_hash(data, size) == bytes(expected)
+
+
+def test_store_path_digest_matches_pipeline():
+    from pix.base32 import encode
+    from pix.hash import compress_hash
+
+    for i in range(200):
+        fp = f"text:sha256:{sha256(bytes([i])).hex()}:/nix/store:f{i}".encode()
+        assert store_path_digest(fp) == encode(compress_hash(sha256(fp), 20))
+
+
+def test_make_store_paths_batch():
+    items = [("source", sha256(bytes([i])), f"src-{i}") for i in range(50)]
+    assert make_store_paths(items) == [make_store_path(*item) for item in items]
+
+
+def test_cache_hits_misses_evictions():
+    from pix.store_path import cache_info, disable_cache, enable_cache, placeholder
+
+    h = sha256(b"x")
+    uncached = make_store_path("source", h, "a")
+    enable_cache(maxsize=2)
+    try:
+        assert make_store_path("source", h, "a") == uncached
+        assert make_store_path("source", h, "a") == uncached
+        make_store_path("source", h, "b")
+        make_store_path("source", h, "c")  # evicts "a"; placeholder evicts "b"
+        assert placeholder("out") == placeholder("out")
+        info = cache_info()
+        assert (info.hits, info.misses, info.evictions) == (2, 4, 2)
+        assert info.currsize == 2 and info.maxsize == 2
+    finally:
+        disable_cache()
+    assert cache_info().misses == 0